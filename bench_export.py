@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Measures how many blocks per second the postprocessor formats. The
+# postprocessor configurations are read from the configuration folder of
+# dxf2gcode, like dxf2gcode.py does.
+#
+
+"""
+Export micro-benchmark: formats the moves of the export with the compiled
+templates of a postprocessor configuration and with the replacement of the
+keywords one after another, and compares the blocks per second. Also
+compares formatting numbers one by one and as an array.
+"""
+
+import os
+import sys
+import time
+import getopt
+from math import pi
+
+import numpy as np
+
+from PyQt5.QtWidgets import QApplication
+
+import dxf2gcode.globals.globals as g
+
+g.folder = os.path.join(os.path.expanduser("~"), ".config/dxf2gcode").replace("\\", "/")
+
+from dxf2gcode.globals.config import MyConfig
+from dxf2gcode.core.point import Point
+from dxf2gcode.core.layercontent import Layers
+from dxf2gcode.postpro.breaks import Breaks
+from dxf2gcode.postpro.postprocessor import MyPostProcessor
+
+
+def replace_keywords(postpro):
+    """
+    The formatting before the templates were compiled: every keyword is
+    replaced in the whole string.
+    """
+    def make_print_str(keystr):
+        exstr = keystr
+        for key, formatter in postpro.keyvars.items():
+            exstr = exstr.replace(key, formatter())
+        return exstr
+    return make_print_str
+
+
+def moves(postpro):
+    """
+    The moves to format, each gets the number of the block.
+    """
+    return [("rap_pos_xy", lambda i: postpro.rap_pos_xy(Point(i * 0.37, i * 0.11))),
+            ("lin_pol_xy", lambda i: postpro.lin_pol_xy(postpro.lPe, Point(i * 0.37, 5.0 - i * 0.11))),
+            ("lin_pol_arc", lambda i: postpro.lin_pol_arc("cw", Point(i + 5.0, 0.0), Point(i, 5.0), 0.0, pi / 2, 5.0,
+                                                          Point(i, 0.0), Point(-5.0, 0.0), pi / 2)),
+            ("lin_pol_z", lambda i: postpro.lin_pol_z(-i * 0.001)),
+            ("rap_pos_z", lambda i: postpro.rap_pos_z(i * 0.001))]
+
+
+def blocks_per_second(move, blocks):
+    start = time.time()
+    for i in range(blocks):
+        move(i)
+    return blocks / max(time.time() - start, 1e-9)
+
+
+# Handle command line options
+try:
+    (opts, left) = getopt.getopt(sys.argv[1:], "hn:p:", ["help", "blocks=", "postpro="])
+except getopt.GetoptError as e:
+    print(e)
+    sys.exit(1)
+
+if left != list():
+    print("unrecognized name on command line:", left [0])
+    sys.exit(1)
+
+BLOCKS = 100000
+POSTPRO = 0
+
+for opt,val in opts:
+    if opt == "-h" or opt == "--help":
+        print ("""\
+Usage: %s [options]
+    -n --blocks N     Number of blocks formatted per move (default %i)
+    -p --postpro NR   Index of the postprocessor configuration (default %i)
+""" % (sys.argv[0], BLOCKS, POSTPRO))
+        sys.exit(1)
+    elif opt == "--blocks" or opt == "-n":
+        BLOCKS = int(val)
+    elif opt == "--postpro" or opt == "-p":
+        POSTPRO = int(val)
+
+g.config = MyConfig()
+app = QApplication(sys.argv)
+
+postpro = MyPostProcessor()
+postpro.getPostProVars(POSTPRO)
+postpro.breaks = Breaks(Layers())
+
+print("Postprocessor configuration: %s\n" % postpro.postprocessor_files[POSTPRO])
+print("%-12s %14s %14s %8s" % ("move", "replaced/s", "compiled/s", "speedup"))
+for name, move in moves(postpro):
+    postpro.initialize_export_vars()
+    postpro.make_print_str = replace_keywords(postpro)
+    replaced = blocks_per_second(move, BLOCKS)
+
+    postpro.initialize_export_vars()
+    del postpro.make_print_str
+    compiled = blocks_per_second(move, BLOCKS)
+    print("%-12s %14.0f %14.0f %7.1fx" % (name, replaced, compiled, compiled / replaced))
+
+numbers = np.linspace(-1000.0, 1000.0, BLOCKS)
+start = time.time()
+for number in numbers.tolist():
+    postpro.fnprint(number)
+single = BLOCKS / max(time.time() - start, 1e-9)
+start = time.time()
+postpro.fnprint_array(numbers)
+batch = BLOCKS / max(time.time() - start, 1e-9)
+print("\n%-12s %14s %14s %8s" % ("numbers", "fnprint/s", "array/s", "speedup"))
+print("%-12s %14.0f %14.0f %7.1fx" % ("", single, batch, batch / single))
@@ -7,10 +7,12 @@ SOURCES += \
     make_exe.py \
     make_py_uic.py \
     make_tr.py \
+    bench_export.py \
     setup.py \
     st-setup.py \
     dxf2gcode/__init__.py \
     dxf2gcode/core/__init__.py \
+    dxf2gcode/core/adaptiveclearing.py \
     dxf2gcode/core/arcgeo.py \
     dxf2gcode/core/point.py \
     dxf2gcode/core/boundingbox.py \
@@ -21,11 +23,15 @@ SOURCES += \
     dxf2gcode/core/intersect.py \
     dxf2gcode/core/layercontent.py \
     dxf2gcode/core/linegeo.py \
+    dxf2gcode/core/pocketmill.py \
+    dxf2gcode/core/pocketrings.py \
     dxf2gcode/core/point3d.py \
     dxf2gcode/core/project.py \
     dxf2gcode/core/shape.py \
+    dxf2gcode/core/shapeindex.py \
     dxf2gcode/core/shapeoffset.py \
     dxf2gcode/core/stmove.py \
+    dxf2gcode/core/zigzagpocket.py \
     dxf2gcode/globals/__init__.py \
     dxf2gcode/globals/config.py \
     dxf2gcode/globals/constants.py \
@@ -62,8 +68,15 @@ SOURCES += \
     dxf2gcode/dxfimport/spline_convert.py \
     dxf2gcode/postpro/__init__.py \
     dxf2gcode/postpro/breaks.py \
+    dxf2gcode/postpro/gcodewriter.py \
+    dxf2gcode/postpro/gridindex.py \
+    dxf2gcode/postpro/layersequencer.py \
     dxf2gcode/postpro/postprocessor.py \
     dxf2gcode/postpro/postprocessorconfig.py \
+    dxf2gcode/postpro/routecache.py \
+    dxf2gcode/postpro/tspdrilling.py \
+    dxf2gcode/postpro/tspislands.py \
+    dxf2gcode/postpro/tsplocalsearch.py \
     dxf2gcode/postpro/tspoptimisation.py
 
 DISTFILES += \
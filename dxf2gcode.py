@@ -29,6 +29,7 @@ from __future__ import division
 
 import argparse
 import logging
+import multiprocessing
 import os
 import subprocess
 import sys
@@ -53,8 +54,13 @@ from dxf2gcode.gui.aboutdialog import AboutDialog
 from dxf2gcode.gui.configwindow import ConfigWindow
 from dxf2gcode.gui.popupdialog import PopUpDialog
 from dxf2gcode.gui.treehandling import TreeHandler
+from dxf2gcode.postpro.layersequencer import LayerSequencer
 from dxf2gcode.postpro.postprocessor import MyPostProcessor
-from dxf2gcode.postpro.tspoptimisation import TspOptimization
+from dxf2gcode.postpro.routecache import RouteCache
+from dxf2gcode.postpro.tspdrilling import TspDrilling
+from dxf2gcode.postpro.tspislands import TspIslands
+from dxf2gcode.postpro.tsplocalsearch import TspLocalSearch
+from dxf2gcode.postpro.tspoptimisation import TspOptimization, optimize_route
 
 from PyQt5.QtWidgets import QMainWindow, QGraphicsView, QFileDialog, QApplication, QMessageBox
 from PyQt5.QtGui import QSurfaceFormat
@@ -108,6 +114,12 @@ class MainWindow(QMainWindow):
             self.canvas_scene = None
 
         self.TreeHandler = TreeHandler(self.ui)
+
+        # State of a running route optimization (see optimizeTSP)
+        self.TSP_running = False
+        self.TSP_accept = False
+        # The optimized routes of the layers
+        self.route_cache = RouteCache()
         self.configuration_changed.connect(self.TreeHandler.updateConfiguration)
 
         if sys.version_info[0] == 2:
@@ -269,6 +281,33 @@ class MainWindow(QMainWindow):
         self.ui.actionScaleAll.setEnabled(status)
         self.ui.actionMoveWorkpieceZero.setEnabled(status)
 
+    def enableEditing(self, status=True):
+        """
+        Enables or disables everything which replaces or changes the shapes,
+        their order or the settings, e.g. while the route is optimized (the
+        events are processed meanwhile to draw the intermediate routes).
+        @param status: True to enable, False to disable
+        """
+        # File
+        self.ui.actionOpen.setEnabled(status)
+
+        # Options
+        self.ui.actionConfiguration.setEnabled(status)
+        self.ui.actionConfigurationPostprocessor.setEnabled(status)
+        self.ui.actionSplitLineSegments.setEnabled(status)
+        self.ui.actionAutomaticCutterCompensation.setEnabled(status and g.config.machine_type == 'milling')
+
+        # Machine type and units
+        self.ui.actionMilling.setEnabled(status)
+        self.ui.actionDragKnife.setEnabled(status)
+        self.ui.actionLathe.setEnabled(status)
+        self.ui.actionMillimeters.setEnabled(status)
+        self.ui.actionInches.setEnabled(status)
+
+        # TreeViews and the context menu of the shapes
+        self.ui.mytabWidget.setEnabled(status)
+        self.canvas.setContextMenuPolicy(QtCore.Qt.DefaultContextMenu if status else QtCore.Qt.NoContextMenu)
+
     def deleteG0Paths(self):
         """
         Deletes the optimisation paths from the scene.
@@ -384,24 +423,66 @@ class MainWindow(QMainWindow):
     def optimizeTSP(self):
         """
         Method is called to optimize the order of the shapes. This is performed
-        by solving the TSP Problem.
+        by solving the TSP Problem. The intermediate routes are drawn while
+        the optimization runs; calling this method again meanwhile accepts
+        the current route of the layer.
         """
-        self.setCursor(QtCore.Qt.WaitCursor)
-        self.app.processEvents()
+        if self.TSP_running:
+            logger.info(self.tr("Accepting current route"))
+            self.TSP_accept = True
+            return
 
+        # The editing is enabled again even if the optimization fails, as
+        # otherwise the window stays locked
+        self.TSP_running = True
+        try:
+            self.enableToolbarButtons(False)
+            self.enableEditing(False)
+            self.ui.actionOptimizePaths.setEnabled(True)
+            self.setCursor(QtCore.Qt.WaitCursor)
+            self.app.processEvents()
+            self.optimizeRoutes()
+        finally:
+            self.TSP_running = False
+            self.TSP_accept = False
+            self.enableToolbarButtons(True)
+            self.enableEditing(True)
+            self.unsetCursor()
+
+    def optimizeRoutes(self):
+        """
+        Optimizes the routes of all layers, see optimizeTSP.
+        """
         logger.debug(self.tr('Optimize order of enabled shapes per layer'))
         self.canvas_scene.delete_opt_paths()
 
         # Get the export order from the QTreeView
         logger.debug(self.tr('Updating order according to TreeView'))
         self.TreeHandler.updateExportOrder()
+
+        x_st = g.config.vars.Plane_Coordinates['axis1_start_end']
+        y_st = g.config.vars.Plane_Coordinates['axis2_start_end']
+        sequence_layers = g.config.vars.Route_Optimisation['sequence_layers']
+        if sequence_layers:
+            self.sequenceLayers(Point(x_st, y_st))
         self.canvas_scene.addexproutest()
 
+        route_layers = [layerContent for layerContent in self.layerContents.non_break_layer_iter()
+                        if len(layerContent.exp_order)]
+        # Shapes which are not optimized either keep their order among the
+        # others, or are all placed before them
+        place_after = g.config.vars.Route_Optimisation['TSP_shape_order'] == 'CONSTRAIN_PLACE_AFTER'
+        # The layers whose routes are cached once all layers are done
+        optimized = []
         for layerContent in self.layerContents.non_break_layer_iter():
             # Initial values for the Lists to export.
+            shapes_placed_first = []
             shapes_to_write = []
             shapes_fixed_order = []
             shapes_st_en_points = []
+            shapes_candidates = []
+            optimize_start_points = g.config.vars.Route_Optimisation['algorithm'] == 'local_search' and\
+                g.config.vars.Route_Optimisation['optimize_start_points']
 
             # Check all shapes of Layer which shall be exported and create List for it.
             logger.debug(self.tr("Nr. of Shapes %s; Nr. of Shapes in Route %s")
@@ -410,13 +491,21 @@ class MainWindow(QMainWindow):
 
             for shape_nr in range(len(layerContent.exp_order)):
                 if not self.shapes[layerContent.exp_order[shape_nr]].send_to_TSP:
-                    shapes_fixed_order.append(shape_nr)
+                    if place_after:
+                        shapes_placed_first.append(layerContent.exp_order[shape_nr])
+                        continue
+                    shapes_fixed_order.append(len(shapes_to_write))
 
                 shapes_to_write.append(shape_nr)
-                if self.shapes[LayerContent.exp_order[shape_nr]].Pocket == True: 
-                    shapes_st_en_points.append(self.shapes[LayerContent.exp_order[shape_nr]].get_start_end_points(PPocket=True))
+                shapes_st_en_points.append(self.shapeStartEndPoints(self.shapes[layerContent.exp_order[shape_nr]]))
+                if self.shapes[layerContent.exp_order[shape_nr]].Pocket == True: 
+                    shapes_candidates.append(None)
                 else:
-                    shapes_st_en_points.append(self.shapes[LayerContent.exp_order[shape_nr]].get_start_end_points())
+                    # Drills are always started at their centre
+                    if optimize_start_points and not self.shapes[layerContent.exp_order[shape_nr]].Drill:
+                        shapes_candidates.append(self.shapes[layerContent.exp_order[shape_nr]].get_start_end_candidates())
+                    else:
+                        shapes_candidates.append(None)
                     
             # Perform Export only if the Number of shapes to export is bigger than 0
             if len(shapes_to_write) > 0:
@@ -425,40 +514,198 @@ class MainWindow(QMainWindow):
                 iter_ = min(g.config.vars.Route_Optimisation['max_iterations'], len(shapes_to_write) * 50)
 
                 # Adding the Start and End Points to the List.
-                x_st = g.config.vars.Plane_Coordinates['axis1_start_end']
-                y_st = g.config.vars.Plane_Coordinates['axis2_start_end']
-                start = Point(x_st, y_st)
-                ende = Point(x_st, y_st)
+                # The route begins at the end point and returns to the start point.
+                start, ende = self.routeEnds(layerContent, route_layers, shapes_placed_first)
                 shapes_st_en_points.append([start, ende])
-
-                TSPs = TspOptimization(shapes_st_en_points, shapes_fixed_order)
+                shapes_candidates.append(None)
+
+                # Reuse the route if nothing it depends on has changed
+                exp_order = [layerContent.exp_order[shape_nr] for shape_nr in shapes_to_write]
+                fixed_order = [exp_order[nr] for nr in shapes_fixed_order]
+                route_key = self.routeKey(exp_order, shapes_st_en_points[:-1], fixed_order,
+                                          shapes_placed_first, start, ende)
+                cached_order = self.route_cache.lookup(layerContent.nr, route_key)
+                if cached_order is not None:
+                    logger.info(self.tr("Using the cached route for Layer %s") % layerContent.name)
+                    layerContent.exp_order = cached_order
+                    continue
+
+                # Otherwise start with the cached route if most shapes are known
+                route = self.route_cache.warm_route(layerContent.nr, exp_order)
+                if route is not None:
+                    route = [len(exp_order)] + route
+
+                # Layers with points only, e.g. drill holes, take the fast path
+                drilling = len(shapes_fixed_order) == 0 and\
+                    all(self.shapes[nr].isPoint() for nr in exp_order)
+                if drilling:
+                    TSPs = TspDrilling(shapes_st_en_points, route=route)
+                elif g.config.vars.Route_Optimisation['algorithm'] == 'local_search':
+                    TSPs = TspLocalSearch(shapes_st_en_points, shapes_fixed_order,
+                                          candidates=shapes_candidates if optimize_start_points else None,
+                                          route=route)
+                elif g.config.vars.Route_Optimisation['islands'] > 1 and multiprocessing.cpu_count() > 1:
+                    TSPs = TspIslands(shapes_st_en_points, shapes_fixed_order, route=route)
+                else:
+                    TSPs = TspOptimization(shapes_st_en_points, shapes_fixed_order, route=route)
                 logger.info(self.tr("TSP start values initialised for Layer %s") % layerContent.name)
                 logger.debug(self.tr("Shapes to write: %s") % shapes_to_write)
                 logger.debug(self.tr("Fixed order: %s") % shapes_fixed_order)
 
-                for it_nr in range(iter_ // 50):
-                    TSPs.calc_next_iteration()
+                # The genetic algorithms do 50 generations per iteration
+                if not drilling and g.config.vars.Route_Optimisation['algorithm'] != 'local_search':
+                    iter_ //= 50
+
+                logger.info(self.tr("Trigger the optimization again to accept the current route"))
+                self.TSP_accept = False
+                optimize_route(TSPs, iter_,
+                               g.config.vars.Route_Optimisation['max_time'],
+                               g.config.vars.Route_Optimisation['max_stall_iterations'],
+                               lambda TSPs, improved: self.showTSPProgress(layerContent, shapes_placed_first,
+                                                                           exp_order, TSPs, improved))
 
                 logger.debug(self.tr("TSP done with result: %s") % TSPs)
 
-                layerContent.exp_order = [layerContent.exp_order[nr] for nr in TSPs.opt_route[1:]]
-                layerContent.optimize()
+                layerContent.exp_order = shapes_placed_first + [exp_order[nr] for nr in TSPs.opt_route[1:]]
+                if optimize_start_points and not drilling:
+                    start_points = TSPs.start_points()
+                    layerContent.optimize({exp_order[nr]: start_points[nr] for nr in range(len(exp_order))
+                                           if shapes_candidates[nr] is not None})
+                else:
+                    layerContent.optimize()
+
+                # A route accepted before the end of the optimization is not cached
+                if not self.TSP_accept:
+                    optimized.append((layerContent, exp_order, fixed_order, shapes_placed_first))
 
-                self.canvas_scene.addexproute(layerContent.exp_order, layerContent.nr)
+                self.updateExportRoute()
                 logger.debug(self.tr("New Export Order after TSP: %s") % layerContent.exp_order)
                 self.app.processEvents()
             else:
-                layerContent.exp_order = []
+                layerContent.exp_order = shapes_placed_first
+
+        # The start points of the shapes have been moved by optimize, also
+        # those the ends of the routes of other layers depend on, so the
+        # routes are stored with the points as they are now
+        for layerContent, exp_order, fixed_order, shapes_placed_first in optimized:
+            start, ende = self.routeEnds(layerContent, route_layers, shapes_placed_first)
+            st_en_points = [self.shapeStartEndPoints(self.shapes[nr]) for nr in exp_order]
+            self.route_cache.store(layerContent.nr,
+                                   self.routeKey(exp_order, st_en_points, fixed_order,
+                                                 shapes_placed_first, start, ende),
+                                   layerContent.exp_order)
 
-        if len(self.canvas_scene.routearrows) > 0:
-            self.ui.actionDeleteG0Paths.setEnabled(True)
-            self.canvas_scene.addexprouteen()
+        self.updateExportRoute()
 
         # Update order in the treeView, according to path calculation done by the TSP
         self.TreeHandler.updateTreeViewOrder()
-        self.canvas_scene.update()
 
-        self.unsetCursor()
+    def shapeStartEndPoints(self, shape):
+        """
+        Returns the points where the route enters and leaves a shape: the
+        ends of the toolpath of a pocket, the centre of a drill or the ends
+        of the contour.
+        @param shape: The shape
+        @return: Tuple of the start and end point
+        """
+        if shape.Pocket == True:
+            return shape.get_start_end_points(PPocket=True)
+        elif shape.Drill == True:
+            return shape.get_start_end_points(Drill=True)
+        return shape.get_start_end_points()
+
+    def routeEnds(self, layerContent, route_layers, placed_first):
+        """
+        Returns the points the route of a layer returns to and begins at: the
+        start position of the machine, or, if the layers are sequenced, the
+        end of the previous and the middle of the next layer milled with the
+        same tool. A route after shapes placed first begins at their end.
+        @param layerContent: The layer
+        @param route_layers: The layers with shapes to export in their order
+        @param placed_first: The numbers of the shapes placed before the route
+        @return: Tuple of the start and end point
+        """
+        start = Point(g.config.vars.Plane_Coordinates['axis1_start_end'],
+                      g.config.vars.Plane_Coordinates['axis2_start_end'])
+        ende = Point(start.x, start.y)
+        if g.config.vars.Route_Optimisation['sequence_layers']:
+            # Chain the routes of the layers which are milled with the same tool
+            layer_nr = route_layers.index(layerContent)
+            if layer_nr > 0 and route_layers[layer_nr - 1].tool_nr == layerContent.tool_nr:
+                last_shape = self.shapes[route_layers[layer_nr - 1].exp_order[-1]]
+                ende = last_shape.get_start_end_points(False, PPocket=last_shape.Pocket)
+            if layer_nr + 1 < len(route_layers) and route_layers[layer_nr + 1].tool_nr == layerContent.tool_nr:
+                next_points = [self.shapes[nr].get_start_end_points(True)
+                               for nr in route_layers[layer_nr + 1].exp_order]
+                start = Point(sum(p.x for p in next_points) / len(next_points),
+                              sum(p.y for p in next_points) / len(next_points))
+        if len(placed_first):
+            # The route continues after the shapes placed first
+            last_shape = self.shapes[placed_first[-1]]
+            ende = last_shape.get_start_end_points(False, PPocket=last_shape.Pocket)
+        return start, ende
+
+    def routeKey(self, exp_order, st_en_points, fixed_order, placed_first, start, ende):
+        """
+        Returns the key of the route cache for the shapes of a layer.
+        @param exp_order: The numbers of the shapes of the route
+        @param st_en_points: The start and end points of these shapes
+        @param fixed_order: The numbers of the shapes which keep their order
+        @param placed_first: The numbers of the shapes placed before the route
+        @param start: The point the route returns to
+        @param ende: The point the route begins at
+        @return: The key as string
+        """
+        return self.route_cache.key(exp_order, st_en_points, fixed_order, placed_first,
+                                    (start.x, start.y, ende.x, ende.y),
+                                    [g.config.vars.Route_Optimisation[name] for name in
+                                     ('algorithm', 'optimize_start_points', 'max_iterations',
+                                      'max_time', 'max_stall_iterations', 'max_population',
+                                      'mutation_rate', 'begin_art', 'islands', 'migration_interval')])
+
+    def sequenceLayers(self, start):
+        """
+        Orders the layers such that layers which are milled with the same
+        tool follow each other, and updates the TreeView accordingly.
+        @param start: The start point of the machine
+        """
+        layers = [layerContent for layerContent in self.layerContents.non_break_layer_iter()
+                  if len(layerContent.exp_order)]
+        tools = [layerContent.tool_nr for layerContent in layers]
+        points = [[self.shapes[shape_nr].get_start_end_points(True) for shape_nr in layerContent.exp_order]
+                  for layerContent in layers]
+        # Layers without shapes for the TSP optimization or with custom G-code keep their order
+        order = [nr for nr, layerContent in enumerate(layers)
+                 if not any(self.shapes[shape_nr].send_to_TSP for shape_nr in layerContent.exp_order) or
+                 len(layerContent.exp_order_complete) > len(layerContent.exp_order)]
+        tool_change_cost = g.config.vars.Route_Optimisation['tool_change_time'] *\
+            g.config.vars.Route_Optimisation['rapid_feed'] / 60
+
+        sequencer = LayerSequencer(tools, points, order, start, tool_change_cost)
+        logger.debug(self.tr("Layer sequence: %s") % sequencer)
+
+        # The sequenced layers take the places of the layers with shapes to export
+        slots = [nr for nr, layerContent in enumerate(self.layerContents) if layerContent in layers]
+        for slot, layer_nr in zip(slots, sequencer.opt_route):
+            self.layerContents[slot] = layers[layer_nr]
+        self.TreeHandler.updateTreeViewLayerOrder()
+
+    def showTSPProgress(self, layerContent, placed_first, exp_order, TSPs, improved):
+        """
+        Draws the intermediate route of a running optimization and handles
+        the events of the GUI meanwhile.
+        @param layerContent: The layer whose shapes are optimized
+        @param placed_first: The shapes which are placed before the route
+        @param exp_order: The shapes of the route before the optimization
+        @param TSPs: The running optimization
+        @param improved: True if the route has become shorter since the last call
+        @return: True if the current route shall be accepted
+        """
+        if improved:
+            layerContent.exp_order = placed_first + [exp_order[nr] for nr in TSPs.opt_route[1:]]
+            self.updateExportRoute()
+        self.app.processEvents()
+        return self.TSP_accept
 
     def automaticCutterCompensation(self):
         if self.ui.actionAutomaticCutterCompensation.isEnabled() and\
@@ -935,6 +1182,7 @@ class MainWindow(QMainWindow):
                                         sca=[self.cont_scale, self.cont_scale, self.cont_scale], rot=self.cont_rotate)
         self.layerContents = Layers([])
         self.shapes = Shapes([])
+        self.route_cache.clear()
 
         self.makeEntityShapes(self.entityRoot)
 
@@ -1146,6 +1394,9 @@ if __name__ == "__main__":
     """
     The main function which is executed after program start.
     """
+    # Needed by the processes of the TSP islands in frozen executables
+    multiprocessing.freeze_support()
+
     Log = LoggerClass(logger)
 
     g.config = MyConfig()
@@ -0,0 +1,910 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+from math import ceil, cos, floor, sqrt, pi, radians
+import logging
+
+import numpy as np
+
+from dxf2gcode.core.linegeo import LineGeo
+from dxf2gcode.core.arcgeo import ArcGeo
+from dxf2gcode.core.point import Point
+from dxf2gcode.core.shapeoffset import offShapeClass
+from dxf2gcode.core.shapeindex import polygon_points
+from dxf2gcode.core.pocketmill import PocketMill
+
+logger = logging.getLogger('core.adaptiveclearing')
+
+# Number of samples on the circumference of the tool used to measure the
+# engagement angle
+engagement_samples = 72
+
+# Maximum number of cells of the material grid
+max_grid_cells = 4000000
+
+# The tool moves in one of engagement_samples headings, so that a heading is
+# also the angle of a sample. Changes of the heading tried for the next step
+# (-150 to 150 degrees):
+step_turns = np.arange(-30, 31)
+
+# Maximal length of a link through the cleared material in tool radii;
+# starts which are farther away are reached with a lift
+max_link = 16.0
+
+# Neighbours of a cell for the search of links
+neighbours = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+class MaterialGrid(object):
+    """
+    Boolean raster of the material which is left in the pocket. A cell is True
+    as long as it contains material. The tool removes all cells whose centre
+    lies within its radius.
+    """
+
+    def __init__(self, Ps, Pe, tool_rad, resolution):
+        """
+        Standard method to initialize the class
+        @param Ps: Lower left corner of the region to simulate
+        @param Pe: Upper right corner of the region to simulate
+        @param tool_rad: The radius of the tool
+        @param resolution: The edge length of a cell
+        """
+        margin = tool_rad + 2 * resolution
+        self.x0 = Ps.x - margin
+        self.y0 = Ps.y - margin
+        self.h = resolution
+        self.nx = int(ceil((Pe.x - Ps.x + 2 * margin) / resolution)) + 1
+        self.ny = int(ceil((Pe.y - Ps.y + 2 * margin) / resolution)) + 1
+        self.material = np.zeros((self.ny, self.nx), dtype=bool)
+
+        # Cells covered by the tool relative to the cell of its centre
+        self.disk = self.disk_kernel(tool_rad)
+        self.disk_m = m = self.disk.shape[0] // 2
+
+        # Samples just inside of the cutting edge, relative to the cell of the
+        # centre (as offsets in the flattened grid). Before the material at a
+        # position is removed, they show where the edge cuts.
+        self.edge_angles = np.linspace(0.0, 2 * pi, engagement_samples, endpoint=False)
+        edge = tool_rad - 0.75 * resolution
+        edge_rows = np.rint(edge * np.sin(self.edge_angles) / resolution).astype(int)
+        edge_cols = np.rint(edge * np.cos(self.edge_angles) / resolution).astype(int)
+        self.edge_index = edge_rows * self.nx + edge_cols
+
+        # The same samples as kernel for engagement maps of the whole grid
+        k = m + 1
+        self.edge_kernel = np.zeros((2 * k + 1, 2 * k + 1))
+        np.add.at(self.edge_kernel, (edge_rows + k, edge_cols + k), 1)
+
+    def disk_kernel(self, radius):
+        """
+        Returns the cells within the radius around a cell.
+        @param radius: The radius
+        @return: Boolean array of odd size; its centre is the cell itself
+        """
+        m = int(ceil(radius / self.h))
+        d = np.arange(-m, m + 1) * self.h
+        return d[:, np.newaxis] ** 2 + d[np.newaxis, :] ** 2 <= radius ** 2
+
+    def polygon_mask(self, points):
+        """
+        Rasterizes a closed polygon with the crossing number method. The
+        crossings of every edge are computed per row and a cell is inside if
+        an odd number of crossings lies to its left.
+        @param points: The points of the polygon
+        @return: Boolean array with the shape of the grid
+        """
+        xs = np.array([point.x for point in points])
+        ys = np.array([point.y for point in points])
+
+        row_y = self.y0 + np.arange(self.ny) * self.h
+        toggles = np.zeros((self.ny, self.nx + 1), dtype=np.int32)
+        for ax, ay, bx, by in zip(xs, ys, np.roll(xs, -1), np.roll(ys, -1)):
+            rows = np.nonzero((row_y > ay) != (row_y > by))[0]
+            if len(rows) == 0:
+                continue
+            x = ax + (row_y[rows] - ay) * (bx - ax) / (by - ay)
+            cols = np.clip(np.ceil((x - self.x0) / self.h), 0, self.nx).astype(int)
+            np.add.at(toggles, (rows, cols), 1)
+        return np.cumsum(toggles[:, :-1], axis=1) % 2 == 1
+
+    def correlate(self, array, kernel, rows=None, cols=None):
+        """
+        Correlates an array with the shape of the grid with a kernel of odd
+        size (using FFT).
+        @param array: Array with the shape of the grid
+        @param kernel: The kernel; its centre is the cell itself
+        @param rows: Optional range of rows to which the result is limited
+        @param cols: Optional range of columns to which the result is limited
+        @return: Array of the kernel weighted sums around every cell
+        """
+        r0, r1 = rows or (0, self.ny)
+        c0, c1 = cols or (0, self.nx)
+        kh, kw = kernel.shape
+        mh, mw = kh // 2, kw // 2
+
+        # The window plus the margin the kernel reaches into
+        padded = np.zeros((r1 - r0 + 2 * mh, c1 - c0 + 2 * mw))
+        a0, a1 = max(r0 - mh, 0), min(r1 + mh, self.ny)
+        b0, b1 = max(c0 - mw, 0), min(c1 + mw, self.nx)
+        padded[a0 - r0 + mh:a1 - r0 + mh, b0 - c0 + mw:b1 - c0 + mw] = array[a0:a1, b0:b1]
+
+        shape = (padded.shape[0] + kh - 1, padded.shape[1] + kw - 1)
+        full = np.fft.irfft2(np.fft.rfft2(padded, shape) *
+                             np.fft.rfft2(kernel[::-1, ::-1], shape), shape)
+        return full[2 * mh:2 * mh + r1 - r0, 2 * mw:2 * mw + c1 - c0]
+
+    def material_window(self, margin):
+        """
+        Returns the bounding box of the remaining material, enlarged by a
+        margin.
+        @param margin: The margin in cells
+        @return: The ranges of rows and columns or None if no material is left
+        """
+        rows = np.flatnonzero(self.material.any(axis=1))
+        if len(rows) == 0:
+            return None
+        cols = np.flatnonzero(self.material.any(axis=0))
+        return ((max(rows[0] - margin, 0), min(rows[-1] + margin + 1, self.ny)),
+                (max(cols[0] - margin, 0), min(cols[-1] + margin + 1, self.nx)))
+
+    def cell(self, x, y):
+        """
+        Returns the row and column of the cell containing the point.
+        """
+        return (int(round((y - self.y0) / self.h)),
+                int(round((x - self.x0) / self.h)))
+
+    def index(self, xs, ys):
+        """
+        Returns the indices of the cells containing the points given as
+        coordinate arrays, in the flattened grid. Use them with take(...,
+        mode='clip').
+        """
+        return (np.rint((ys - self.y0) / self.h).astype(int) * self.nx +
+                np.rint((xs - self.x0) / self.h).astype(int))
+
+    def point(self, row, col):
+        """
+        Returns the centre of a cell.
+        """
+        return Point(self.x0 + col * self.h, self.y0 + row * self.h)
+
+    def edge_material(self, xs, ys):
+        """
+        Looks up the material on the cutting edge for several tool positions.
+        @param xs: Array of the x coordinates of the tool positions
+        @param ys: Array of the y coordinates of the tool positions
+        @return: Boolean array (positions x engagement_samples)
+        """
+        index = self.index(xs, ys)[:, np.newaxis] + self.edge_index
+        return self.material.take(index, mode='clip')
+
+    def engagement(self, x, y):
+        """
+        Measures the engagement angle of the tool at the given position, i.e.
+        the part of the cutting edge which is in contact with material. Call
+        it before the material at the position is removed.
+        @return: The engagement angle in degrees
+        """
+        material = self.edge_material(np.array([x]), np.array([y]))
+        return 360.0 * np.count_nonzero(material) / engagement_samples
+
+    def disk_window(self, x, y):
+        """
+        Returns the window of the grid around the tool at the given position
+        and the part of the disk kernel within it.
+        @return: The slices of the window and the disk
+        """
+        row, col = self.cell(x, y)
+        m = self.disk_m
+        r0, r1 = max(row - m, 0), max(min(row + m + 1, self.ny), 0)
+        c0, c1 = max(col - m, 0), max(min(col + m + 1, self.nx), 0)
+        return ((slice(r0, r1), slice(c0, c1)),
+                self.disk[r0 - row + m:r1 - row + m, c0 - col + m:c1 - col + m])
+
+    def remove(self, x, y):
+        """
+        Removes the material covered by the tool at the given position.
+        @return: The number of removed cells
+        """
+        window, disk = self.disk_window(x, y)
+        removed = np.count_nonzero(self.material[window] & disk)
+        self.material[window] &= ~disk
+        return removed
+
+
+class EngagementStats(object):
+    """
+    Engagement angles which were measured along one pass of the toolpath.
+    """
+
+    def __init__(self, nr, entry=False, finish=False):
+        """
+        Standard method to initialize the class
+        @param nr: The number of the pass
+        @param entry: True for an entry spiral, which starts in full material
+        @param finish: True for a finishing pass along the walls
+        """
+        self.nr = nr
+        self.entry = entry
+        self.finish = finish
+        self.samples = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.violations = 0
+
+    def add(self, angle, limit):
+        self.samples += 1
+        self.sum += angle
+        self.max = max(self.max, angle)
+        if angle > limit:
+            self.violations += 1
+
+    @property
+    def mean(self):
+        return self.sum / self.samples if self.samples else 0.0
+
+    def __str__(self):
+        return ("%s %i: engagement max %0.1f, mean %0.1f deg, %i of %i samples above limit" %
+                ("Entry" if self.entry else "Finish" if self.finish else "Pass",
+                 self.nr, self.max, self.mean, self.violations, self.samples))
+
+
+class AdaptiveClearing(object):
+    """
+    Pocketing with a bounded radial engagement angle. The removed material is
+    simulated on a MaterialGrid. The tool enters with a spiral at the deepest
+    point of the pocket and then follows the border of the remaining material:
+    every step goes into the direction with the highest engagement which does
+    not exceed the limit and keeps the material on the side given by the
+    milling direction. When no material is left next to the tool, the next
+    pass starts at the nearest position within the limit; the tool moves there
+    through the cleared material if it can, otherwise it lifts. The passes are
+    approximated by lines and arcs. Finally the walls and islands are finished
+    with a contour pass. Since the
+    engagement stays bounded, the plane feed rate (f_g1_plane) may be raised
+    compared to conventional pocketing.
+
+    No step of a pass exceeds the engagement limit. Material which cannot be
+    reached within the limit (e.g. a slot narrower than the tool path) is
+    entered with a new spiral, like the pocket itself. The finishing passes
+    are not limited: in a corner the tool touches both walls, so there the
+    engagement depends on the angle of the corner.
+    """
+
+    def __init__(self, shape, tool_rad, stepover, islands=None, max_engagement=90.0):
+        """
+        Standard method to initialize the class
+        @param shape: The closed shape which shall be pocketed
+        @param tool_rad: The radius of the tool
+        @param stepover: Maximal pitch of the entry spiral
+        @param islands: Closed shapes within the pocket which shall be spared
+        @param max_engagement: The maximal engagement angle in degrees
+        """
+        self.shape = shape
+        self.tool_rad = tool_rad
+        self.islands = islands or []
+        self.max_engagement = max_engagement
+
+        shape.calc_bounding_box()
+        size = max(shape.BB.Pe.x - shape.BB.Ps.x, shape.BB.Pe.y - shape.BB.Ps.y) + 2 * tool_rad
+        self.resolution = max(tool_rad / 10, size / sqrt(max_grid_cells))
+        self.step = 2 * self.resolution
+
+        # Radial depth of a straight cut at the engagement limit
+        self.stepover = min(stepover, tool_rad * (1 - cos(radians(min(max_engagement, 180.0)))))
+        self.stats = []
+
+        # Highest number of samples which may touch material
+        self.max_samples = int(floor(max_engagement * engagement_samples / 360.0 + 1e-9))
+
+        # The steps into every heading, and the side of every sample relative
+        # to every heading
+        angles = np.linspace(0.0, 2 * pi, engagement_samples, endpoint=False)
+        self.step_dx = self.step * np.cos(angles)
+        self.step_dy = self.step * np.sin(angles)
+        self.side = np.sin(angles[np.newaxis, :] - angles[:, np.newaxis])
+
+    def init_grid(self):
+        """
+        Creates the material grid of the pocket and the masks of the positions
+        the centre of the tool may reach. While clearing, the tool keeps one
+        cell of distance to the walls, which covers the rounding to cells; the
+        remaining sliver is cut by the finishing pass along the walls and
+        is kept aside in self.rest until then.
+        """
+        grid = MaterialGrid(self.shape.BB.Ps, self.shape.BB.Pe,
+                            self.tool_rad, self.resolution)
+        grid.material = grid.polygon_mask(polygon_points(self.shape.geos.abs_iter()))
+        for island in self.islands:
+            grid.material &= ~grid.polygon_mask(polygon_points(island.geos.abs_iter()))
+
+        self.grid = grid
+        self.inside = self.offset_mask(self.tool_rad)
+        self.allowed = self.offset_mask(self.tool_rad + self.resolution)
+        self.tried = np.zeros_like(self.allowed)
+
+        reach = grid.correlate(self.allowed, grid.disk)
+        self.rest = grid.material & (reach < 0.5)
+        grid.material &= ~self.rest
+
+    def offset_mask(self, distance):
+        """
+        Returns the mask of the cells which keep at least the given distance
+        to the walls of the pocket and to the islands.
+        @param distance: The distance
+        @return: Boolean array with the shape of the grid
+        """
+        grid = self.grid
+        offshape = offShapeClass(parent=self.shape, offset=distance, offtype='in')
+        mask = grid.polygon_mask(polygon_points(offshape.rawoff))
+        for island in self.islands:
+            offshape = offShapeClass(parent=island, offset=distance, offtype='out')
+            if len(offshape.rawoff):
+                mask &= ~grid.polygon_mask(polygon_points(offshape.rawoff))
+            else:
+                logger.warning("Offset of island %s failed" % island.nr)
+                mask &= ~grid.polygon_mask(polygon_points(island.geos.abs_iter()))
+        return mask
+
+    def toolpath(self, direction=-1):
+        """
+        Generator which yields the adaptive toolpath of the pocket. The
+        engagement statistics of every pass are stored in self.stats.
+        @param direction: -1 for CW, 1 for CCW
+        @return: Yields the geometries of the toolpath and Points for lifts
+        """
+        self.stats = []
+        self.init_grid()
+        if not self.allowed.any():
+            logger.warning("Tool is too big for the pocket of shape %s" % self.shape.nr)
+            return
+
+        stats = EngagementStats(0, entry=True)
+        self.stats.append(stats)
+        centre, radius = self.entry_point(self.allowed)
+        self.plunge(centre, stats)
+        points, heading = self.entry_spiral(centre, radius, direction, stats)
+        for geo in self.clear([centre] + points, heading, direction, stats):
+            yield geo
+
+        for geo in self.finish(self.pos, direction):
+            yield geo
+
+        passes = [stats for stats in self.stats if not stats.entry and not stats.finish]
+        finish = [stats for stats in self.stats if stats.finish]
+        logger.info("Adaptive pocket of shape %s: %i passes, %i entries, max. engagement %0.1f deg"
+                    " (limit %0.1f deg), %i samples above limit" %
+                    (self.shape.nr, len(passes), len(self.stats) - len(passes) - len(finish),
+                     max([s.max for s in passes] + [0.0]), self.max_engagement,
+                     sum(s.violations for s in passes)))
+        if any(s.violations for s in finish):
+            logger.info("Adaptive pocket of shape %s: finishing passes exceed the limit in"
+                        " %i samples (max. %0.1f deg)" %
+                        (self.shape.nr, sum(s.violations for s in finish),
+                         max(s.max for s in finish)))
+
+    def clear(self, points, heading, direction, stats):
+        """
+        Generator which yields the passes which clear the material within
+        reach of self.allowed. The final position is stored in self.pos.
+        @param points: The points of the current pass so far
+        @param heading: The current heading (None at the start of a pass)
+        @param direction: -1 for CW, 1 for CCW
+        @param stats: The EngagementStats of the current pass
+        @return: Yields the geometries of the passes and Points for lifts
+        """
+        while True:
+            more, heading = self.follow(points[-1], heading, direction, stats)
+            points += more[1:]
+            if len(more) == 1:
+                # Nothing can be cut within the limit around here; do not
+                # start passes next to this position again
+                window, disk = self.grid.disk_window(more[0].x, more[0].y)
+                self.tried[window] |= disk
+            for geo in fit_geos(points, self.resolution / 4):
+                yield geo
+            logger.debug("Shape %s: %s" % (self.shape.nr, stats))
+
+            # A pass starts where the engagement is within the limit; material
+            # which cannot be reached like this is entered with a new spiral
+            start = self.next_start(points[-1], direction)
+            entry = start is None
+            if entry:
+                start, radius = self.reentry_point()
+                if start is None:
+                    break
+
+            stats = EngagementStats(len(self.stats), entry=entry)
+            self.stats.append(stats)
+            link = self.link_path(points[-1], start, self.allowed)
+            if link is None:
+                yield Point(start.x, start.y)
+                self.plunge(start, stats)
+                points = [start]
+            else:
+                points = [points[-1]]
+                for point in link:
+                    points += self.cut_line(points[-1], point, stats)
+
+            if entry:
+                spiral, heading = self.entry_spiral(start, radius, direction, stats)
+                points += spiral
+            else:
+                heading = None
+
+        self.pos = points[-1]
+
+    def finish(self, pos, direction):
+        """
+        Generator which yields the finishing passes along the walls of the
+        pocket and around the islands.
+        @param pos: The current position of the tool
+        @param direction: -1 for CW, 1 for CCW
+        @return: Yields the geometries of the passes and Points for lifts
+        """
+        self.grid.material |= self.rest
+        walls = PocketMill(self.shape, self.tool_rad, self.stepover, self.islands, max_rings=1)
+        for link, loop in walls.passes(direction):
+            stats = EngagementStats(len(self.stats), finish=True)
+            self.stats.append(stats)
+
+            if link is None:
+                if loop[0].Ps.distance(loop[-1].Pe) < 1e-6:
+                    nearest_nr = min(range(len(loop)),
+                                     key=lambda nr: loop[nr].Ps.distance(pos))
+                    loop = loop[nearest_nr:] + loop[:nearest_nr]
+                corners = self.link_path(pos, loop[0].Ps, self.inside)
+                if corners is None:
+                    link = Point(loop[0].Ps.x, loop[0].Ps.y)
+                else:
+                    link = [LineGeo(Ps, Pe) for Ps, Pe in zip([pos] + corners[:-1], corners)]
+            elif not isinstance(link, Point):
+                link = [link]
+
+            if isinstance(link, Point):
+                self.plunge(link, stats)
+                yield link
+            else:
+                for geo in link:
+                    self.cut_line(geo.Ps, geo.Pe, stats)
+                    yield geo
+
+            for geo in loop:
+                self.cut_geo(geo, stats)
+                yield geo
+            pos = loop[-1].Pe
+
+    def entry_point(self, region, origin=(0, 0)):
+        """
+        Searches the deepest point of a region, i.e. the cell which is
+        farthest from its border, as centre of an entry spiral.
+        @param region: Boolean array of a window of the grid
+        @param origin: The first row and column of the window
+        @return: The centre and the radius of the spiral
+        """
+        depth = 0
+        deepest = region
+        while True:
+            eroded = deepest.copy()
+            eroded[1:, :] &= deepest[:-1, :]
+            eroded[:-1, :] &= deepest[1:, :]
+            eroded[:, 1:] &= deepest[:, :-1]
+            eroded[:, :-1] &= deepest[:, 1:]
+            if not eroded.any():
+                break
+            deepest = eroded
+            depth += 1
+
+        cells = np.argwhere(deepest)
+        row, col = cells[len(cells) // 2] + origin
+        self.tried[row, col] = True
+        return self.grid.point(row, col), min(self.tool_rad, depth * self.resolution / sqrt(2))
+
+    def reentry_point(self):
+        """
+        Searches the centre of a new entry spiral when no pass can start
+        within the engagement limit: the deepest point of the allowed
+        positions where the tool would cut material.
+        @return: The centre and the radius of the spiral, or None and 0 if the
+        tool cannot reach any more material
+        """
+        grid = self.grid
+        window = grid.material_window(grid.disk_m)
+        if window is None:
+            return None, 0.0
+        (r0, r1), (c0, c1) = window
+        region = self.allowed[r0:r1, c0:c1] & ~self.tried[r0:r1, c0:c1] &\
+            (grid.correlate(grid.material, grid.disk, *window) > 1.5)
+        if not region.any():
+            return None, 0.0
+        return self.entry_point(region, (r0, c0))
+
+    def plunge(self, point, stats):
+        """
+        Simulates the tool moving down at a point after a lift.
+        @param point: The point
+        @param stats: The EngagementStats of the current pass
+        """
+        stats.add(self.grid.engagement(point.x, point.y), self.max_engagement)
+        self.grid.remove(point.x, point.y)
+
+    def entry_spiral(self, centre, radius, direction, stats):
+        """
+        Creates an Archimedean spiral around the centre, at which the tool
+        already is. The pitch is the stepover; the spiral ends with a full
+        circle at the given radius.
+        @param centre: The centre of the spiral
+        @param radius: The final radius
+        @param direction: -1 for CW, 1 for CCW
+        @param stats: The EngagementStats of the entry
+        @return: The points of the spiral (without the centre) and the
+        heading at its end
+        """
+        grid = self.grid
+        pitch = max(min(self.stepover, radius), self.resolution)
+
+        points = []
+        ang = 0.0
+        end_ang = 2 * pi * (radius / pitch + 1)
+        while radius > 0 and ang < end_ang:
+            ang += self.step / max(min(pitch * ang / (2 * pi), radius), self.step)
+            point = centre.get_arc_point(direction * ang, min(pitch * ang / (2 * pi), radius))
+            stats.add(grid.engagement(point.x, point.y), self.max_engagement)
+            grid.remove(point.x, point.y)
+            points.append(point)
+
+        heading = direction * (ang + pi / 2) * engagement_samples / (2 * pi)
+        return points, int(round(heading)) % engagement_samples
+
+    def choose_step(self, pos, heading, direction):
+        """
+        Chooses the next step of the tool: the allowed heading with the
+        highest engagement which touches material without exceeding the
+        limit. Headings which keep the material on the side given by the
+        milling direction are preferred, and of equal ones the straightest.
+        @param pos: The current position
+        @param heading: The current heading (None at the start of a pass)
+        @param direction: -1 for CW (material on the left), 1 for CCW
+        @return: The new position, its heading and the number of samples
+        touching material, or None if there is no such heading
+        """
+        grid = self.grid
+        if heading is None:
+            headings = np.arange(engagement_samples)
+        else:
+            headings = (heading + step_turns) % engagement_samples
+        xs = pos.x + self.step_dx[headings]
+        ys = pos.y + self.step_dy[headings]
+
+        index = grid.index(xs, ys)
+        material = grid.material.take(index[:, np.newaxis] + grid.edge_index, mode='clip')
+        counts = np.count_nonzero(material, axis=1)
+        gentle = self.allowed.take(index, mode='clip') & (counts > 0) & (counts <= self.max_samples)
+        if not gentle.any():
+            return None
+
+        side = self.side[headings] * direction
+        valid = gentle & (np.count_nonzero(material & (side > 0.2), axis=1) <=
+                          np.count_nonzero(material & (side < -0.2), axis=1))
+        if not valid.any():
+            valid = gentle
+        score = np.where(valid, counts, -1.0)
+        if heading is not None:
+            score -= np.abs(step_turns) / 1000.0
+        nr = int(np.argmax(score))
+        return Point(xs[nr], ys[nr]), int(headings[nr]), int(counts[nr])
+
+    def follow(self, pos, heading, direction, stats):
+        """
+        Moves the tool along the border of the remaining material as long as
+        there is material next to the tool. The pass ends with the last step
+        which removes material.
+        @param pos: The start position
+        @param heading: The current heading (None at the start of a pass)
+        @param direction: -1 for CW (material on the left), 1 for CCW
+        @param stats: The EngagementStats of the current pass
+        @return: The visited points and the final heading
+        """
+        grid = self.grid
+        points = [pos]
+        max_idle = int(ceil(2 * self.tool_rad / self.step))
+
+        # Steps which remove no material are kept only if the pass continues
+        # to remove material afterwards
+        idle = []
+        last_heading = heading
+        while len(idle) <= max_idle:
+            step = self.choose_step(pos, heading, direction)
+            if step is None:
+                break
+            pos, heading, counts = step
+            idle.append((pos, 360.0 * counts / engagement_samples))
+            if grid.remove(pos.x, pos.y):
+                for point, angle in idle:
+                    stats.add(angle, self.max_engagement)
+                    points.append(point)
+                idle = []
+                last_heading = heading
+
+        return points, last_heading
+
+    def next_start(self, pos, direction):
+        """
+        Searches the start of the next pass: the allowed position nearest to
+        pos whose tool touches material without exceeding the engagement
+        limit, and from which the first step is within the limit too. The
+        search starts in a window around pos, then around the nearest
+        material, and covers all of the material only if these windows
+        contain no such position.
+        @param pos: The current position of the tool
+        @param direction: -1 for CW, 1 for CCW
+        @return: The start point or None if there is none
+        """
+        grid = self.grid
+        window = grid.material_window(grid.disk_m + 1)
+        if window is None:
+            return None
+
+        row, col = grid.cell(pos.x, pos.y)
+        material = np.argwhere(grid.material[window[0][0]:window[0][1],
+                                             window[1][0]:window[1][1]])
+        nearest = material[np.argmin((material[:, 0] + window[0][0] - row) ** 2 +
+                                     (material[:, 1] + window[1][0] - col) ** 2)]
+        size = 4 * grid.disk_m
+        windows = [((max(r - size, 0), min(r + size + 1, grid.ny)),
+                    (max(c - size, 0), min(c + size + 1, grid.nx)))
+                   for r, c in ((row, col), (nearest[0] + window[0][0], nearest[1] + window[1][0]))]
+
+        for rows, cols in windows + [window]:
+            counts = grid.correlate(grid.material, grid.edge_kernel, rows, cols)
+            gentle = (self.allowed[rows[0]:rows[1], cols[0]:cols[1]] &
+                      ~self.tried[rows[0]:rows[1], cols[0]:cols[1]] &
+                      (counts > 1.5) & (counts < self.max_samples + 0.5))
+            cells = np.argwhere(gentle) + (rows[0], cols[0])
+            for nr in np.argsort((cells[:, 0] - row) ** 2 + (cells[:, 1] - col) ** 2):
+                self.tried[cells[nr, 0], cells[nr, 1]] = True
+                start = grid.point(*cells[nr])
+                if self.choose_step(start, None, direction) is not None:
+                    return start
+        return None
+
+    def link_path(self, Ps, Pe, mask):
+        """
+        Searches a move from Ps to Pe within the mask along which the
+        engagement stays within the limit: the straight line if it is clear,
+        otherwise the shortest path through the cells where the tool touches
+        little enough material, straightened where the lines are clear.
+        @param Ps: The start point
+        @param Pe: The end point
+        @param mask: The mask of the allowed positions
+        @return: The corners of the move (without Ps) or None if the tool
+        has to lift
+        """
+        if self.link_is_clear(Ps, Pe, mask):
+            return [Pe]
+        if Ps.distance(Pe) > max_link * self.tool_rad:
+            return None
+
+        grid = self.grid
+        (r0, c0), (r1, c1) = grid.cell(Ps.x, Ps.y), grid.cell(Pe.x, Pe.y)
+        m = 2 * grid.disk_m
+        rows = (max(min(r0, r1) - m, 0), min(max(r0, r1) + m + 1, grid.ny))
+        cols = (max(min(c0, c1) - m, 0), min(max(c0, c1) + m + 1, grid.nx))
+        counts = grid.correlate(grid.material, grid.edge_kernel, rows, cols)
+        free = mask[rows[0]:rows[1], cols[0]:cols[1]] & (counts < self.max_samples + 0.5)
+        start, goal = (r0 - rows[0], c0 - cols[0]), (r1 - rows[0], c1 - cols[0])
+        free[start] = free[goal] = True
+
+        # Breadth-first search; fronts[nr] holds the cells nr steps away
+        front = np.zeros_like(free)
+        front[start] = True
+        reached = front.copy()
+        fronts = [front]
+        while not reached[goal]:
+            grown = front.copy()
+            grown[1:, :] |= front[:-1, :]
+            grown[:-1, :] |= front[1:, :]
+            grown[:, 1:] |= grown[:, :-1]
+            grown[:, :-1] |= grown[:, 1:]
+            front = grown & free & ~reached
+            if not front.any():
+                return None
+            reached |= front
+            fronts.append(front)
+
+        path = [goal]
+        for front in reversed(fronts[:-1]):
+            row, col = path[-1]
+            for dr, dc in neighbours:
+                if 0 <= row + dr < free.shape[0] and 0 <= col + dc < free.shape[1] and\
+                        front[row + dr, col + dc]:
+                    path.append((row + dr, col + dc))
+                    break
+        points = [Ps] + [grid.point(row + rows[0], col + cols[0])
+                         for row, col in reversed(path[1:-1])] + [Pe]
+
+        corners = []
+        nr = 0
+        while nr < len(points) - 1:
+            nxt = next((end for end in range(len(points) - 1, nr + 1, -1)
+                        if self.link_is_clear(points[nr], points[end], mask)), nr + 1)
+            corners.append(points[nxt])
+            nr = nxt
+        return corners
+
+    def return_path(self, Ps, Pe):
+        """
+        Returns the move from the end back to the start of the toolpath,
+        which is repeated for every slice of the pocket. The toolpath ends on
+        the finishing pass, so the move is searched within self.inside like
+        the links of the finishing passes.
+        @param Ps: The end of the toolpath
+        @param Pe: The start of the toolpath
+        @return: List of LineGeos, None if the tool has to lift
+        """
+        corners = self.link_path(Ps, Pe, self.inside)
+        if corners is None:
+            return None
+        return [LineGeo(Ps, Pe) for Ps, Pe in zip([Ps] + corners[:-1], corners)]
+
+    def link_is_clear(self, Ps, Pe, mask):
+        """
+        Checks if the tool can move straight from Ps to Pe within the given
+        mask without exceeding the engagement limit.
+        @param Ps: The start point
+        @param Pe: The end point
+        @param mask: The mask of the allowed positions
+        @return: Returns true or false
+        """
+        # Twice the positions of cut_line
+        steps = 2 * max(1, int(ceil(Ps.distance(Pe) / self.step)))
+        ts = np.arange(1, steps + 1) / steps
+        xs = Ps.x + ts * (Pe.x - Ps.x)
+        ys = Ps.y + ts * (Pe.y - Ps.y)
+        if not mask.take(self.grid.index(xs, ys), mode='clip').all():
+            return False
+        counts = np.count_nonzero(self.grid.edge_material(xs, ys), axis=1)
+        return counts.max() <= self.max_samples
+
+    def cut_line(self, Ps, Pe, stats):
+        """
+        Simulates a straight move of the tool.
+        @param Ps: The start point
+        @param Pe: The end point
+        @param stats: The EngagementStats of the current pass
+        @return: The points of the move (without Ps)
+        """
+        steps = max(1, int(ceil(Ps.distance(Pe) / self.step)))
+        points = []
+        for step in range(1, steps + 1):
+            t = step / steps
+            point = Point(Ps.x + t * (Pe.x - Ps.x), Ps.y + t * (Pe.y - Ps.y))
+            stats.add(self.grid.engagement(point.x, point.y), self.max_engagement)
+            self.grid.remove(point.x, point.y)
+            points.append(point)
+        return points
+
+    def cut_geo(self, geo, stats):
+        """
+        Simulates the move of the tool along a LineGeo or an ArcGeo.
+        @param geo: The geometry
+        @param stats: The EngagementStats of the current pass
+        """
+        if not isinstance(geo, ArcGeo):
+            self.cut_line(geo.Ps, geo.Pe, stats)
+            return
+        steps = max(1, int(ceil(geo.length / self.step)))
+        for step in range(1, steps + 1):
+            point = geo.get_point_from_start(step, steps)
+            stats.add(self.grid.engagement(point.x, point.y), self.max_engagement)
+            self.grid.remove(point.x, point.y)
+
+
+def fit_geos(points, tol):
+    """
+    Approximates a sequence of points by lines and arcs. Every geometry starts
+    at the end of the previous one and takes as many of the following points
+    as fit into the tolerance (see fit_geo). The number of points is doubled
+    as long as they fit, then bisected.
+    @param points: List of points
+    @param tol: The allowed deviation
+    @return: List of LineGeos and ArcGeos
+    """
+    points = [point for nr, point in enumerate(points)
+              if nr == 0 or point.distance(points[nr - 1]) > 1e-9]
+    xy = np.array([(point.x, point.y) for point in points])
+    last = len(points) - 1
+
+    geos = []
+    nr = 0
+    while nr < last:
+        good, geo = nr + 1, LineGeo(points[nr], points[nr + 1])
+        bad = last + 1
+        size = 2
+        while good < last:
+            end = min(nr + size, last)
+            fitted = fit_geo(points, xy, nr, end, tol)
+            if fitted is None:
+                bad = end
+                break
+            good, geo = end, fitted
+            size *= 2
+        while bad - good > 1:
+            end = (good + bad) // 2
+            fitted = fit_geo(points, xy, nr, end, tol)
+            if fitted is None:
+                bad = end
+            else:
+                good, geo = end, fitted
+        geos.append(geo)
+        nr = good
+    return geos
+
+
+def fit_geo(points, xy, first, last, tol):
+    """
+    Fits a line, or else the arc through the first, middle and last point, to
+    the points from first to last. All points must lie within tol of the
+    geometry, in the order of its direction, and the arc must not bulge more
+    than tol from the lines between them.
+    @param points: List of points
+    @param xy: The coordinates of the points as array
+    @param first: The number of the first point
+    @param last: The number of the last point
+    @param tol: The allowed deviation
+    @return: A LineGeo, an ArcGeo or None if the points do not fit
+    """
+    rel = xy[first:last + 1] - xy[first]
+    chord = rel[-1]
+    length = sqrt(chord.dot(chord))
+    if length > tol:
+        across = (rel[:, 0] * chord[1] - rel[:, 1] * chord[0]) / length
+        if np.abs(across).max() <= tol and (np.diff(rel.dot(chord)) >= 0).all():
+            return LineGeo(points[first], points[last])
+
+    mid = rel[(last - first) // 2]
+    det = 2 * (mid[0] * chord[1] - mid[1] * chord[0])
+    if abs(det) < 1e-12:
+        return None
+    O = np.array([chord[1] * mid.dot(mid) - mid[1] * chord.dot(chord),
+                  mid[0] * chord.dot(chord) - chord[0] * mid.dot(mid)]) / det
+    r = sqrt(O.dot(O))
+    radial = rel - O
+    if np.abs(np.hypot(radial[:, 0], radial[:, 1]) - r).max() > tol:
+        return None
+
+    direction = 1 if det > 0 else -1
+    angles = np.diff(np.unwrap(np.arctan2(radial[:, 1], radial[:, 0])) * direction)
+    if (angles < 0).any() or angles.sum() > 2 * pi - 1e-3 or\
+            r * (1 - cos(angles.max() / 2)) > tol:
+        return None
+    return ArcGeo(Ps=points[first], Pe=points[last],
+                  O=Point(xy[first, 0] + O[0], xy[first, 1] + O[1]), r=r, direction=direction)
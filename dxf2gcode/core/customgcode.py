@@ -82,3 +82,10 @@ class CustomGCode(object):
         @param PostPro: this is the Postprocessor class including the methods to export
         """
         return self.gcode
+
+    def Write_GCode_blocks(self, PostPro):
+        """
+        This method yields the blocks to be exported for this custom gcode
+        @param PostPro: this is the Postprocessor class including the methods to export
+        """
+        yield self.gcode
@@ -33,6 +33,7 @@ import logging
 
 import dxf2gcode.globals.globals as g
 from dxf2gcode.core.point import Point
+from dxf2gcode.core.shapeindex import ShapeIndex
 
 logger = logging.getLogger("Core.LayerContent")
 
@@ -42,6 +43,7 @@ class LayerContent(object):
         self.name = name
         self.shapes = Shapes(shapes)
         self.exp_order = []  # used for shape order optimization, ... Only contains shapes
+        self.shape_index = None  # containment index, built on first use
 
         # Use default tool 1 (always exists in config)
         self.tool_nr = 1
@@ -63,6 +65,16 @@ class LayerContent(object):
                "\nname:   %s" % self.name +\
                "\nshapes: %s" % self.shapes
 
+    @property
+    def shapes(self):
+        return self._shapes
+
+    @shapes.setter
+    def shapes(self, shapes):
+        # The containment index of the old shapes is no longer valid
+        self._shapes = shapes
+        self.shape_index = None
+
     def should_ignore(self):
         return self.name.startswith('IGNORE' + g.config.vars.Layer_Options['id_float_separator'])
 
@@ -84,6 +96,18 @@ class LayerContent(object):
     def getToolRadius(self):
         return self.tool_diameter / 2
 
+    def getIslands(self, shape):
+        """
+        Returns the closed shapes of this layer which are islands of the given
+        pocket shape. The containment index is built again if shapes were
+        added or removed since.
+        @param shape: The pocket shape
+        @return: List of the island shapes
+        """
+        if self.shape_index is None or self.shape_index.count != len(self.shapes):
+            self.shape_index = ShapeIndex(self.shapes)
+        return self.shape_index.islands(shape)
+
     def overrideDefaults(self):
         # search for layer commands to override defaults
         if self.isParameterizableLayer():
@@ -138,14 +162,18 @@ class LayerContent(object):
             for shape in self.shapes:
                 shape.setDisable(True)
 
-    def optimize(self):
+    def optimize(self, st_points=None):
         """
         Optimize jumps between shape export order by choosing the
         start point of next shape as closest to last point of previous.
 
         This is called after TSP optimization.
+        @param st_points: Dictionary with the start points chosen by the TSP
+        optimization per shape nr; these shapes are started there
         """
 
+        st_points = st_points or {}
+
         # exp_order_complete is not filled yet, so we'll have to lookup shape by nr.
         # Create a shape.nr -> shape map so that we don't run in O(n^2) time
         nr2shape = {}
@@ -157,7 +185,9 @@ class LayerContent(object):
             shape = nr2shape.get(nr, None)
             if shape is None:
                 continue
-            if lastPoint is not None:
+            if nr in st_points:
+                shape.setNearestStPoint(st_points[nr])
+            elif lastPoint is not None:
                 shape.setNearestStPoint (lastPoint)
             lastPoint = shape.get_start_end_points (False)
 
@@ -0,0 +1,598 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+from math import sqrt
+from copy import deepcopy
+import logging
+
+from dxf2gcode.core.linegeo import LineGeo
+from dxf2gcode.core.arcgeo import ArcGeo
+from dxf2gcode.core.point import Point
+from dxf2gcode.core.intersect import Intersect
+from dxf2gcode.core.shape import Shape
+from dxf2gcode.core.shapeoffset import offShapeClass
+from dxf2gcode.core.shapeindex import point_in_geos
+
+logger = logging.getLogger('core.pocketmill')
+
+eps = 1e-6
+
+
+class PocketMill(object):
+    """
+    Contour parallel pocketing for arbitrary closed shapes. The rings are
+    generated with the pair-wise offset algorithm of offShapeClass. The first
+    ring is the shape offset by the tool radius, every following ring is the
+    previous ring offset by the stepover (OffsetXY). Deriving each ring from
+    its predecessor keeps the costs proportional to the number of rings times
+    the size of a ring.
+    """
+
+    def __init__(self, shape, tool_rad, stepover, islands=None, max_rings=None):
+        """
+        Standard method to initialize the class
+        @param shape: The closed shape which shall be pocketed
+        @param tool_rad: The radius of the tool
+        @param stepover: The distance between two neighbouring rings
+        @param islands: Closed shapes within the pocket which shall be spared
+        @param max_rings: Limits the number of rings (e.g. 1 for a finishing
+        pass along the walls); None for all rings
+        """
+        self.shape = shape
+        self.tool_rad = tool_rad
+        self.stepover = stepover
+        self.islands = islands or []
+        self.max_rings = max_rings
+
+    def rings(self):
+        """
+        Generator which yields the offset rings from the boundary inwards. The
+        generation stops as soon as the next offset collapses. If the last full
+        stepover would leave material in the centre, a final smaller offset is
+        done to clean it up.
+        @return: Yields the offset distance and the list of geometries
+        (absolute coordinates, CW) per ring
+        """
+        if self.stepover <= 0.0:
+            logger.error("Pocket stepover must be greater than zero (shape %s)"
+                         % self.shape.nr)
+            return
+
+        parent = self.shape
+        offset = self.tool_rad
+        distance = 0.0
+        prv_size = None
+        cleanup = False
+        nr = 0
+
+        while True:
+            offshape = offShapeClass(parent=parent, offset=offset, offtype='in')
+            if len(offshape.rawoff) == 0:
+                return
+
+            ring = Shape(parent.nr, True, None, offshape.rawoff)
+            ring.calc_bounding_box()
+            size = min(ring.BB.Pe.x - ring.BB.Ps.x, ring.BB.Pe.y - ring.BB.Ps.y)
+
+            # A collapsed offset either inverts its direction or stops shrinking
+            if ring.isDirectionOfGeosCCW(ring.geos) or\
+                    (prv_size is not None and size > prv_size - eps):
+                return
+
+            distance += offset
+            yield distance, offshape.rawoff
+            nr += 1
+
+            if cleanup or nr == self.max_rings:
+                return
+
+            half_size = size / 2
+            if half_size <= self.stepover:
+                if half_size <= self.tool_rad + eps:
+                    return
+                offset = half_size - self.tool_rad
+                cleanup = True
+            else:
+                offset = self.stepover
+
+            parent = ring
+            prv_size = size
+
+    def ordered_rings(self, direction=-1):
+        """
+        Returns the rings from the inside to the outside. Every ring starts at
+        its point nearest to the start of the previous (inner) ring.
+        @param direction: -1 for CW, 1 for CCW rings
+        @return: A list of rings; each ring is a list of geometries
+        """
+        rings = [ring for _, ring in self.rings()]
+        logger.debug("Pocket for shape %s has %i rings" % (self.shape.nr, len(rings)))
+
+        ordered = []
+        for ring in reversed(rings):
+            if direction == 1:
+                ring.reverse()
+                for geo in ring:
+                    geo.reverse()
+
+            if len(ordered):
+                prv_start = ordered[-1][0].Ps
+                nearest_nr = min(range(len(ring)),
+                                 key=lambda geo_nr: ring[geo_nr].Ps.distance(prv_start))
+                ring = ring[nearest_nr:] + ring[:nearest_nr]
+            ordered.append(ring)
+        return ordered
+
+    def passes(self, direction=-1):
+        """
+        Generator which yields the passes of the contour parallel toolpath.
+        The rings are milled from the inside to the outside, so all rings are
+        generated before the innermost one is yielded. Every pass comes with
+        the move which links it to the previous pass.
+        @param direction: -1 for CW, 1 for CCW rings
+        @return: Yields the link (None for the first pass, a LineGeo or a
+        Point for a lift) and the list of geometries per pass
+        """
+        if len(self.islands):
+            for link, loop in self.island_passes(direction):
+                yield link, loop
+            return
+
+        prv_end = None
+        for ring in self.ordered_rings(direction):
+            if prv_end is None:
+                yield None, ring
+            else:
+                yield LineGeo(prv_end, ring[0].Ps), ring
+            prv_end = ring[-1].Pe
+
+    def toolpath(self, direction=-1):
+        """
+        Generator which yields the contour parallel toolpath of the pocket.
+        Neighbouring rings are connected with a line, loops around islands
+        which are not neighbours by a lift move.
+        @param direction: -1 for CW, 1 for CCW rings
+        @return: Yields the geometries of the toolpath and Points for lifts
+        """
+        for link, ring in self.passes(direction):
+            if link is not None:
+                yield link
+            for geo in ring:
+                yield geo
+
+    def spiral_toolpath(self, direction=-1):
+        """
+        Generator which yields a spiral toolpath from the centre to the wall of
+        the pocket. Circles get an Archimedean spiral, all other shapes a
+        spiral which morphs each ring into the next outer one. The spiral is
+        finished with a full pass along the outermost ring.
+        @param direction: -1 for CW, 1 for CCW
+        @return: Yields the geometries of the toolpath
+        """
+        if len(self.islands):
+            # The rings split up around islands, so they cannot be morphed
+            for geo in self.toolpath(direction):
+                yield geo
+            return
+
+        if self.shape.isCircle():
+            for geo in self.archimedean_spiral(direction):
+                yield geo
+            return
+
+        rings = self.ordered_rings(direction)
+        if len(rings) == 0:
+            return
+
+        for geo in rings[0]:
+            yield geo
+
+        outer_done = True
+        for inner, outer in zip(rings, rings[1:]):
+            if self.rings_do_match(inner, outer):
+                for geo in self.morph_rings(inner, outer):
+                    yield geo
+                outer_done = False
+            else:
+                # The topology changed between the rings; link them as contours
+                yield LineGeo(inner[-1].Pe, outer[0].Ps)
+                for geo in outer:
+                    yield geo
+                outer_done = True
+
+        if not outer_done:
+            for geo in rings[-1]:
+                yield geo
+
+    def archimedean_spiral(self, direction):
+        """
+        Archimedean spiral approximated with half circles around two
+        alternating centres. The half circles are tangent to each other and
+        each full turn increases the radius by the stepover.
+        @param direction: -1 for CW, 1 for CCW
+        @return: Yields the ArcGeos of the spiral and the final circle
+        """
+        circle = self.shape.geos.abs_el(0)
+        O = circle.O
+        r_end = circle.r - self.tool_rad
+        if r_end <= 0.0:
+            logger.error("Tool is too big for the pocket of shape %s" % self.shape.nr)
+            return
+
+        # Position of the tool on the x axis relative to the centre O
+        x_start = min(self.tool_rad, r_end)
+        while True:
+            if x_start > 0.0:
+                x_end = -x_start
+            else:
+                x_end = self.stepover - x_start
+                if x_end >= r_end:
+                    break
+            yield self.half_circle(O, x_start, x_end, direction)
+            x_start = x_end
+
+        x_end = r_end if x_start < 0.0 else -r_end
+        if abs(x_end - x_start) > eps:
+            yield self.half_circle(O, x_start, x_end, direction)
+        yield self.half_circle(O, x_end, -x_end, direction)
+        yield self.half_circle(O, -x_end, x_end, direction)
+
+    def half_circle(self, O, x_start, x_end, direction):
+        """
+        Returns a half circle between two points on the x axis through O.
+        @param O: The reference point of the x axis
+        @param x_start: The distance of the start point from O along x
+        @param x_end: The distance of the end point from O along x
+        @param direction: -1 for CW, 1 for CCW
+        @return: The ArcGeo of the half circle
+        """
+        return ArcGeo(Ps=Point(O.x + x_start, O.y),
+                      Pe=Point(O.x + x_end, O.y),
+                      O=Point(O.x + (x_start + x_end) / 2, O.y),
+                      r=abs(x_end - x_start) / 2,
+                      direction=direction)
+
+    def rings_do_match(self, inner, outer):
+        """
+        Checks if the geometries of two rings correspond to each other, which
+        is the case as long as the offset did not remove any geometry.
+        @param inner: The inner ring
+        @param outer: The outer ring
+        @return: Returns true or false
+        """
+        if len(inner) != len(outer):
+            return False
+        for geo_in, geo_out in zip(inner, outer):
+            if isinstance(geo_in, ArcGeo) != isinstance(geo_out, ArcGeo):
+                return False
+            if isinstance(geo_in, ArcGeo) and geo_in.O.distance(geo_out.O) > self.stepover:
+                return False
+        return True
+
+    def morph_rings(self, inner, outer):
+        """
+        Generator which yields one turn of the spiral from the start of the
+        inner ring to the start of the outer ring. Each geometry is the
+        interpolation of the corresponding geometries of both rings, weighted
+        by the travelled fraction of the ring length.
+        @param inner: The inner ring
+        @param outer: The outer ring (must match the inner ring)
+        @return: Yields the LineGeos and ArcGeos of the turn
+        """
+        lengths = [(geo_in.length + geo_out.length) / 2
+                   for geo_in, geo_out in zip(inner, outer)]
+        total = sum(lengths)
+        if total <= 0.0:
+            return
+
+        t_start = 0.0
+        Ps = inner[0].Ps
+        for geo_in, geo_out, length in zip(inner, outer, lengths):
+            t_end = t_start + length / total
+            Pe = geo_in.Pe + t_end * (geo_out.Pe - geo_in.Pe)
+
+            if isinstance(geo_in, ArcGeo):
+                # Centre on the bisector of Ps and Pe next to the ring centre
+                Pm = (Ps + Pe) / 2
+                normal = Point(Ps.y - Pe.y, Pe.x - Ps.x)
+                if normal.length() < eps:
+                    Ps = Pe
+                    t_start = t_end
+                    continue
+                normal = normal.unit_vector()
+                O = Pm + normal.dotProd(geo_in.O - Pm) * normal
+                yield ArcGeo(Ps=Ps, Pe=Pe, O=O, r=O.distance(Ps),
+                             direction=1 if geo_in.ext > 0.0 else -1)
+            else:
+                yield LineGeo(Ps, Pe)
+
+            Ps = Pe
+            t_start = t_end
+
+    def island_passes(self, direction=-1):
+        """
+        Generator which yields the contour parallel passes of a pocket with
+        islands. For every offset distance the ring of the pocket is clipped
+        by the rings of the islands at the same distance and vice versa. The
+        remaining pieces are stitched together to loops, which are milled
+        from the inside to the outside. Loops which are not neighbours are
+        connected by a lift move, which is yielded as a Point.
+        @param direction: -1 for CW, 1 for CCW
+        @return: Yields the link (None, a LineGeo or a Point for a lift) and
+        the list of geometries per loop
+        """
+        island_rings = [(island, 0.0) for island in self.islands]
+        keep_out = None
+        levels = []
+
+        for distance, pocket_ring in self.rings():
+            cur_rings = []
+            for nr, (parent, prv_distance) in enumerate(island_rings):
+                offshape = offShapeClass(parent=parent, offset=distance - prv_distance,
+                                         offtype='out')
+                if len(offshape.rawoff) == 0:
+                    logger.warning("Offset of island %s failed" % parent.nr)
+                    continue
+                ring = Shape(parent.nr, True, None, offshape.rawoff)
+                island_rings[nr] = (ring, distance)
+                # The region to mill lies to the right of CW pocket rings, so
+                # the rings around islands have to be CCW
+                island_ring = [deepcopy(geo) for geo in reversed(offshape.rawoff)]
+                for geo in island_ring:
+                    geo.reverse()
+                cur_rings.append(island_ring)
+
+            if keep_out is None:
+                keep_out = [pocket_ring] + cur_rings
+
+            pieces = self.clip_ring(pocket_ring, cur_rings, [])
+            for nr, island_ring in enumerate(cur_rings):
+                pieces += self.clip_ring(island_ring, cur_rings[:nr] + cur_rings[nr + 1:],
+                                         [pocket_ring])
+
+            loops = self.stitch_pieces(pieces)
+            if len(loops) == 0:
+                break
+            levels.append(loops)
+
+        logger.debug("Pocket for shape %s with %i islands has %i levels" %
+                     (self.shape.nr, len(self.islands), len(levels)))
+
+        prv_end = None
+        for loops in reversed(levels):
+            while len(loops):
+                if prv_end is None:
+                    loop = loops.pop(0)
+                else:
+                    loop = loops.pop(min(range(len(loops)),
+                                         key=lambda nr: self.loop_distance(loops[nr], prv_end)))
+                if direction == 1:
+                    loop.reverse()
+                    for geo in loop:
+                        geo.reverse()
+                link = None
+                if prv_end is not None:
+                    if loop[0].Ps.distance(loop[-1].Pe) < eps:
+                        nearest_nr = min(range(len(loop)),
+                                         key=lambda nr: loop[nr].Ps.distance(prv_end))
+                        loop = loop[nearest_nr:] + loop[:nearest_nr]
+                    link = LineGeo(prv_end, loop[0].Ps)
+                    if link.length > 2 * self.stepover or\
+                            self.crosses_rings(link, keep_out):
+                        link = Point(loop[0].Ps.x, loop[0].Ps.y)
+                yield link, loop
+                prv_end = loop[-1].Pe
+
+    def clip_ring(self, ring, outside_rings, inside_rings):
+        """
+        Splits the ring at all intersections with the clip rings and returns
+        the pieces which are outside of all outside_rings and inside of all
+        inside_rings.
+        @param ring: The ring which shall be clipped
+        @param outside_rings: List of closed rings the pieces must not be in
+        @param inside_rings: List of closed rings the pieces must be in
+        @return: List of the remaining geometries
+        """
+        pieces = []
+        for geo in ring:
+            points = []
+            for clip_ring in outside_rings + inside_rings:
+                for clip_geo in clip_ring:
+                    if geo.BB.hasintersection(clip_geo.BB, tol=eps):
+                        points += geo_intersections(geo, clip_geo)
+            for piece in split_geo(geo, points):
+                mid = self.mid_point(piece)
+                if not any(point_in_geos(mid, clip_ring) for clip_ring in outside_rings) and\
+                        all(point_in_geos(mid, clip_ring) for clip_ring in inside_rings):
+                    pieces.append(piece)
+        return pieces
+
+    def stitch_pieces(self, pieces):
+        """
+        Joins pieces whose end and start points coincide to loops.
+        @param pieces: List of LineGeos and ArcGeos
+        @return: List of loops; each loop is a list of geometries
+        """
+        tol = max(eps, self.stepover * 1e-4)
+        loops = []
+        while len(pieces):
+            loop = [pieces.pop(0)]
+            while loop[-1].Pe.distance(loop[0].Ps) > tol:
+                next_nr = None
+                for nr, piece in enumerate(pieces):
+                    if piece.Ps.distance(loop[-1].Pe) <= tol:
+                        next_nr = nr
+                        break
+                if next_nr is None:
+                    break
+                loop.append(pieces.pop(next_nr))
+            loops.append(loop)
+        return loops
+
+    def loop_distance(self, loop, point):
+        """
+        Returns the distance between a point and the nearest possible entry
+        point of a loop (any start point of a closed loop).
+        @param loop: The loop
+        @param point: The point
+        @return: The distance
+        """
+        if loop[0].Ps.distance(loop[-1].Pe) < eps:
+            return min(geo.Ps.distance(point) for geo in loop)
+        return loop[0].Ps.distance(point)
+
+    def crosses_rings(self, link, rings):
+        """
+        Checks if the link intersects any of the rings.
+        @param link: The LineGeo which shall be checked
+        @param rings: List of rings
+        @return: Returns true or false
+        """
+        for ring in rings:
+            for geo in ring:
+                if link.BB.hasintersection(geo.BB, tol=eps):
+                    for point in geo_intersections(link, geo):
+                        if point.distance(link.Ps) > eps and point.distance(link.Pe) > eps:
+                            return True
+        return False
+
+    def mid_point(self, geo):
+        """
+        Returns the point in the middle of the geometry.
+        @param geo: A LineGeo or an ArcGeo
+        @return: The middle point
+        """
+        if isinstance(geo, ArcGeo):
+            return geo.get_point_from_start(1, 2)
+        return (geo.Ps + geo.Pe) / 2
+
+
+def geo_intersections(geo1, geo2):
+    """
+    Returns all intersection points of two geometries.
+    @param geo1: A LineGeo or an ArcGeo
+    @param geo2: A LineGeo or an ArcGeo
+    @return: List of the intersection points
+    """
+    if isinstance(geo1, ArcGeo) and not isinstance(geo2, ArcGeo):
+        geo1, geo2 = geo2, geo1
+
+    if isinstance(geo1, ArcGeo):
+        points = circle_circle_points(geo1.O, geo1.r, geo2.O, geo2.r)
+        return [point for point in points
+                if Intersect.point_belongs_to_arc(point, geo1) and
+                Intersect.point_belongs_to_arc(point, geo2)]
+    elif isinstance(geo2, ArcGeo):
+        points = line_circle_points(geo1, geo2.O, geo2.r)
+        return [point for point in points
+                if Intersect.point_belongs_to_arc(point, geo2)]
+    else:
+        point = Intersect.line_line_intersection(geo1, geo2)
+        return [] if point is None else [point]
+
+
+def line_circle_points(line, O, r):
+    """
+    Returns the intersection points of a line segment and a full circle.
+    @param line: The LineGeo
+    @param O: The center of the circle
+    @param r: The radius of the circle
+    @return: List of the intersection points
+    """
+    d = line.Pe - line.Ps
+    f = line.Ps - O
+    a = d.dotProd(d)
+    if a < eps ** 2:
+        return []
+    b = 2 * f.dotProd(d)
+    c = f.dotProd(f) - r ** 2
+    disc = b ** 2 - 4 * a * c
+    if disc < 0:
+        return []
+    disc = sqrt(disc)
+    points = []
+    for t in set([(-b - disc) / (2 * a), (-b + disc) / (2 * a)]):
+        if -eps <= t <= 1 + eps:
+            points.append(line.Ps + t * d)
+    return points
+
+
+def circle_circle_points(O1, r1, O2, r2):
+    """
+    Returns the intersection points of two full circles.
+    @param O1: The center of the first circle
+    @param r1: The radius of the first circle
+    @param O2: The center of the second circle
+    @param r2: The radius of the second circle
+    @return: List of the intersection points
+    """
+    d = O1.distance(O2)
+    if d < eps or d > r1 + r2 or d < abs(r1 - r2):
+        return []
+    a = (r1 ** 2 - r2 ** 2 + d ** 2) / (2 * d)
+    h = sqrt(max(r1 ** 2 - a ** 2, 0.0))
+    Pm = O1 + a / d * (O2 - O1)
+    return [Point(Pm.x + h * (O2.y - O1.y) / d, Pm.y - h * (O2.x - O1.x) / d),
+            Point(Pm.x - h * (O2.y - O1.y) / d, Pm.y + h * (O2.x - O1.x) / d)]
+
+
+def split_geo(geo, points):
+    """
+    Splits a geometry at the given points (which have to lie on it).
+    @param geo: A LineGeo or an ArcGeo
+    @param points: The points at which the geometry shall be split
+    @return: List of the pieces in the direction of the geometry
+    """
+    if isinstance(geo, ArcGeo):
+        direction = 1 if geo.ext > 0.0 else -1
+        position = lambda point: geo.dif_ang(geo.Ps, point, geo.ext) / geo.ext
+    else:
+        direction = None
+        position = lambda point: (point - geo.Ps).dotProd(geo.Pe - geo.Ps) / geo.length ** 2
+
+    splits = sorted([(position(point), point) for point in points
+                     if eps < position(point) < 1 - eps], key=lambda split: split[0])
+    pieces = []
+    Ps = geo.Ps
+    for pos, point in splits + [(1.0, geo.Pe)]:
+        if Ps.distance(point) < eps:
+            continue
+        if direction is None:
+            pieces.append(LineGeo(Ps, point))
+        else:
+            pieces.append(ArcGeo(Ps=Ps, Pe=point, O=geo.O, r=geo.r, direction=direction))
+        Ps = point
+    if len(pieces) and pieces[-1].Pe is not geo.Pe:
+        # Snap the last piece to the end point of the geometry
+        last = pieces.pop()
+        if direction is None:
+            pieces.append(LineGeo(last.Ps, geo.Pe))
+        else:
+            pieces.append(ArcGeo(Ps=last.Ps, Pe=geo.Pe, O=geo.O, r=geo.r, direction=direction))
+    return pieces
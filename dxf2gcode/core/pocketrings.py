@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+
+import numpy as np
+
+from dxf2gcode.core.linegeo import LineGeo
+from dxf2gcode.core.arcgeo import ArcGeo
+from dxf2gcode.core.point import Point
+
+logger = logging.getLogger('core.pocketrings')
+
+
+class PocketRings(object):
+    """
+    The concentric rings of the dedicated circular and rectangular pockets.
+    All rings are computed at once as arrays: the radii of the circles or the
+    corners of the rectangles. The start move, the start and end points used
+    by the route optimisation and the canvas all use the same rings.
+    """
+
+    def __init__(self, shape, tool_rad, stepover):
+        """
+        Standard method to initialize the class
+        @param shape: The circle or axis aligned rectangle which is pocketed
+        @param tool_rad: The radius of the tool
+        @param stepover: The distance between two rings
+        """
+        self.tool_rad = tool_rad
+        self.stepover = stepover
+        self.circle = shape.isCircle()
+        if self.circle:
+            self.init_circle(shape.geos[0].O, shape.geos[0].r)
+        else:
+            self.init_rectangle(shape.geos[0], shape.geos[1])
+
+        # When the pocket is not a multiple of the stepover the outermost
+        # rings are all clamped to the wall, mill it only once
+        keep = np.ones(len(self.starts), dtype=bool)
+        keep[1:] = np.any(self.starts[1:] != self.starts[:-1], axis=1)
+        self.starts = self.starts[keep]
+        if self.circle:
+            self.radii = self.radii[keep]
+        else:
+            self.corners = self.corners[keep]
+        self.count = len(self.starts)
+
+    def init_circle(self, O, r):
+        """
+        Computes the radii of the rings of a circular pocket; every ring
+        starts on the right of the centre.
+        @param O: The centre of the circle
+        @param r: The radius of the circle
+        """
+        self.center = Point(O.x, O.y)
+        count = int((r - self.tool_rad) / self.stepover) + 1
+        offsets = self.tool_rad + np.arange(max(count, 0)) * self.stepover
+        xs = O.x + offsets
+        inside = xs - O.x + self.tool_rad < r
+        xs = np.where(inside, xs, O.x + r - self.tool_rad)
+        self.radii = np.where(inside, offsets, xs - O.x)
+        self.starts = np.column_stack((xs, np.full(len(xs), O.y)))
+        logger.debug("Circular pocket at %s, radius %f: %i rings" % (O, r, len(xs)))
+
+    def init_rectangle(self, first, second):
+        """
+        Computes the corners of the rings of a rectangular pocket. The rings
+        grow from the centre line along the longer side; every ring starts
+        at its upper right corner.
+        @param first: The first side of the rectangle
+        @param second: The second side of the rectangle
+        """
+        minx = min(first.Ps.x, first.Pe.x, second.Ps.x, second.Pe.x)
+        miny = min(first.Ps.y, first.Pe.y, second.Ps.y, second.Pe.y)
+        width = max(abs(first.Ps.x - first.Pe.x), abs(second.Ps.x - second.Pe.x))
+        height = max(abs(first.Ps.y - first.Pe.y), abs(second.Ps.y - second.Pe.y))
+        cx, cy = width / 2 + minx, height / 2 + miny
+        self.center = Point(cx, cy)
+
+        value = (min(width, height) / 2 - self.tool_rad) / self.stepover
+        count = int(value)
+        if value > count + 0.5:
+            count += 1
+        offsets = self.tool_rad + np.arange(max(count, 0)) * self.stepover
+
+        # Half of the difference of the sides is added along the longer side
+        dx = (width - height) / 2 if width > height else 0.0
+        dy = (height - width) / 2 if height > width else 0.0
+        if height > width:
+            inside = cy - dy - offsets - self.tool_rad >= miny
+        else:
+            inside = cx - dx - offsets - self.tool_rad >= minx
+
+        right = np.where(inside, cx + (dx + offsets), cx + width / 2 - self.tool_rad)
+        left = np.where(inside, cx - (dx + offsets), cx - width / 2 + self.tool_rad)
+        top = np.where(inside, cy + (dy + offsets), cy + height / 2 - self.tool_rad)
+        bottom = np.where(inside, cy - (dy + offsets), cy - height / 2 + self.tool_rad)
+
+        # Corners in CCW order starting at the upper right one
+        self.corners = np.stack((np.column_stack((right, top)),
+                                 np.column_stack((left, top)),
+                                 np.column_stack((left, bottom)),
+                                 np.column_stack((right, bottom))), axis=1)
+        self.starts = self.corners[:, 0]
+        logger.debug("Rectangular pocket at %s, %f x %f: %i rings" %
+                     (self.center, width, height, len(offsets)))
+
+    def start_point(self):
+        """
+        Returns the point where the innermost ring starts.
+        @return: The Point or None if the pocket has no rings
+        """
+        if self.count == 0:
+            return None
+        return Point(*self.starts[0].tolist())
+
+    def end_point(self):
+        """
+        Returns the point where the outermost ring ends.
+        @return: The Point or None if the pocket has no rings
+        """
+        if self.count == 0:
+            return None
+        return Point(*self.starts[-1].tolist())
+
+    def toolpath(self, direction=-1):
+        """
+        Generator which yields the rings from the inside out, each connected
+        to the next by a line.
+        @param direction: -1 for CW, 1 for CCW rings
+        @return: Yields the geometries of the toolpath
+        """
+        starts = [Point(x, y) for x, y in self.starts.tolist()]
+        if self.circle:
+            rings = [[ArcGeo(Ps=Ps, Pe=Ps, O=self.center, r=r, direction=direction)]
+                     for Ps, r in zip(starts, self.radii.tolist())]
+        else:
+            order = [0, 1, 2, 3, 0] if direction == 1 else [0, 3, 2, 1, 0]
+            rings = []
+            for corners in self.corners[:, order].tolist():
+                points = [Point(x, y) for x, y in corners]
+                rings.append([LineGeo(Ps, Pe) for Ps, Pe in zip(points, points[1:])])
+
+        for nr, ring in enumerate(rings):
+            for geo in ring:
+                yield geo
+            if nr + 1 < len(rings):
+                yield LineGeo(starts[nr], starts[nr + 1])
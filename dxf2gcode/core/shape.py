@@ -29,13 +29,17 @@ from __future__ import division
 
 from math import radians, pi
 from copy import deepcopy
+from itertools import chain
+import hashlib
 import logging
+import time
 
 import dxf2gcode.globals.globals as g
 from dxf2gcode.core.point import Point
 from dxf2gcode.core.linegeo import LineGeo
 from dxf2gcode.core.arcgeo import ArcGeo
 from dxf2gcode.core.holegeo import HoleGeo
+from dxf2gcode.core.pocketrings import PocketRings
 
 import dxf2gcode.globals.constants as c
 from PyQt5 import QtCore
@@ -61,6 +65,8 @@ class Shape(object):
         self.closed = closed
         self.cut_cor = 40
         self.Pocket = False
+        self.Drill = False
+        self.DrillType = None
         self.parentEntity = parentEntity
         self.parentLayer = None
         self.geos = Geos(geos)
@@ -68,6 +74,7 @@ class Shape(object):
         self.cw = True
 
         self.stmove = None
+        self.pocket_rings = None
 
         self.send_to_TSP = g.config.vars.Route_Optimisation['default_TSP']
 
@@ -127,6 +134,48 @@ class Shape(object):
     def isToolPathOptimized(self):
         return self.send_to_TSP
 
+    def isCircle(self):
+        """
+        Checks if the shape is a full circle made of two arcs. The dedicated
+        circular pocket is used for those shapes.
+        @return: Returns true or false
+        """
+        return self.closed and len(self.geos) == 2 and\
+            all(isinstance(geo, ArcGeo) for geo in self.geos) and\
+            self.geos[0].O == self.geos[1].O and\
+            abs(self.geos[0].r - self.geos[1].r) < 1e-6
+
+    def isRectangle(self):
+        """
+        Checks if the shape is an axis aligned rectangle made of four lines.
+        The dedicated rectangular pocket is used for those shapes.
+        @return: Returns true or false
+        """
+        return self.closed and len(self.geos) == 4 and\
+            all(isinstance(geo, LineGeo) and
+                (abs(geo.Ps.x - geo.Pe.x) < 1e-6 or abs(geo.Ps.y - geo.Pe.y) < 1e-6)
+                for geo in self.geos)
+
+    def isPoint(self):
+        """
+        Checks if the shape is machined at a single point: a drilled circle
+        or a point of the drawing.
+        @return: Returns true or false
+        """
+        return not self.Pocket and\
+            (self.Drill or len(self.geos) == 1 and isinstance(self.geos[0], HoleGeo))
+
+    def usesPocketEngine(self):
+        """
+        Checks if the pocket toolpath of the shape is generated by PocketMill
+        instead of the dedicated circle and rectangle code.
+        @return: Returns true or false
+        """
+        return self.Pocket and\
+            (g.config.vars.Pocketing['strategy'] != 'contour' or
+             not (self.isCircle() or self.isRectangle()) or
+             len(self.parentLayer.getIslands(self)) > 0)
+
     def isDirectionOfGeosCCW(self, geos):
         # By calculating the area of the shape
         start = geos.abs_el(0).get_start_end_points(True)
@@ -238,101 +287,15 @@ class Shape(object):
             
         ### drill cut here
         
-        if PPocket ==True:
-            #Calculate the start and end points for pocket entry and exit for a circular pocket
-            if isinstance(self.geos[0],ArcGeo):  
-                numberofrotations = int((self.geos[0].r - self.parentLayer.tool_diameter)/self.OffsetXY)
-                if ((self.geos[0].r - self.parentLayer.tool_diameter/2)/self.OffsetXY)> numberofrotations :
-                    numberofrotations += 1
-                st_point = Point(self.geos[0].O.x + (0.5 * self.parentLayer.tool_diameter),self.geos[0].O.y)
-                en_point = Point(self.geos[0].O.x + (0.5 * self.parentLayer.tool_diameter * 2 * numberofrotations),self.geos[0].O.y)
-                if ((en_point.x - self.geos[0].O.x + (0.5 * self.parentLayer.tool_diameter)) > self.geos[0].r):
-                    en_point = Point(self.geos[0].O.x + self.geos[0].r - (0.5 * self.parentLayer.tool_diameter)  ,self.geos[0].O.y)
-                logger.debug(self.tr("shape:get_start_end_points_physical:Start Point at: %s" % st_point))
-                logger.debug(self.tr("shape:get_start_end_points_physical:End Point at: %s" % en_point))
-                if start_point is None:
-                    return (st_point, en_point),direction*1.57
-                elif start_point:
-                    return st_point,direction*1.57
-                else:
-                    return en_point,direction*(-1.57)
-            elif isinstance(self.geos[0],LineGeo) and len(self.geos) == 4:
-                #get Rectangle width and height
-                firstgeox = abs(self.geos[0].Ps.x - self.geos[0].Pe.x)
-                firstgeoy = abs(self.geos[0].Ps.y - self.geos[0].Pe.y)
-                secondgeox = abs(self.geos[1].Ps.x - self.geos[1].Pe.x)
-                secondgeoy = abs(self.geos[1].Ps.y - self.geos[1].Pe.y)
-                if firstgeox > secondgeox:
-                    Pocketx = firstgeox
-                    if self.geos[0].Ps.x < self.geos[0].Pe.x:
-                        minx = self.geos[0].Ps.x
-                    else:
-                        minx = self.geos[0].Pe.x
-                else:
-                    Pocketx = secondgeox
-                    if self.geos[1].Ps.x < self.geos[1].Pe.x:
-                        minx = self.geos[1].Ps.x
-                    else:
-                        minx = self.geos[1].Pe.x
-                if firstgeoy > secondgeoy:
-                    Pockety = firstgeoy
-                    if self.geos[0].Ps.y < self.geos[0].Pe.y:
-                        miny = self.geos[0].Ps.y
-                    else:
-                        miny = self.geos[0].Pe.y
-                else:
-                    Pockety = secondgeoy
-                    if self.geos[1].Ps.y < self.geos[1].Pe.y:
-                        miny = self.geos[1].Ps.y
-                    else:
-                        miny = self.geos[1].Pe.y
-                Centerpt = Point(Pocketx/2 + minx, Pockety/2 +miny)
-                # calc number of rotations
-                if Pockety > Pocketx:
-                    numberofrotations = int(((Pocketx/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)+1
-                    if (((Pocketx/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)> int(((Pocketx/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)+0.5 :
-                        numberofrotations += 1
-                else:
-                    numberofrotations = int(((Pockety/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)+1
-                    if (((Pockety/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)> int(((Pockety/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)+0.5 :
-                        numberofrotations += 1
-            
-                if Pockety > Pocketx: 
-                    st_point = Point(Centerpt.x +(self.parentLayer.tool_diameter/2 ) ,Centerpt.y + ((Pockety-Pocketx)/2 +(self.parentLayer.tool_diameter/2 )) )
-                    if (Centerpt.y - (Pockety-Pocketx)/2 - (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) - self.parentLayer.tool_diameter/2 >= miny):
-                        en_point = Point(Centerpt.x +(self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) ,Centerpt.y + ((Pockety-Pocketx)/2 +(self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY))) )
-                    else:
-                        en_point = Point(Centerpt.x + Pocketx/2 - self.parentLayer.tool_diameter/2 ,Centerpt.y + Pockety/2 - self.parentLayer.tool_diameter/2 )
-                    
-                elif Pocketx > Pockety:
-                    st_point = Point(Centerpt.x + ((Pocketx-Pockety)/2 +(self.parentLayer.tool_diameter/2 )) ,Centerpt.y + (self.parentLayer.tool_diameter/2 ) )
-                    if (Centerpt.x - (Pocketx-Pockety)/2 - (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) - self.parentLayer.tool_diameter/2 >= minx):
-                        en_point = Point(Centerpt.x + ((Pocketx-Pockety)/2 +(self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY))) ,Centerpt.y + (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) )
-                    else:
-                        en_point = Point(Centerpt.x + Pocketx/2 - self.parentLayer.tool_diameter/2 ,Centerpt.y + Pockety/2 - self.parentLayer.tool_diameter/2 )
-                        
-                    
-                elif Pocketx == Pockety:
-                    st_point = Point(Centerpt.x + self.parentLayer.tool_diameter/2 ,Centerpt.y + (self.parentLayer.tool_diameter/2 ) )
-                    if (Centerpt.x - (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) - self.parentLayer.tool_diameter/2 >= minx):
-                        en_point = Point(Centerpt.x + (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) ,Centerpt.y + (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) )
-                    else:
-                        en_point = Point(Centerpt.x + Pocketx/2 - self.parentLayer.tool_diameter/2 ,Centerpt.y + Pockety/2 - self.parentLayer.tool_diameter/2 )
-                    
-                    
-                if start_point is None:
-                    return (st_point, en_point),direction*3.14
-                elif start_point:
-                    if direction == -1:
-                        return st_point,-1.57
-                    else:
-                        return st_point,3.14
-                else:
-                    return en_point,direction*(-1.57)
-            
-        
+        if PPocket ==True and not self.usesPocketEngine() and self.get_pocket_rings().count > 0:
+            #The rings of a circular or rectangular pocket start and end at different points
+            if start_point is None:
+                return self.get_start_end_points(None, angles, PPocket),\
+                    direction*(1.57 if self.pocket_rings.circle else 3.14)
+            return self.get_start_end_points(start_point, angles, PPocket)
+
         if start_point or self.closed:
-            return self.get_start_end_points(start_point, angles)
+            return self.get_start_end_points(start_point, angles, PPocket)
         else:
             max_slice = max(self.axis3_slice_depth,
                             self.axis3_mill_depth -
@@ -373,97 +336,31 @@ class Shape(object):
                 return en_point,direction*(-1.57)
         
         if PPocket ==True:
-            #Calculate the start and end points for pocket entry and exit for a circular pocket
-            if isinstance(self.geos[0],ArcGeo):  
-                numberofrotations = int((self.geos[0].r - self.parentLayer.tool_diameter)/self.OffsetXY)
-                if ((self.geos[0].r - self.parentLayer.tool_diameter/2)/self.OffsetXY)> numberofrotations :
-                    numberofrotations += 1
-                st_point = Point(self.geos[0].O.x + (0.5 * self.parentLayer.tool_diameter),self.geos[0].O.y)
-                en_point = Point(self.geos[0].O.x + (0.5 * self.parentLayer.tool_diameter * 2 * numberofrotations),self.geos[0].O.y)
-                if ((en_point.x - self.geos[0].O.x + (0.5 * self.parentLayer.tool_diameter)) > self.geos[0].r):
-                    en_point = Point(self.geos[0].O.x + self.geos[0].r - (0.5 * self.parentLayer.tool_diameter)  ,self.geos[0].O.y)
-                logger.debug(self.tr("shape:get_start_end_points_physical:Start Point at: %s" % st_point))
-                logger.debug(self.tr("shape:get_start_end_points_physical:End Point at: %s" % en_point))
-                if start_point is None:
-                    return (st_point, en_point)#,1.57
-                elif start_point:
-                    return st_point,direction*1.57
-                else:
-                    return en_point,direction*(-1.57)
-            elif isinstance(self.geos[0],LineGeo) and len(self.geos) == 4:
-                #get Rectangle width and height
-                firstgeox = abs(self.geos[0].Ps.x - self.geos[0].Pe.x)
-                firstgeoy = abs(self.geos[0].Ps.y - self.geos[0].Pe.y)
-                secondgeox = abs(self.geos[1].Ps.x - self.geos[1].Pe.x)
-                secondgeoy = abs(self.geos[1].Ps.y - self.geos[1].Pe.y)
-                if firstgeox > secondgeox:
-                    Pocketx = firstgeox
-                    if self.geos[0].Ps.x < self.geos[0].Pe.x:
-                        minx = self.geos[0].Ps.x
-                    else:
-                        minx = self.geos[0].Pe.x
-                else:
-                    Pocketx = secondgeox
-                    if self.geos[1].Ps.x < self.geos[1].Pe.x:
-                        minx = self.geos[1].Ps.x
+            if self.usesPocketEngine():
+                # The start and end of the PocketMill toolpath
+                if self.stmove is not None and len(self.stmove.geos) > 0:
+                    if start_point is None:
+                        return (self.stmove.geos.abs_el(0).get_start_end_points(True, angles),
+                                self.stmove.geos.abs_el(-1).get_start_end_points(False, angles))
+                    elif start_point:
+                        return self.stmove.geos.abs_el(0).get_start_end_points(True, angles)
                     else:
-                        minx = self.geos[1].Pe.x
-                if firstgeoy > secondgeoy:
-                    Pockety = firstgeoy
-                    if self.geos[0].Ps.y < self.geos[0].Pe.y:
-                        miny = self.geos[0].Ps.y
-                    else:
-                        miny = self.geos[0].Pe.y
-                else:
-                    Pockety = secondgeoy
-                    if self.geos[1].Ps.y < self.geos[1].Pe.y:
-                        miny = self.geos[1].Ps.y
-                    else:
-                        miny = self.geos[1].Pe.y
-                Centerpt = Point(Pocketx/2 + minx, Pockety/2 +miny)
-                # calc number of rotations
-                if Pockety > Pocketx:
-                    numberofrotations = int(((Pocketx/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)+1
-                    if (((Pocketx/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)> int(((Pocketx/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)+0.5 :
-                        numberofrotations += 1
-                else:
-                    numberofrotations = int(((Pockety/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)+1
-                    if (((Pockety/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)> int(((Pockety/2) - self.parentLayer.tool_diameter/2)/self.OffsetXY)+0.5 :
-                        numberofrotations += 1
-            
-                if Pockety > Pocketx: 
-                    st_point = Point(Centerpt.x +(self.parentLayer.tool_diameter/2 ) ,Centerpt.y + ((Pockety-Pocketx)/2 +(self.parentLayer.tool_diameter/2 )) )
-                    if (Centerpt.y - (Pockety-Pocketx)/2 - (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) - self.parentLayer.tool_diameter/2 >= miny):
-                        en_point = Point(Centerpt.x +(self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) ,Centerpt.y + ((Pockety-Pocketx)/2 +(self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY))) )
-                    else:
-                        en_point = Point(Centerpt.x + Pocketx/2 - self.parentLayer.tool_diameter/2 ,Centerpt.y + Pockety/2 - self.parentLayer.tool_diameter/2 )
-                    
-                elif Pocketx > Pockety:
-                    st_point = Point(Centerpt.x + ((Pocketx-Pockety)/2 +(self.parentLayer.tool_diameter/2 )) ,Centerpt.y + (self.parentLayer.tool_diameter/2 ) )
-                    if (Centerpt.x - (Pocketx-Pockety)/2 - (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) - self.parentLayer.tool_diameter/2 >= minx):
-                        en_point = Point(Centerpt.x + ((Pocketx-Pockety)/2 +(self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY))) ,Centerpt.y + (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) )
-                    else:
-                        en_point = Point(Centerpt.x + Pocketx/2 - self.parentLayer.tool_diameter/2 ,Centerpt.y + Pockety/2 - self.parentLayer.tool_diameter/2 )
-                        
-                    
-                elif Pocketx == Pockety:
-                    st_point = Point(Centerpt.x + self.parentLayer.tool_diameter/2 ,Centerpt.y + (self.parentLayer.tool_diameter/2 ) )
-                    if (Centerpt.x - (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) - self.parentLayer.tool_diameter/2 >= minx):
-                        en_point = Point(Centerpt.x + (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) ,Centerpt.y + (self.parentLayer.tool_diameter/2 + (numberofrotations*self.OffsetXY)) )
-                    else:
-                        en_point = Point(Centerpt.x + Pocketx/2 - self.parentLayer.tool_diameter/2 ,Centerpt.y + Pockety/2 - self.parentLayer.tool_diameter/2 )
-                    
-                    
+                        return self.stmove.geos.abs_el(-1).get_start_end_points(False, angles)
+            #Start and end points of the rings of a circular or rectangular pocket
+            elif self.get_pocket_rings().count > 0:
+                rings = self.pocket_rings
                 if start_point is None:
-                    return (st_point, en_point)#,3.14
+                    return (rings.start_point(), rings.end_point())
                 elif start_point:
-                    if direction == -1:
-                        return st_point,-1.57
+                    if rings.circle:
+                        return rings.start_point(),direction*1.57
+                    elif direction == -1:
+                        return rings.start_point(),-1.57
                     else:
-                        return st_point,3.14
+                        return rings.start_point(),3.14
                 else:
-                    return en_point,direction*(-1.57)
-                
+                    return rings.end_point(),direction*(-1.57)
+
         if start_point is None:
             return (self.geos.abs_el(0).get_start_end_points(True, angles),
                     self.geos.abs_el(-1).get_start_end_points(False, angles))
@@ -472,6 +369,31 @@ class Shape(object):
         else:
             return self.geos.abs_el(-1).get_start_end_points(False, angles)
 
+    def get_start_end_candidates(self):
+        """
+        Returns the start and end points the shape can be cut with: a closed
+        shape can be started at every geometry and ends there again, an open
+        shape can be cut in both directions. setNearestStPoint selects the
+        candidate with its start point.
+        @return: List of [start, end] points
+        """
+        if self.closed:
+            return [[geo.get_start_end_points(True)] * 2 for geo in self.geos.abs_iter()]
+        start, end = self.get_start_end_points()
+        return [[start, end], [end, start]]
+
+    def get_pocket_rings(self):
+        """
+        Returns the rings of the dedicated circular or rectangular pocket.
+        They are computed again only if the tool or the stepover has changed.
+        @return: The PocketRings instance
+        """
+        tool_rad = self.parentLayer.getToolRadius()
+        if self.pocket_rings is None or\
+                (self.pocket_rings.tool_rad, self.pocket_rings.stepover) != (tool_rad, self.OffsetXY):
+            self.pocket_rings = PocketRings(self, tool_rad, self.OffsetXY)
+        return self.pocket_rings
+
     def make_path(self, drawHorLine, drawVerLine):
 
         for geo in self.geos.abs_iter():
@@ -529,15 +451,180 @@ class Shape(object):
         else:
             return ""
 
-    def Write_GCode(self, PostPro):
+    def Write_GCode_for_pocket(self, PostPro, mom_depth, blocks=None):
+        """
+        Returns the string for one pass of the pocket toolpath. Points within
+        the toolpath are lift moves: the tool is retracted to the safe margin,
+        moved and plunged again to the current depth.
+        If a list is given for blocks, the formatted moves between the lifts
+        are stored in it together with the lifts, so that the passes of the
+        following slices can reuse them (see Write_GCode_pocket_blocks).
+        @param PostPro: The PostProcessor instance to be used
+        @param mom_depth: The depth of the current pass
+        @param blocks: List to store the formatted moves and the lifts in
+        @return: Returns the string to be written to a file.
+        """
+        exstr = ""
+        block = ""
+        format_time = 0.0
+        start = time.time()
+        for geo in self.stmove.geos.abs_iter():
+            if isinstance(geo, Point):
+                if blocks is not None:
+                    if block:
+                        blocks.append((block, PostPro.get_position_xy()))
+                    blocks.append(geo)
+                format_time += time.time() - start
+                exstr += block
+                block = ""
+                exstr += self.Write_GCode_lift(PostPro, geo, mom_depth)
+                start = time.time()
+            else:
+                block += self.Write_GCode_for_geo(geo, PostPro)
+        format_time += time.time() - start
+        if blocks is not None and block:
+            blocks.append((block, PostPro.get_position_xy()))
+        PostPro.stats.add_pass(format_time)
+        return exstr + block
+
+    def Write_GCode_pocket_blocks(self, PostPro, mom_depth, blocks, format_time):
+        """
+        Returns the string for one pass of the pocket toolpath from the moves
+        formatted during the first pass. Only the lift moves, which depend on
+        the depth, are formatted again.
+        @param PostPro: The PostProcessor instance to be used
+        @param mom_depth: The depth of the current pass
+        @param blocks: The list filled by Write_GCode_for_pocket
+        @param format_time: The time needed to format the moves in the first
+        pass, i.e. the time saved by reusing them
+        @return: Returns the string to be written to a file.
+        """
+        exstr = ""
+        for block in blocks:
+            if isinstance(block, Point):
+                exstr += self.Write_GCode_lift(PostPro, block, mom_depth)
+            else:
+                exstr += PostPro.reuse_moves(*block)
+        PostPro.stats.add_reused_pass(format_time)
+        return exstr
+
+    def Write_GCode_pocket_return(self, PostPro, mom_depth):
+        """
+        Returns the string for the move from the end back to the start of the
+        pocket toolpath. The tool moves through the already milled area if
+        the start move found such a move (see StMove.return_geos), otherwise
+        it is lifted.
+        @param PostPro: The PostProcessor instance to be used
+        @param mom_depth: The depth of the current pass
+        @return: Returns the string to be written to a file.
+        """
+        return_geos = self.stmove.return_geos
+        if return_geos is None:
+            return self.Write_GCode_lift(PostPro, self.stmove.geos.abs_el(0).Ps, mom_depth)
+        return "".join(geo.Write_GCode(PostPro) for geo in return_geos)
+
+    def Write_GCode_lift(self, PostPro, point, mom_depth):
+        """
+        Returns the string to retract the tool, move it to the point and
+        plunge it to the given depth again.
+        @param PostPro: The PostProcessor instance to be used
+        @param point: The point to move to
+        @param mom_depth: The depth to plunge to; None within a subroutine,
+        which gets the depth as parameter
+        @return: Returns the string to be written to a file.
+        """
+        exstr = PostPro.rap_pos_z(self.axis3_start_mill_depth +
+                                  abs(self.parentLayer.axis3_safe_margin))
+        exstr += PostPro.rap_pos_xy(point)
+        exstr += PostPro.chg_feed_rate(self.f_g1_depth)
+        if mom_depth is None:
+            exstr += PostPro.lin_pol_z_sub()
+        else:
+            exstr += PostPro.lin_pol_z(mom_depth)
+        exstr += PostPro.chg_feed_rate(self.f_g1_plane)
+        return exstr
+
+    def get_start_move_point(self):
+        """
+        Returns the point the tool is moved to before the shape is cut.
+        @return: The start point
+        """
+        if self.Pocket == True:
+            return self.stmove.geos[0].Ps
+        elif self.Drill == True:
+            return self.stmove.geos[0]
+        else:
+            return self.stmove.geos.abs_el(0)
+
+    def Write_GCode_start_move(self, PostPro):
+        """
+        Returns the string to move the tool to the start of the shape.
+        @param PostPro: The PostProcessor instance to be used
+        @return: Returns the string to be written to a file.
+        """
+        if self.Pocket == True or self.Drill == True:
+            return LineGeo(Point(0, 0), self.get_start_move_point()).Write_GCode(PostPro)
+        return self.stmove.geos.abs_el(0).Write_GCode(PostPro)
+
+    def get_placement_hash(self):
         """
-        This method returns the string to be exported for this shape, including
-        the defined start and end move of the shape.
+        Fingerprints the toolpath and the cutting parameters of the shape
+        relative to its start point, like Project.get_hash does for the
+        geometry. Shapes with the same hash (e.g. the same part placed several
+        times) result in the same G-code in incremental coordinates.
+        @return: The hash as hex string, None if the shape cannot be exported
+        as subroutine (drilling uses absolute canned cycles)
+        """
+        if self.Drill == True or g.config.machine_type == 'drag_knife' or\
+                self.stmove is None or len(self.stmove.geos) == 0:
+            return None
+
+        start = self.get_start_move_point()
+
+        def rel(point):
+            return "%0.6f %0.6f" % (round(point.x - start.x, 6) + 0.0,
+                                    round(point.y - start.y, 6) + 0.0)
+
+        items = ["%s %s %s %s %s %s %s %s %s %s" % (
+            self.parentLayer.nr, self.closed, self.cut_cor, self.Pocket, self.OffsetXY,
+            self.axis3_start_mill_depth, self.axis3_slice_depth, self.axis3_mill_depth,
+            self.f_g1_plane, self.f_g1_depth)]
+        for geo in chain(self.geos.abs_iter(), self.stmove.geos.abs_iter()):
+            if isinstance(geo, Point):
+                items.append("P %s" % rel(geo))
+            elif isinstance(geo, ArcGeo):
+                items.append("A %s %s %s %0.6f" % (rel(geo.Ps), rel(geo.Pe), rel(geo.O), geo.ext))
+            elif isinstance(geo, LineGeo):
+                items.append("L %s %s" % (rel(geo.Ps), rel(geo.Pe)))
+            else:
+                return None
+        return hashlib.sha1('\n'.join(items).encode('utf-8')).hexdigest()
+
+    def Write_GCode(self, PostPro, start_move=True):
+        """
+        This method returns the string to be exported for this shape, see
+        Write_GCode_blocks.
+        @param PostPro: this is the Postprocessor class including the methods
+        to export
+        @param start_move: If False the move to the start of the shape is
+        omitted (see Write_GCode_start_move)
+        """
+        return "".join(self.Write_GCode_blocks(PostPro, start_move))
+
+    def Write_GCode_blocks(self, PostPro, start_move=True):
+        """
+        This method yields the blocks to be exported for this shape, including
+        the defined start and end move of the shape, one after another while
+        they are formatted.
         @param PostPro: this is the Postprocessor class including the methods
         to export
+        @param start_move: If False the move to the start of the shape is
+        omitted (see Write_GCode_start_move)
         """
         if g.config.machine_type == 'drag_knife':
-            return self.Write_GCode_Drag_Knife(PostPro)
+            for exstr in self.Write_GCode_blocks_Drag_Knife(PostPro, start_move):
+                yield exstr
+            return
 
         prv_cut_cor = self.cut_cor
         if (self.cut_cor != 40 and
@@ -549,11 +636,9 @@ class Shape(object):
 
         # If there is nothing to export
         if len(new_geos) == 0:
-            return ""
+            return
 
         new_geos = PostPro.breaks.getNewGeos(new_geos)
-        # initialisation of the string
-        exstr = ""
 
         # Get the mill settings defined in the GUI
         safe_retract_depth = self.parentLayer.axis3_retract
@@ -570,6 +655,8 @@ class Shape(object):
 
         # Save the initial Cutter correction in a variable
         has_reversed = False
+        pocket_blocks = None
+        sub_nr = None
 
         # If the Output Format is DXF do not perform more then one cut.
         if PostPro.vars.General["output_type"] == 'dxf':
@@ -589,47 +676,57 @@ class Shape(object):
         mom_depth = initial_mill_depth
 
         # Move the tool to the start.
-        if self.Pocket == True:
-            mylinegeo = LineGeo(Point(0,0),self.stmove.geos[0].Ps)
-            exstr += mylinegeo.Write_GCode(PostPro)
-        elif self.Drill == True:
-            mylinegeo = LineGeo(Point(0,0),self.stmove.geos[0])
-            exstr += mylinegeo.Write_GCode(PostPro)
-        else:
-            exstr += self.stmove.geos.abs_el(0).Write_GCode(PostPro)
-            
+        if start_move:
+            yield self.Write_GCode_start_move(PostPro)
+
         # Add string to be added before the shape will be cut.
-        exstr += PostPro.write_pre_shape_cut()
+        yield PostPro.write_pre_shape_cut()
 
         # Cutter radius compensation when G41 or G42 is on, AND cutter
         # compensation option is set to be done outside the piece
         if self.cut_cor != 40 and PostPro.vars.General["cc_outside_the_piece"]:
-            exstr += PostPro.set_cut_cor(self.cut_cor)
+            yield PostPro.set_cut_cor(self.cut_cor)
 
-            exstr += PostPro.chg_feed_rate(f_g1_plane)
-            exstr += self.stmove.geos.abs_el(1).Write_GCode(PostPro)
-            exstr += self.stmove.geos.abs_el(2).Write_GCode(PostPro)
+            yield PostPro.chg_feed_rate(f_g1_plane)
+            yield self.stmove.geos.abs_el(1).Write_GCode(PostPro)
+            yield self.stmove.geos.abs_el(2).Write_GCode(PostPro)
 
-        exstr += PostPro.rap_pos_z(
+        yield PostPro.rap_pos_z(
             workpiece_top_Z + abs(safe_margin))  # Compute the safe margin from the initial mill depth
-        exstr += PostPro.chg_feed_rate(f_g1_depth)
-        exstr += PostPro.lin_pol_z(mom_depth)
-        exstr += PostPro.chg_feed_rate(f_g1_plane)
+        yield PostPro.chg_feed_rate(f_g1_depth)
+        yield PostPro.lin_pol_z(mom_depth)
+        yield PostPro.chg_feed_rate(f_g1_plane)
 
         # Cutter radius compensation when G41 or G42 is on, AND cutter
         # compensation option is set to be done inside the piece
         if self.cut_cor != 40 and not PostPro.vars.General["cc_outside_the_piece"]:
-            exstr += PostPro.set_cut_cor(self.cut_cor)
+            yield PostPro.set_cut_cor(self.cut_cor)
+
+            yield self.stmove.geos.abs_el(1).Write_GCode(PostPro)
+            yield self.stmove.geos.abs_el(2).Write_GCode(PostPro)
 
-            exstr += self.stmove.geos.abs_el(1).Write_GCode(PostPro)
-            exstr += self.stmove.geos.abs_el(2).Write_GCode(PostPro)
+        # If there are several slices, the pass may be written only once as a
+        # subroutine, which is called for every slice
+        if PostPro.use_subroutines and self.closed and self.Drill != True and\
+                mom_depth > depth and max_slice != 0.0:
+            if self.Pocket == True:
+                sub_nr = PostPro.write_subroutine(self.Write_GCode_for_pocket(PostPro, None))
+            else:
+                sub_nr = PostPro.write_subroutine("".join(
+                    [self.Write_GCode_for_geo(geo, PostPro) for geo in new_geos.abs_iter()]))
 
         # Write the geometries for the first cut
-        if self.Pocket == True:
-            for geo in self.stmove.geos.abs_iter():
-                exstr += self.Write_GCode_for_geo(geo, PostPro)
-            mylinegeo = LineGeo(self.stmove.geos[-1].Pe,self.stmove.geos[0].Ps)
-            exstr += mylinegeo.Write_GCode(PostPro)
+        if sub_nr is not None:
+            yield PostPro.call_subroutine(sub_nr, mom_depth)
+            if self.Pocket == True:
+                yield self.Write_GCode_pocket_return(PostPro, mom_depth)
+        elif self.Pocket == True:
+            # The XY moves of the pocket are the same for all slices, so they
+            # are formatted once (if the plane moves do not print the depth)
+            pocket_blocks = [] if PostPro.reuse_plane_moves else None
+            yield self.Write_GCode_for_pocket(PostPro, mom_depth, pocket_blocks)
+            pocket_format_time = PostPro.stats.last_format_time
+            yield self.Write_GCode_pocket_return(PostPro, mom_depth)
         elif self.Drill == True:
             #do nothing
             logger.debug(self.tr("Debug: Gcode Drill"))
@@ -639,14 +736,14 @@ class Shape(object):
             myholegeo.R = self.parentLayer.axis3_safe_margin
             myholegeo.DrillType = self.DrillType
             myholegeo.DFeed = self.f_g1_depth
-            exstr += myholegeo.Write_GCode(PostPro) 
+            yield myholegeo.Write_GCode(PostPro) 
         else:
             for geo in new_geos.abs_iter():
-                exstr += self.Write_GCode_for_geo(geo, PostPro)
+                yield self.Write_GCode_for_geo(geo, PostPro)
                 
         # Turning the cutter radius compensation
         if self.cut_cor != 40 and PostPro.vars.General["cancel_cc_for_depth"]:
-            exstr += PostPro.deactivate_cut_cor()
+            yield PostPro.deactivate_cut_cor()
 
         # Numbers of loops
         snr = 0
@@ -658,9 +755,9 @@ class Shape(object):
                 mom_depth = depth
 
             # Erneutes Eintauchen
-            exstr += PostPro.chg_feed_rate(f_g1_depth)
-            exstr += PostPro.lin_pol_z(mom_depth)
-            exstr += PostPro.chg_feed_rate(f_g1_plane)
+            yield PostPro.chg_feed_rate(f_g1_depth)
+            yield PostPro.lin_pol_z(mom_depth)
+            yield PostPro.chg_feed_rate(f_g1_plane)
 
             # If it is not a closed contour
             if not self.closed:
@@ -673,44 +770,47 @@ class Shape(object):
                 # If cutter radius compensation is turned on. Turn it off - because some interpreters cannot handle
                 # a switch
                 if self.cut_cor != 40 and not PostPro.vars.General["cancel_cc_for_depth"]:
-                    exstr += PostPro.deactivate_cut_cor()
-                    exstr += PostPro.set_cut_cor(self.cut_cor)
+                    yield PostPro.deactivate_cut_cor()
+                    yield PostPro.set_cut_cor(self.cut_cor)
 
 
             # If cutter correction is enabled
             if self.cut_cor != 40 and PostPro.vars.General["cancel_cc_for_depth"]:
-                exstr += PostPro.set_cut_cor(self.cut_cor)
+                yield PostPro.set_cut_cor(self.cut_cor)
 
             #for geo in new_geos.abs_iter():
             #    exstr += self.Write_GCode_for_geo(geo, PostPro)
-            if self.Pocket == True:
-                for geo in self.stmove.geos.abs_iter():
-                    exstr += self.Write_GCode_for_geo(geo, PostPro)
+            if sub_nr is not None:
+                yield PostPro.call_subroutine(sub_nr, mom_depth)
+            elif self.Pocket == True and pocket_blocks is not None:
+                yield self.Write_GCode_pocket_blocks(PostPro, mom_depth, pocket_blocks,
+                                                     pocket_format_time)
+            elif self.Pocket == True:
+                yield self.Write_GCode_for_pocket(PostPro, mom_depth)
             else:
                 for geo in new_geos.abs_iter():
-                    exstr += self.Write_GCode_for_geo(geo, PostPro)
+                    yield self.Write_GCode_for_geo(geo, PostPro)
                     
             # Move the tool to the start.
             if self.Pocket == True and mom_depth > depth:
-                mylinegeo = LineGeo(self.stmove.geos[-1].Pe,self.stmove.geos[0].Ps)
-                exstr += mylinegeo.Write_GCode(PostPro)
+                yield self.Write_GCode_pocket_return(PostPro, mom_depth)
                 
             # Turning off the cutter radius compensation if needed
             if self.cut_cor != 40 and PostPro.vars.General["cancel_cc_for_depth"]:
-                exstr += PostPro.deactivate_cut_cor()
+                yield PostPro.deactivate_cut_cor()
 
             # Turning off the cutter radius compensation if needed
             if self.cut_cor != 40 and PostPro.vars.General["cancel_cc_for_depth"]:
-                exstr += PostPro.deactivate_cut_cor()
+                yield PostPro.deactivate_cut_cor()
 
         # Do the tool retraction
-        exstr += PostPro.chg_feed_rate(f_g1_depth)
-        exstr += PostPro.lin_pol_z(workpiece_top_Z + abs(safe_margin))
-        exstr += PostPro.rap_pos_z(safe_retract_depth)
+        yield PostPro.chg_feed_rate(f_g1_depth)
+        yield PostPro.lin_pol_z(workpiece_top_Z + abs(safe_margin))
+        yield PostPro.rap_pos_z(safe_retract_depth)
 
         # If cutter radius compensation is turned on.
         if self.cut_cor != 40 and not PostPro.vars.General["cancel_cc_for_depth"]:
-            exstr += PostPro.deactivate_cut_cor()
+            yield PostPro.deactivate_cut_cor()
 
         # Initial value of direction restored if necessary
         if has_reversed:
@@ -720,22 +820,19 @@ class Shape(object):
         self.cut_cor = prv_cut_cor
 
         # Add string to be added before the shape will be cut.
-        exstr += PostPro.write_post_shape_cut()
+        yield PostPro.write_post_shape_cut()
 
-        return exstr
-
-    def Write_GCode_Drag_Knife(self, PostPro):
+    def Write_GCode_blocks_Drag_Knife(self, PostPro, start_move=True):
         """
-        This method returns the string to be exported for this shape, including
+        This method yields the blocks to be exported for this shape, including
         the defined start and end move of the shape. This function is used for
         Drag Knife cutting machine only.
         @param PostPro: this is the Postprocessor class including the methods
         to export
+        @param start_move: If False the move to the start of the shape is
+        omitted
         """
 
-        # initialisation of the string
-        exstr = ""
-
         # Get the mill settings defined in the GUI
         safe_retract_depth = self.parentLayer.axis3_retract
         safe_margin = self.parentLayer.axis3_safe_margin
@@ -751,60 +848,59 @@ class Shape(object):
         drag_depth = self.axis3_slice_depth
 
         # Move the tool to the start.
-        exstr += self.stmove.geos.abs_el(0).Write_GCode(PostPro)
+        if start_move:
+            yield self.stmove.geos.abs_el(0).Write_GCode(PostPro)
 
         # Add string to be added before the shape will be cut.
-        exstr += PostPro.write_pre_shape_cut()
+        yield PostPro.write_pre_shape_cut()
 
         # Move into workpiece and start cutting into Z
-        exstr += PostPro.rap_pos_z(
+        yield PostPro.rap_pos_z(
             workpiece_top_Z + abs(safe_margin))  # Compute the safe margin from the initial mill depth
-        exstr += PostPro.chg_feed_rate(f_g1_depth)
+        yield PostPro.chg_feed_rate(f_g1_depth)
 
         # Write the geometries for the first cut
         if isinstance(self.stmove.geos.abs_el(1), ArcGeo):
             if self.stmove.geos.abs_el(1).drag:
-                exstr += PostPro.lin_pol_z(drag_depth)
+                yield PostPro.lin_pol_z(drag_depth)
                 drag = True
             else:
-                exstr += PostPro.lin_pol_z(mom_depth)
+                yield PostPro.lin_pol_z(mom_depth)
                 drag = False
         else:
-            exstr += PostPro.lin_pol_z(mom_depth)
+            yield PostPro.lin_pol_z(mom_depth)
             drag = False
-        exstr += PostPro.chg_feed_rate(f_g1_plane)
+        yield PostPro.chg_feed_rate(f_g1_plane)
 
-        exstr += self.stmove.geos.abs_el(1).Write_GCode(PostPro)
+        yield self.stmove.geos.abs_el(1).Write_GCode(PostPro)
 
         for geo in Geos(self.stmove.geos[2:]).abs_iter():
             if isinstance(geo, ArcGeo):
                 if geo.drag:
-                    exstr += PostPro.chg_feed_rate(f_g1_depth)
-                    exstr += PostPro.lin_pol_z(drag_depth)
-                    exstr += PostPro.chg_feed_rate(f_g1_plane)
+                    yield PostPro.chg_feed_rate(f_g1_depth)
+                    yield PostPro.lin_pol_z(drag_depth)
+                    yield PostPro.chg_feed_rate(f_g1_plane)
                     drag = True
                 elif drag:
-                    exstr += PostPro.chg_feed_rate(f_g1_depth)
-                    exstr += PostPro.lin_pol_z(mom_depth)
-                    exstr += PostPro.chg_feed_rate(f_g1_plane)
+                    yield PostPro.chg_feed_rate(f_g1_depth)
+                    yield PostPro.lin_pol_z(mom_depth)
+                    yield PostPro.chg_feed_rate(f_g1_plane)
                     drag = False
             elif drag:
-                exstr += PostPro.chg_feed_rate(f_g1_depth)
-                exstr += PostPro.lin_pol_z(mom_depth)
-                exstr += PostPro.chg_feed_rate(f_g1_plane)
+                yield PostPro.chg_feed_rate(f_g1_depth)
+                yield PostPro.lin_pol_z(mom_depth)
+                yield PostPro.chg_feed_rate(f_g1_plane)
                 drag = False
 
-            exstr += self.Write_GCode_for_geo(geo, PostPro)
+            yield self.Write_GCode_for_geo(geo, PostPro)
 
         # Do the tool retraction
-        exstr += PostPro.chg_feed_rate(f_g1_depth)
-        exstr += PostPro.lin_pol_z(workpiece_top_Z + abs(safe_margin))
-        exstr += PostPro.rap_pos_z(safe_retract_depth)
+        yield PostPro.chg_feed_rate(f_g1_depth)
+        yield PostPro.lin_pol_z(workpiece_top_Z + abs(safe_margin))
+        yield PostPro.rap_pos_z(safe_retract_depth)
 
         # Add string to be added before the shape will be cut.
-        exstr += PostPro.write_post_shape_cut()
-
-        return exstr
+        yield PostPro.write_post_shape_cut()
 
     def join_colinear_lines(self):
         """
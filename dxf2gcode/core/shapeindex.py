@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+from bisect import bisect_left, bisect_right
+import logging
+
+import numpy as np
+
+from dxf2gcode.core.arcgeo import ArcGeo
+from dxf2gcode.core.customgcode import CustomGCode
+
+logger = logging.getLogger('core.shapeindex')
+
+# Number of segments used to approximate an arc for the point in polygon test
+arc_segments = 16
+
+
+def polygon_points(geos):
+    """
+    Approximates the given geometries by a polygon. Arcs are divided into
+    segments.
+    @param geos: Iterable of LineGeos and ArcGeos (absolute coordinates)
+    @return: List of the polygon's points
+    """
+    points = []
+    for geo in geos:
+        points.append(geo.Ps)
+        if isinstance(geo, ArcGeo):
+            for i in range(1, arc_segments):
+                points.append(geo.get_point_from_start(i, arc_segments))
+    return points
+
+
+def point_in_polygon(point, points):
+    """
+    Checks with the crossing number method if the point is inside of the
+    closed polygon.
+    @param point: The point which shall be checked
+    @param points: The points of the polygon
+    @return: Returns true or false
+    """
+    inside = False
+    prv = points[-1]
+    for cur in points:
+        if (cur.y > point.y) != (prv.y > point.y):
+            x = prv.x + (point.y - prv.y) * (cur.x - prv.x) / (cur.y - prv.y)
+            if point.x < x:
+                inside = not inside
+        prv = cur
+    return inside
+
+
+def point_in_geos(point, geos):
+    """
+    Checks if the point is inside of the closed contour given by the geos.
+    @param point: The point which shall be checked
+    @param geos: Iterable of LineGeos and ArcGeos (absolute coordinates)
+    @return: Returns true or false
+    """
+    points = polygon_points(geos)
+    return len(points) > 2 and point_in_polygon(point, points)
+
+
+def edges_cross(points, other):
+    """
+    Checks if an edge of the first closed polygon crosses an edge of the
+    second one. Edges which only touch each other do not count.
+    @param points: Array (n x 2) of the points of the first polygon
+    @param other: Array (m x 2) of the points of the second polygon
+    @return: Returns true or false
+    """
+    a0, a1 = points, np.roll(points, -1, axis=0)
+    b0, b1 = other, np.roll(other, -1, axis=0)
+
+    # Only the edges of the second polygon near the first one are of interest
+    lo, hi = points.min(axis=0), points.max(axis=0)
+    near = (np.maximum(b0, b1) >= lo).all(axis=1) & (np.minimum(b0, b1) <= hi).all(axis=1)
+    b0, b1 = b0[near], b1[near]
+    if len(b0) == 0:
+        return False
+
+    def side(p0, p1, q):
+        # Sign of the cross product, i.e. on which side of p0-p1 q lies
+        d = p1 - p0
+        return np.sign(d[..., 0] * (q[..., 1] - p0[..., 1]) - d[..., 1] * (q[..., 0] - p0[..., 0]))
+
+    a0, a1 = a0[:, np.newaxis], a1[:, np.newaxis]
+    return bool(((side(a0, a1, b0) * side(a0, a1, b1) < 0) &
+                 (side(b0, b1, a0) * side(b0, b1, a1) < 0)).any())
+
+
+class ShapeIndex(object):
+    """
+    Containment index over the bounding boxes of the closed shapes of a layer.
+    The shapes are sorted by the left border of their bounding box, so the
+    candidates which may be contained in a shape are found by bisection and
+    then filtered by their bounding boxes. Candidates are confirmed by an
+    exact polygon test. The containment only depends on the geometry, so it
+    is cached; the Pocket and disable flags are evaluated on each query.
+    """
+
+    def __init__(self, shapes):
+        """
+        Standard method to initialize the class
+        @param shapes: The shapes of the layer (CustomGCodes and open shapes
+        are ignored)
+        """
+        self.count = len(shapes)
+        self.shapes = []
+        for shape in shapes:
+            if isinstance(shape, CustomGCode) or not shape.closed or len(shape.geos) == 0:
+                continue
+            shape.calc_bounding_box()
+            self.shapes.append(shape)
+
+        self.shapes.sort(key=lambda shape: shape.BB.Ps.x)
+        self.xmin = [shape.BB.Ps.x for shape in self.shapes]
+        self.bbs = np.array([(shape.BB.Ps.x, shape.BB.Ps.y, shape.BB.Pe.x, shape.BB.Pe.y)
+                             for shape in self.shapes], dtype=float).reshape(-1, 4)
+        self.polygons = {}
+        self.arrays = {}
+        self.contained = {}
+        self.pairs = {}
+
+    def get_polygon(self, shape):
+        """
+        Returns the (cached) polygon approximation of the shape.
+        @param shape: The shape
+        @return: List of the polygon's points
+        """
+        if shape not in self.polygons:
+            self.polygons[shape] = polygon_points(shape.geos.abs_iter())
+        return self.polygons[shape]
+
+    def get_array(self, shape):
+        """
+        Returns the (cached) polygon approximation of the shape as array.
+        @param shape: The shape
+        @return: Array (n x 2) of the polygon's points
+        """
+        if shape not in self.arrays:
+            self.arrays[shape] = np.array([(point.x, point.y) for point in self.get_polygon(shape)],
+                                          dtype=float).reshape(-1, 2)
+        return self.arrays[shape]
+
+    def is_contained(self, shape, outer):
+        """
+        Checks if the shape lies within the outer shape: its bounding box is
+        within the one of the outer shape, its first point is inside of the
+        outer shape and none of its edges crosses the outer shape.
+        @param shape: The shape which shall be checked
+        @param outer: The outer shape
+        @return: Returns true or false
+        """
+        if shape is outer or not shape.BB.iscontained(outer.BB):
+            return False
+        key = (shape, outer)
+        if key not in self.pairs:
+            self.pairs[key] = len(self.get_polygon(outer)) > 2 and\
+                point_in_polygon(shape.geos.abs_el(0).Ps, self.get_polygon(outer)) and\
+                not edges_cross(self.get_array(shape), self.get_array(outer))
+        return self.pairs[key]
+
+    def within(self, outer):
+        """
+        Returns all shapes which lie within the outer shape, also the disabled
+        ones. The result is cached since it only depends on the geometry.
+        @param outer: The outer shape
+        @return: List of the contained shapes
+        """
+        if outer not in self.contained:
+            outer.calc_bounding_box()
+            first = bisect_left(self.xmin, outer.BB.Ps.x)
+            last = bisect_right(self.xmin, outer.BB.Pe.x)
+            bbs = self.bbs[first:last]
+            nrs = np.flatnonzero((bbs[:, 2] < outer.BB.Pe.x) &
+                                 (bbs[:, 1] > outer.BB.Ps.y) & (bbs[:, 3] < outer.BB.Pe.y))
+            self.contained[outer] = [self.shapes[first + nr] for nr in nrs.tolist()
+                                     if self.is_contained(self.shapes[first + nr], outer)]
+        return self.contained[outer]
+
+    def contained_shapes(self, outer):
+        """
+        Returns all enabled shapes which lie within the outer shape.
+        @param outer: The outer shape
+        @return: List of the contained shapes
+        """
+        return [shape for shape in self.within(outer) if not shape.isDisabled()]
+
+    def islands(self, outer):
+        """
+        Returns the islands of a pocket, i.e. the outermost shapes within the
+        outer shape. Shapes which are pockets themselves are cleared anyhow and
+        therefore no islands.
+        @param outer: The shape of the pocket
+        @return: List of the island shapes
+        """
+        candidates = [shape for shape in self.contained_shapes(outer)
+                      if not shape.Pocket]
+        candidates.sort(key=lambda shape: (shape.BB.Pe.x - shape.BB.Ps.x) *
+                        (shape.BB.Pe.y - shape.BB.Ps.y), reverse=True)
+
+        islands = []
+        inside = set()
+        for shape in candidates:
+            if shape not in inside:
+                islands.append(shape)
+                inside.update(self.within(shape))
+        return islands
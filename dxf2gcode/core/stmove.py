@@ -40,6 +40,9 @@ from dxf2gcode.core.intersect import Intersect
 from dxf2gcode.core.shape import Geos
 from dxf2gcode.core.shape import Shape
 from dxf2gcode.core.shapeoffset import *
+from dxf2gcode.core.pocketmill import PocketMill
+from dxf2gcode.core.adaptiveclearing import AdaptiveClearing
+from dxf2gcode.core.zigzagpocket import ZigZagPocket
 
 import logging
 logger = logging.getLogger('core.stmove')
@@ -49,7 +52,10 @@ class StMove(object):
     """
     This Function generates the StartMove for each shape. It
     also performs the Plotting and Export of this moves. It is linked
-    to the shape of its parent
+    to the shape of its parent.
+    The moves are generated on the first access of the geometries (export,
+    route or selection display) and only generated again if the shape has
+    changed since, see get_state.
     """
     # only need default arguments here because of the change of usage with super in QGraphicsLineItem
     def __init__(self, shape=None):
@@ -57,11 +63,96 @@ class StMove(object):
             return
 
         self.shape = shape
+        self.state = None
 
-        self.start, self.angle = self.shape.get_start_end_points(True, True)
-        self.end = self.start
+    @property
+    def geos(self):
+        """
+        The geometries of the start move (or of the pocket toolpath).
+        """
+        self.update_start_moves()
+        return self._geos
+
+    @geos.setter
+    def geos(self, geos):
+        self._geos = geos
+
+    @property
+    def islands(self):
+        """
+        The islands spared by the pocket toolpath.
+        """
+        self.update_start_moves()
+        return self._islands
+
+    @islands.setter
+    def islands(self, islands):
+        self._islands = islands
 
-        self.make_start_moves()
+    @property
+    def return_geos(self):
+        """
+        The move from the end back to the start of the pocket toolpath
+        between the slices: the geometries of the move, or None if the tool
+        has to lift.
+        """
+        self.update_start_moves()
+        return self._return_geos
+
+    @return_geos.setter
+    def return_geos(self, return_geos):
+        self._return_geos = return_geos
+
+    def get_state(self):
+        """
+        Returns the values the start move depends on: the direction, the start
+        point, the cutter compensation, the pocket flag, the stepover and the
+        tool radius of the shape. In addition the start radius, the machine
+        type and the pocketing options are included. For a pocket also its
+        islands are included, i.e. the shapes and their geometry; they change
+        if a shape within the pocket is (no longer) a pocket or disabled.
+        @return: Tuple of the values
+        """
+        start, angle = self.shape.get_start_end_points(True, True)
+        layer = self.shape.parentLayer
+        pocketing = g.config.vars.Pocketing
+        if self.shape.Pocket:
+            islands = tuple((island, island.cw, id(island.geos), len(island.geos))
+                            for island in layer.getIslands(self.shape))
+        else:
+            islands = ()
+        return (self.shape.cw, start.x, start.y, angle, self.shape.cut_cor,
+                self.shape.Pocket, self.shape.OffsetXY, layer.getToolRadius(),
+                layer.start_radius, g.config.machine_type, pocketing['strategy'],
+                pocketing['max_engagement'], pocketing['zigzag_angle'],
+                pocketing['zigzag_finish'], islands)
+
+    def update_start_moves(self):
+        """
+        Generates the start move if it was not generated yet or if the shape
+        has changed since.
+        """
+        state = self.get_state()
+        if state != self.state:
+            self.state = state
+            self.start, self.angle = self.shape.get_start_end_points(True, True)
+            self.end = self.start
+            self.make_start_moves()
+
+    def reuse(self, other):
+        """
+        Takes over the start move generated by another instance for the same
+        shape (e.g. when the shape is plotted again). It is generated again
+        on the next access if the shape has changed since.
+        @param other: The other StMove instance
+        """
+        if other.state is not None:
+            self.state = other.state
+            self.start, self.angle, self.end = other.start, other.angle, other.end
+            self._geos = other._geos
+            self._islands = other._islands
+            self._return_geos = other._return_geos
+            self.engagement_stats = other.engagement_stats
 
     def append(self, geo):
         # we don't want to additional scale / rotate the stmove geo
@@ -75,6 +166,9 @@ class StMove(object):
         be generated based on the given values for start and angle.
         """
         self.geos = Geos([])
+        self.islands = []
+        self.return_geos = None
+        self.engagement_stats = []
 
         if g.config.machine_type == 'drag_knife':
             self.make_swivelknife_move()
@@ -98,205 +192,44 @@ class StMove(object):
 
         # Pocket Milling - draw toolpath
         if self.shape.Pocket == True:
-            #for circular pocket
-            if isinstance(self.shape.geos[0],ArcGeo):
-                numberofrotations = int((self.shape.geos[0].r - tool_rad)/self.shape.OffsetXY)-1
-                if ((self.shape.geos[0].r - tool_rad)/self.shape.OffsetXY)> numberofrotations :
-                    numberofrotations += 1
-                logger.debug("stmove:make_start_moves:Tool Radius: %f" % (tool_rad))
-                logger.debug("stmove:make_start_moves:StepOver XY: %f" % (self.shape.OffsetXY))
-                logger.debug("stmove:make_start_moves:Shape Radius: %f" % (self.shape.geos[0].r))
-                logger.debug("stmove:make_start_moves:Shape Origin at: %f,%f" % (self.shape.geos[0].O.x, self.shape.geos[0].O.y))
-                logger.debug("stmove:make_start_moves:Number of Arcs: %f" % (numberofrotations+1))
-                for i in range(0, numberofrotations + 1):
-                    st_point = Point(self.shape.geos[0].O.x,self.shape.geos[0].O.y)
-                    Ps_point = Point(self.shape.geos[0].O.x +(tool_rad + (i*self.shape.OffsetXY)) ,self.shape.geos[0].O.y)
-                    Pe_point = Ps_point
-                    if ((Ps_point.x - self.shape.geos[0].O.x + tool_rad) < self.shape.geos[0].r):
-                        self.append(ArcGeo(Ps=Ps_point, Pe=Pe_point, O=st_point, r=(tool_rad + (i*self.shape.OffsetXY)), direction=direction))
-                    else:
-                        Ps_point = Point(self.shape.geos[0].O.x + self.shape.geos[0].r - tool_rad  ,self.shape.geos[0].O.y)
-                        Pe_point = Ps_point
-                        self.append(ArcGeo(Ps=Ps_point, Pe=Pe_point, O=st_point, r=(Ps_point.x - self.shape.geos[0].O.x), direction=direction))
-                    logger.debug("stmove:make_start_moves:Toolpath Arc at: %f,%f" % (Ps_point.x,Ps_point.x))   
-                    if i<numberofrotations:
-                        st_point = Point(Ps_point.x,Ps_point.y)
-                        if ((Ps_point.x + self.shape.OffsetXY - self.shape.geos[0].O.x + tool_rad) < self.shape.geos[0].r):
-                            en_point = Point(Ps_point.x + self.shape.OffsetXY,Ps_point.y)
-                        else:
-                            en_point = Point(self.shape.geos[0].O.x + self.shape.geos[0].r - tool_rad,Ps_point.y)
-                            
-                        self.append(LineGeo(st_point,en_point))
-            
-            #for rectangular pocket
-            if isinstance(self.shape.geos[0],LineGeo):
-                #get Rectangle width and height
-                firstgeox = abs(self.shape.geos[0].Ps.x - self.shape.geos[0].Pe.x)
-                firstgeoy = abs(self.shape.geos[0].Ps.y - self.shape.geos[0].Pe.y)
-                secondgeox = abs(self.shape.geos[1].Ps.x - self.shape.geos[1].Pe.x)
-                secondgeoy = abs(self.shape.geos[1].Ps.y - self.shape.geos[1].Pe.y)
-                if firstgeox > secondgeox:
-                    Pocketx = firstgeox
-                    if self.shape.geos[0].Ps.x < self.shape.geos[0].Pe.x:
-                        minx = self.shape.geos[0].Ps.x
-                    else:
-                        minx = self.shape.geos[0].Pe.x
-                else:
-                    Pocketx = secondgeox
-                    if self.shape.geos[1].Ps.x < self.shape.geos[1].Pe.x:
-                        minx = self.shape.geos[1].Ps.x
-                    else:
-                        minx = self.shape.geos[1].Pe.x
-                if firstgeoy > secondgeoy:
-                    Pockety = firstgeoy
-                    if self.shape.geos[0].Ps.y < self.shape.geos[0].Pe.y:
-                        miny = self.shape.geos[0].Ps.y
-                    else:
-                        miny = self.shape.geos[0].Pe.y
+            self.islands = self.shape.parentLayer.getIslands(self.shape)
+
+            #for spirals, pockets with islands and any other closed shape
+            if self.shape.usesPocketEngine():
+                strategy = g.config.vars.Pocketing['strategy']
+                if strategy == 'adaptive':
+                    pocket = AdaptiveClearing(self.shape, tool_rad, self.shape.OffsetXY, self.islands,
+                                              g.config.vars.Pocketing['max_engagement'])
+                    toolpath = pocket.toolpath(direction)
+                elif strategy == 'zigzag':
+                    pocket = ZigZagPocket(self.shape, tool_rad, self.shape.OffsetXY, self.islands,
+                                          g.config.vars.Pocketing['zigzag_angle'],
+                                          g.config.vars.Pocketing['zigzag_finish'])
+                    toolpath = pocket.toolpath(direction)
                 else:
-                    Pockety = secondgeoy
-                    if self.shape.geos[1].Ps.y < self.shape.geos[1].Pe.y:
-                        miny = self.shape.geos[1].Ps.y
+                    pocket = PocketMill(self.shape, tool_rad, self.shape.OffsetXY, self.islands)
+                    if strategy == 'spiral':
+                        toolpath = pocket.spiral_toolpath(direction)
                     else:
-                        miny = self.shape.geos[1].Pe.y
-                Centerpt = Point(Pocketx/2 + minx, Pockety/2 +miny)
-                # calc number of rotations
-                if Pockety > Pocketx:
-                    numberofrotations = int(((Pocketx/2) - tool_rad)/self.shape.OffsetXY)#+1
-                    if (((Pocketx/2) - tool_rad)/self.shape.OffsetXY)> int(((Pocketx/2) - tool_rad)/self.shape.OffsetXY)+0.5 :
-                        numberofrotations += 1
-                else:
-                    numberofrotations = int(((Pockety/2) - tool_rad)/self.shape.OffsetXY)#+1
-                    if (((Pockety/2) - tool_rad)/self.shape.OffsetXY)> int(((Pockety/2) - tool_rad)/self.shape.OffsetXY)+0.5 :
-                        numberofrotations += 1
-                logger.debug("stmove:make_start_moves:Shape Center at: %f,%f" % (Centerpt.x, Centerpt.y))        
-                for i in range(0, numberofrotations):
-                    # for CCW Climb milling
-                    if Pockety > Pocketx: 
-                        if (Centerpt.y - (Pockety-Pocketx)/2 - (tool_rad + (i*self.shape.OffsetXY)) - tool_rad >= miny):
-                            Ps_point1 = Point(Centerpt.x +(tool_rad + (i*self.shape.OffsetXY)) ,Centerpt.y + ((Pockety-Pocketx)/2 +(tool_rad + (i*self.shape.OffsetXY))) )
-                            Pe_point1 = Point(Centerpt.x -(tool_rad + (i*self.shape.OffsetXY)) ,Centerpt.y + ((Pockety-Pocketx)/2 +(tool_rad + (i*self.shape.OffsetXY))) )
-                            Ps_point2 = Pe_point1
-                            Pe_point2 = Point(Centerpt.x -(tool_rad + (i*self.shape.OffsetXY)) ,Centerpt.y - ((Pockety-Pocketx)/2 +(tool_rad + (i*self.shape.OffsetXY))) )
-                            Ps_point3 = Pe_point2
-                            Pe_point3 = Point(Centerpt.x +(tool_rad + (i*self.shape.OffsetXY)) ,Centerpt.y - ((Pockety-Pocketx)/2 +(tool_rad + (i*self.shape.OffsetXY))) )
-                            Ps_point4 = Pe_point3
-                            Pe_point4 = Ps_point1
-                        else:
-                            Ps_point1 = Point(Centerpt.x + Pocketx/2 - tool_rad ,Centerpt.y + Pockety/2 - tool_rad )
-                            Pe_point1 = Point(Centerpt.x - Pocketx/2 + tool_rad ,Centerpt.y + Pockety/2 - tool_rad )
-                            Ps_point2 = Pe_point1
-                            Pe_point2 = Point(Centerpt.x - Pocketx/2 + tool_rad ,Centerpt.y - Pockety/2 + tool_rad )
-                            Ps_point3 = Pe_point2
-                            Pe_point3 = Point(Centerpt.x + Pocketx/2 - tool_rad ,Centerpt.y - Pockety/2 + tool_rad )
-                            Ps_point4 = Pe_point3
-                            Pe_point4 = Ps_point1
-                        logger.debug("stmove:make_start_moves:Starting point at: %f,%f" % (Ps_point1.x, Ps_point1.y))
-                        if direction == 1: # this is CCW
-                            self.append(LineGeo(Ps_point1,Pe_point1))
-                            self.append(LineGeo(Ps_point2,Pe_point2))
-                            self.append(LineGeo(Ps_point3,Pe_point3))
-                            self.append(LineGeo(Ps_point4,Pe_point4))
-                        else: # this is CW
-                            self.append(LineGeo(Pe_point4,Ps_point4))
-                            self.append(LineGeo(Pe_point3,Ps_point3))
-                            self.append(LineGeo(Pe_point2,Ps_point2))
-                            self.append(LineGeo(Pe_point1,Ps_point1))
-                            
-                        if i<numberofrotations-1:
-                            if direction == 1: # this is CCW
-                                st_point = Point(Ps_point1.x,Ps_point1.y)
-                            else: # this is CW
-                                st_point = Point(Pe_point4.x,Pe_point4.y)
-                            if (Centerpt.y - (Pockety-Pocketx)/2 - (tool_rad + ((i+1)*self.shape.OffsetXY)) - tool_rad >= miny):
-                                en_point = Point(Ps_point1.x + self.shape.OffsetXY,Ps_point1.y + self.shape.OffsetXY)
-                            else:
-                                en_point = Point(Centerpt.x + Pocketx/2 - tool_rad,Centerpt.y + Pockety/2 - tool_rad)
-                                 
-                            self.append(LineGeo(st_point,en_point))
-                    elif Pocketx > Pockety:
-                        if (Centerpt.x - (Pocketx-Pockety)/2 - (tool_rad + (i*self.shape.OffsetXY)) - tool_rad >= minx):
-                            Ps_point1 = Point(Centerpt.x + ((Pocketx-Pockety)/2 +(tool_rad + (i*self.shape.OffsetXY))) ,Centerpt.y + (tool_rad + (i*self.shape.OffsetXY)) )
-                            Pe_point1 = Point(Centerpt.x - ((Pocketx-Pockety)/2 +(tool_rad + (i*self.shape.OffsetXY))) ,Centerpt.y + (tool_rad + (i*self.shape.OffsetXY)) )
-                            Ps_point2 = Pe_point1
-                            Pe_point2 = Point(Centerpt.x - ((Pocketx-Pockety)/2 +(tool_rad + (i*self.shape.OffsetXY))) ,Centerpt.y - (tool_rad + (i*self.shape.OffsetXY)) )
-                            Ps_point3 = Pe_point2
-                            Pe_point3 = Point(Centerpt.x + ((Pocketx-Pockety)/2 +(tool_rad + (i*self.shape.OffsetXY))) ,Centerpt.y - (tool_rad + (i*self.shape.OffsetXY)) )
-                            Ps_point4 = Pe_point3
-                            Pe_point4 = Ps_point1
-                        else:
-                            Ps_point1 = Point(Centerpt.x + Pocketx/2 - tool_rad ,Centerpt.y + Pockety/2 - tool_rad )
-                            Pe_point1 = Point(Centerpt.x - Pocketx/2 + tool_rad ,Centerpt.y + Pockety/2 - tool_rad )
-                            Ps_point2 = Pe_point1
-                            Pe_point2 = Point(Centerpt.x - Pocketx/2 + tool_rad ,Centerpt.y - Pockety/2 + tool_rad )
-                            Ps_point3 = Pe_point2
-                            Pe_point3 = Point(Centerpt.x + Pocketx/2 - tool_rad ,Centerpt.y - Pockety/2 + tool_rad )
-                            Ps_point4 = Pe_point3
-                            Pe_point4 = Ps_point1
-                        logger.debug("stmove:make_start_moves:Starting point at: %f,%f" % (Ps_point1.x, Ps_point1.y))
-                        if direction == 1: # this is CCW
-                            self.append(LineGeo(Ps_point1,Pe_point1))
-                            self.append(LineGeo(Ps_point2,Pe_point2))
-                            self.append(LineGeo(Ps_point3,Pe_point3))
-                            self.append(LineGeo(Ps_point4,Pe_point4))
-                        else: # this is CW
-                            self.append(LineGeo(Pe_point4,Ps_point4))
-                            self.append(LineGeo(Pe_point3,Ps_point3))
-                            self.append(LineGeo(Pe_point2,Ps_point2))
-                            self.append(LineGeo(Pe_point1,Ps_point1))
-                        if i<numberofrotations-1:
-                            if direction == 1: # this is CCW
-                                st_point = Point(Ps_point1.x,Ps_point1.y)
-                            else: # this is CW
-                                st_point = Point(Pe_point4.x,Pe_point4.y)
-                            if (Centerpt.x - (Pocketx-Pockety)/2 - (tool_rad + ((i+1)*self.shape.OffsetXY)) - tool_rad >= minx):
-                                en_point = Point(Ps_point1.x + self.shape.OffsetXY,Ps_point1.y + self.shape.OffsetXY)
-                            else:
-                                en_point = Point(Centerpt.x + Pocketx/2 - tool_rad,Centerpt.y + Pockety/2 - tool_rad)
-                                 
-                            self.append(LineGeo(st_point,en_point))
-                    elif Pocketx == Pockety:
-                        if (Centerpt.x - (tool_rad + (i*self.shape.OffsetXY)) - tool_rad >= minx):
-                            Ps_point1 = Point(Centerpt.x + (tool_rad + (i*self.shape.OffsetXY)) ,Centerpt.y + (tool_rad + (i*self.shape.OffsetXY)) )
-                            Pe_point1 = Point(Centerpt.x - (tool_rad + (i*self.shape.OffsetXY)) ,Centerpt.y + (tool_rad + (i*self.shape.OffsetXY)) )
-                            Ps_point2 = Pe_point1
-                            Pe_point2 = Point(Centerpt.x - (tool_rad + (i*self.shape.OffsetXY)) ,Centerpt.y - (tool_rad + (i*self.shape.OffsetXY)) )
-                            Ps_point3 = Pe_point2
-                            Pe_point3 = Point(Centerpt.x + (tool_rad + (i*self.shape.OffsetXY)) ,Centerpt.y - (tool_rad + (i*self.shape.OffsetXY)) )
-                            Ps_point4 = Pe_point3
-                            Pe_point4 = Ps_point1
-                        else:
-                            Ps_point1 = Point(Centerpt.x + Pocketx/2 - tool_rad ,Centerpt.y + Pockety/2 - tool_rad )
-                            Pe_point1 = Point(Centerpt.x - Pocketx/2 + tool_rad ,Centerpt.y + Pockety/2 - tool_rad )
-                            Ps_point2 = Pe_point1
-                            Pe_point2 = Point(Centerpt.x - Pocketx/2 + tool_rad ,Centerpt.y - Pockety/2 + tool_rad )
-                            Ps_point3 = Pe_point2
-                            Pe_point3 = Point(Centerpt.x + Pocketx/2 - tool_rad ,Centerpt.y - Pockety/2 + tool_rad )
-                            Ps_point4 = Pe_point3
-                            Pe_point4 = Ps_point1
-                        logger.debug("stmove:make_start_moves:Starting point at: %f,%f" % (Ps_point1.x, Ps_point1.y)) 
-                        if direction == 1: # this is CCW
-                            self.append(LineGeo(Ps_point1,Pe_point1))
-                            self.append(LineGeo(Ps_point2,Pe_point2))
-                            self.append(LineGeo(Ps_point3,Pe_point3))
-                            self.append(LineGeo(Ps_point4,Pe_point4))
-                        else: # this is CW
-                            self.append(LineGeo(Pe_point4,Ps_point4))
-                            self.append(LineGeo(Pe_point3,Ps_point3))
-                            self.append(LineGeo(Pe_point2,Ps_point2))
-                            self.append(LineGeo(Pe_point1,Ps_point1))
-                        if i<numberofrotations-1:
-                            if direction == 1: # this is CCW
-                                st_point = Point(Ps_point1.x,Ps_point1.y)
-                            else: # this is CW
-                                st_point = Point(Pe_point4.x,Pe_point4.y)
-                            if (Centerpt.x - (tool_rad + ((i+1)*self.shape.OffsetXY)) - tool_rad >= minx):
-                                en_point = Point(Ps_point1.x + self.shape.OffsetXY,Ps_point1.y + self.shape.OffsetXY)
-                            else:
-                                en_point = Point(Centerpt.x + Pocketx/2 - tool_rad,Centerpt.y + Pockety/2 - tool_rad)
-                                 
-                            self.append(LineGeo(st_point,en_point))
-                      
+                        toolpath = pocket.toolpath(direction)
+                for geo in toolpath:
+                    # Points are lift moves between separated parts of the pocket
+                    self.append(RapidPos(geo) if isinstance(geo, Point) else geo)
+                if strategy == 'adaptive':
+                    self.engagement_stats = pocket.stats
+                # The toolpath may end anywhere, so the tool only moves
+                # straight back to the start if the move stays inside
+                if strategy in ('adaptive', 'zigzag') and len(self.geos):
+                    self.return_geos = pocket.return_path(self.geos.abs_el(-1).Pe,
+                                                          self.geos.abs_el(0).Ps)
+
+            #for circular and rectangular pockets
+            else:
+                for geo in self.shape.get_pocket_rings().toolpath(direction):
+                    self.append(geo)
+                if len(self.geos):
+                    self.return_geos = [LineGeo(self.geos.abs_el(-1).Pe, self.geos.abs_el(0).Ps)]
+
         ### drill cutted from here
             
         if self.shape.cut_cor == 40:
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+from math import ceil, cos, sin, pi, radians
+import logging
+
+import numpy as np
+
+from dxf2gcode.core.linegeo import LineGeo
+from dxf2gcode.core.arcgeo import ArcGeo
+from dxf2gcode.core.point import Point
+from dxf2gcode.core.pocketmill import PocketMill
+
+logger = logging.getLogger('core.zigzagpocket')
+
+eps = 1e-6
+
+
+class ZigZagPocket(object):
+    """
+    Raster (zig-zag) pocketing. The region the centre of the tool may reach is
+    bounded by the first ring of the contour parallel strategy (the walls and
+    islands offset by the tool radius). It is cut by parallel scanlines in one
+    vectorized pass; the pieces of neighbouring scanlines are connected
+    boustrophedon style as long as the connecting move stays within the
+    region. An optional finishing pass along the walls removes the scallops
+    left by the scanlines.
+    """
+
+    def __init__(self, shape, tool_rad, stepover, islands=None, angle=0.0, finish=True):
+        """
+        Standard method to initialize the class
+        @param shape: The closed shape which shall be pocketed
+        @param tool_rad: The radius of the tool
+        @param stepover: The maximal distance between two scanlines
+        @param islands: Closed shapes within the pocket which shall be spared
+        @param angle: The angle of the scanlines in degrees
+        @param finish: If True a finishing pass along the walls is added
+        """
+        self.shape = shape
+        self.tool_rad = tool_rad
+        self.stepover = stepover
+        self.islands = islands or []
+        self.angle = radians(angle)
+        self.finish = finish
+
+    def toolpath(self, direction=-1):
+        """
+        Generator which yields the zig-zag toolpath of the pocket.
+        @param direction: -1 for CW, 1 for CCW finishing pass
+        @return: Yields the geometries of the toolpath and Points for lifts
+        """
+        if self.stepover <= 0.0:
+            logger.error("Pocket stepover must be greater than zero (shape %s)"
+                         % self.shape.nr)
+            return
+
+        walls = PocketMill(self.shape, self.tool_rad, self.stepover, self.islands, max_rings=1)
+        loops = [loop for _, loop in walls.passes(direction)]
+        if len(loops) == 0:
+            return
+
+        self.init_boundary(loops)
+        rows = self.scanlines()
+        runs = self.order_runs(rows)
+        logger.debug("Zig-zag pocket of shape %s: %i scanlines, %i segments, %i runs" %
+                     (self.shape.nr, len(rows), sum(len(row) for row in rows), len(runs)))
+
+        pos = None
+        for run in runs:
+            if pos is not None:
+                for geo in self.link(pos, run[0]):
+                    yield geo
+            for Ps, Pe in zip(run, run[1:]):
+                yield LineGeo(self.to_world(Ps), self.to_world(Pe))
+            pos = run[-1]
+
+        if not self.finish:
+            return
+
+        for loop in loops:
+            if pos is not None:
+                start = self.to_local(loop[0].Ps)
+                if loop[0].Ps.distance(loop[-1].Pe) < eps:
+                    nearest_nr = min(range(len(loop)),
+                                     key=lambda nr: self.to_local(loop[nr].Ps).distance(pos))
+                    loop = loop[nearest_nr:] + loop[:nearest_nr]
+                    start = self.to_local(loop[0].Ps)
+                for geo in self.link(pos, start):
+                    yield geo
+            for geo in loop:
+                yield geo
+            pos = self.to_local(loop[-1].Pe)
+
+    def to_local(self, point):
+        """
+        Rotates a point into the frame in which the scanlines are horizontal.
+        """
+        c, s = cos(self.angle), sin(self.angle)
+        return Point(point.x * c + point.y * s, -point.x * s + point.y * c)
+
+    def to_world(self, point):
+        """
+        Rotates a point from the frame of the scanlines back.
+        """
+        c, s = cos(self.angle), sin(self.angle)
+        return Point(point.x * c - point.y * s, point.x * s + point.y * c)
+
+    def init_boundary(self, loops):
+        """
+        Converts the boundary loops into arrays in the frame of the scanlines:
+        the lines and the y-monotone pieces of the arcs.
+        @param loops: The lists of geometries of the boundary loops
+        """
+        lines = []
+        arcs = []
+        for loop in loops:
+            for geo in loop:
+                if isinstance(geo, ArcGeo):
+                    s_ang = geo.s_ang - self.angle
+                    arcs += monotone_arcs(self.to_local(geo.O), geo.r, s_ang, s_ang + geo.ext)
+                else:
+                    Ps, Pe = self.to_local(geo.Ps), self.to_local(geo.Pe)
+                    lines.append((Ps.x, Ps.y, Pe.x, Pe.y))
+
+        self.lines = np.array(lines).reshape(-1, 4)
+        self.arcs = np.array(arcs).reshape(-1, 6)
+
+        ys = np.hstack([self.lines[:, 1], self.lines[:, 3], self.arcs[:, 3], self.arcs[:, 4]])
+        self.ymin, self.ymax = ys.min(), ys.max()
+
+    def crossings(self, ys):
+        """
+        Intersects horizontal lines with the boundary. An edge is crossed if
+        its end points lie on different sides of the line; an end point on
+        the line counts as above, so shared end points are counted once.
+        @param ys: Column array of the y coordinates of the lines
+        @return: Array (lines x edges) of the sorted x coordinates of the
+        crossings, padded with inf
+        """
+        crossings = []
+        xs = []
+        if len(self.lines):
+            x1, y1, x2, y2 = self.lines.T
+            crossings.append((y1 > ys) != (y2 > ys))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                xs.append(x1 + (ys - y1) * (x2 - x1) / (y2 - y1))
+        if len(self.arcs):
+            cx, cy, r, ya, yb, side = self.arcs.T
+            crossings.append((ya > ys) != (yb > ys))
+            xs.append(cx + side * np.sqrt(np.maximum(r ** 2 - (ys - cy) ** 2, 0.0)))
+        return np.sort(np.where(np.hstack(crossings), np.hstack(xs), np.inf), axis=1)
+
+    def scanlines(self):
+        """
+        Intersects all scanlines with the boundary at once. The scanlines are
+        spread evenly between the lowest and the highest point of the region.
+        @return: List of the rows; each row is a list of [y, x_start, x_end]
+        """
+        count = max(1, int(ceil((self.ymax - self.ymin) / self.stepover)))
+        inset = min(1e-3, (self.ymax - self.ymin) / 4)
+        ys = np.linspace(self.ymin + inset, self.ymax - inset, count + 1)[:, np.newaxis]
+        x = self.crossings(ys)
+        counts = np.count_nonzero(np.isfinite(x), axis=1)
+
+        rows = []
+        for y, row_x, count in zip(ys[:, 0], x, counts):
+            row = []
+            for nr in range(0, count - 1, 2):
+                if row_x[nr + 1] - row_x[nr] > eps:
+                    row.append([y, row_x[nr], row_x[nr + 1]])
+            rows.append(row)
+        return rows
+
+    def order_runs(self, rows):
+        """
+        Connects the segments of the scanlines to zig-zag runs. A run
+        continues on the next scanline with the first unvisited segment which
+        overlaps the current one, if the connecting move stays inside of the
+        region. Every run starts at the lowest scanline with unvisited
+        segments.
+        @param rows: The rows returned by scanlines
+        @return: List of runs; each run is a list of points (local frame)
+        """
+        runs = []
+        pos = None
+        first_row = 0
+        while True:
+            while first_row < len(rows) and len(rows[first_row]) == 0:
+                first_row += 1
+            if first_row == len(rows):
+                break
+
+            row_nr = first_row
+            row = rows[row_nr]
+            if pos is None:
+                seg_nr = 0
+            else:
+                seg_nr = min(range(len(row)), key=lambda nr: min(
+                    abs(row[nr][1] - pos.x), abs(row[nr][2] - pos.x)) + abs(row[nr][0] - pos.y))
+            y, xa, xb = row.pop(seg_nr)
+            forward = pos is None or abs(xa - pos.x) <= abs(xb - pos.x)
+            run = [Point(xa, y), Point(xb, y)] if forward else [Point(xb, y), Point(xa, y)]
+
+            while row_nr + 1 < len(rows):
+                nxt = rows[row_nr + 1]
+                lo, hi = min(xa, xb), max(xa, xb)
+                found = None
+                for nr, (y2, xa2, xb2) in enumerate(nxt):
+                    if xa2 < hi and xb2 > lo:
+                        found = nr
+                        break
+                if found is None:
+                    break
+                y2, xa2, xb2 = nxt[found]
+                forward = not forward
+                start, end = (Point(xa2, y2), Point(xb2, y2)) if forward else\
+                    (Point(xb2, y2), Point(xa2, y2))
+                if not self.link_is_inside(run[-1], start):
+                    forward = not forward
+                    break
+                nxt.pop(found)
+                run += [start, end]
+                row_nr += 1
+                xa, xb = xa2, xb2
+
+            runs.append(run)
+            pos = run[-1]
+        return runs
+
+    def link(self, Ps, Pe):
+        """
+        Returns the move between two runs or passes: a line if it is short
+        and stays inside of the region, otherwise a lift.
+        @param Ps: The current position (local frame)
+        @param Pe: The next position (local frame)
+        @return: List with a LineGeo or a Point
+        """
+        if Ps.distance(Pe) < eps:
+            return []
+        if Ps.distance(Pe) <= 2 * self.stepover and self.link_is_inside(Ps, Pe):
+            return [LineGeo(self.to_world(Ps), self.to_world(Pe))]
+        return [self.to_world(Pe)]
+
+    def return_path(self, Ps, Pe):
+        """
+        Returns the move from the end back to the start of the toolpath,
+        which is repeated for every slice of the pocket.
+        @param Ps: The end of the toolpath
+        @param Pe: The start of the toolpath
+        @return: List with a LineGeo, None if the line leaves the region
+        """
+        if self.link_is_inside(self.to_local(Ps), self.to_local(Pe)):
+            return [LineGeo(Ps, Pe)]
+        return None
+
+    def link_is_inside(self, Ps, Pe):
+        """
+        Checks if a straight move stays inside of the region. The move is
+        sampled and every sample is tested with the crossings of a horizontal
+        line through it; samples closer than a hundredth of the stepover to
+        the boundary count as inside.
+        @param Ps: The start point (local frame), usually on the boundary
+        @param Pe: The end point (local frame), usually on the boundary
+        @return: Returns true or false
+        """
+        samples = max(3, int(ceil(4 * Ps.distance(Pe) / self.stepover)))
+        ts = np.arange(1, samples) / samples
+        xs = (Ps.x + ts * (Pe.x - Ps.x))[:, np.newaxis]
+        ys = (Ps.y + ts * (Pe.y - Ps.y))[:, np.newaxis]
+
+        tol = 0.01 * self.stepover
+        x = self.crossings(ys)
+        left_lo = np.count_nonzero(x < xs - tol, axis=1)
+        left_hi = np.count_nonzero(x < xs + tol, axis=1)
+        return bool(np.all((left_lo % 2 == 1) | (left_lo != left_hi)))
+
+
+def monotone_arcs(O, r, s_ang, e_ang):
+    """
+    Splits an arc at its lowest and highest points into pieces whose y
+    coordinate is monotone.
+    @param O: The centre
+    @param r: The radius
+    @param s_ang: The start angle
+    @param e_ang: The end angle (less than s_ang for CW arcs)
+    @return: List of (centre x, centre y, r, start y, end y, side) per piece;
+    side is 1 for the right and -1 for the left half of the circle
+    """
+    lo, hi = min(s_ang, e_ang), max(s_ang, e_ang)
+    cuts = [lo]
+    k = int(ceil((lo - pi / 2) / pi))
+    while pi / 2 + k * pi < hi - eps:
+        if pi / 2 + k * pi > lo + eps:
+            cuts.append(pi / 2 + k * pi)
+        k += 1
+    cuts.append(hi)
+
+    pieces = []
+    for a, b in zip(cuts, cuts[1:]):
+        side = 1.0 if cos((a + b) / 2) >= 0 else -1.0
+        pieces.append((O.x, O.y, r, O.y + r * sin(a), O.y + r * sin(b), side))
+    return pieces
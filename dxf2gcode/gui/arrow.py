@@ -45,15 +45,19 @@ class Arrow(QGraphicsLineItem):
     def __init__(self, startp=Point(), endp=None,
                  length=60.0, angle=50.0,
                  color=QtCore.Qt.red, pencolor=QtCore.Qt.green,
-                 startarrow=True):
+                 startarrow=True, locate=None):
         """
         Initialisation of the class.
+        @param locate: Optional function which returns the start point and
+        the angle. It is called when the arrow is shown the first time, so
+        that e.g. the start of a pocket toolpath is only generated if needed.
         """
         self.sc = None
         super(Arrow, self).__init__()
 
         self.startp = QtCore.QPointF(startp.x, -startp.y)
         self.endp = endp
+        self.locate = locate
 
         self.length = length
         self.angle = angle
@@ -73,6 +77,16 @@ class Arrow(QGraphicsLineItem):
         """
         return float(0x7fffffff)
 
+    def update_position(self):
+        """
+        Places the arrow with the locate function, if it was not placed yet.
+        """
+        if self.locate is not None:
+            startp, self.angle = self.locate()
+            self.locate = None
+            self.prepareGeometryChange()
+            self.startp = QtCore.QPointF(startp.x, -startp.y)
+
     def setSelected(self, flag=True, blockSignals=True):
         """
         Override inherited function to turn off selection of Arrows.
@@ -81,6 +95,7 @@ class Arrow(QGraphicsLineItem):
         if self.allwaysshow:
             pass
         elif flag is True:
+            self.update_position()
             self.show()
         else:
             self.hide()
@@ -93,6 +108,7 @@ class Arrow(QGraphicsLineItem):
         """
         self.allwaysshow = flag
         if flag is True:
+            self.update_position()
             self.show()
         elif flag is True and self.isSelected():
             self.show()
@@ -298,22 +298,29 @@ class MyGraphicsScene(QGraphicsScene):
 
     def repaint_shape(self, shape):
         # setParentItem(None) might let it crash, hence we rely on the garbage collector
+        prv_stmove = shape.stmove
         shape.stmove.hide()
         shape.starrow.hide()
         shape.enarrow.hide()
         del shape.stmove
         del shape.starrow
         del shape.enarrow
-        self.paint_shape(shape)
+        self.paint_shape(shape, prv_stmove)
         if not shape.isSelected():
             shape.stmove.hide()
             shape.starrow.hide()
             shape.enarrow.hide()
+        else:
+            shape.stmove.setSelected(True)
+            shape.starrow.setSelected(True)
+            shape.enarrow.setSelected(True)
 
-    def paint_shape(self, shape):
+    def paint_shape(self, shape, prv_stmove=None):
         """
         Create all plotting related parts of one shape.
         @param shape: The shape to be plotted.
+        @param prv_stmove: The start move plotted before for the shape. It is
+        reused if the shape did not change.
         """
         start, start_ang = shape.get_start_end_points(True, True)
         shape.path = QPainterPath()
@@ -324,7 +331,7 @@ class MyGraphicsScene(QGraphicsScene):
 
         self.BB = self.BB.joinBB(shape.BB)
 
-        shape.stmove = self.createstmove(shape)
+        shape.stmove = self.createstmove(shape, prv_stmove)
         shape.starrow = self.createstarrow(shape)
         shape.enarrow = self.createenarrow(shape)
         shape.stmove.setParentItem(shape)
@@ -348,11 +355,9 @@ class MyGraphicsScene(QGraphicsScene):
         """
 
         length = 20
-        start, start_ang = shape.get_start_end_points_physical(True, True, PPocket=True)
-        
-        arrow = Arrow(startp=start,
+
+        arrow = Arrow(locate=lambda: shape.get_start_end_points_physical(True, True, PPocket=True),
                       length=length,
-                      angle=start_ang,
                       color=QColor(50, 200, 255),
                       pencolor=QColor(50, 100, 255))
         return arrow
@@ -364,23 +369,24 @@ class MyGraphicsScene(QGraphicsScene):
         @param shape: The shape for which the Arrow shall be created.
         """
         length = 20
-        end, end_ang = shape.get_start_end_points_physical(False, True, PPocket=shape.Pocket)
-            
-        arrow = Arrow(startp=end,
+
+        arrow = Arrow(locate=lambda: shape.get_start_end_points_physical(False, True, PPocket=shape.Pocket),
                       length=length,
-                      angle=end_ang,
                       color=QColor(0, 245, 100),
                       pencolor=QColor(0, 180, 50),
                       startarrow=False)
         return arrow
 
-    def createstmove(self, shape):
+    def createstmove(self, shape, prv_stmove=None):
         """
         This function creates the Additional Start and End Moves in the plot
         window when the shape is selected
         @param shape: The shape for which the Move shall be created.
+        @param prv_stmove: The start move created before for the shape
         """
         stmove = StMoveGUI(shape)
+        if prv_stmove is not None:
+            stmove.reuse(prv_stmove)
         return stmove
 
     def delete_opt_paths(self):
@@ -634,7 +640,9 @@ class StMoveGUI(QGraphicsLineItem, StMove):
         self.pen = QPen(QColor(50, 100, 255), 1, QtCore.Qt.SolidLine,
                         QtCore.Qt.RoundCap, QtCore.Qt.RoundJoin)
         self.pen.setCosmetic(True)
-        self.make_papath()
+        # The state of the start move the path was made for, the path is
+        # made when it is shown the first time
+        self.path_state = None
 
     def contains_point(self, point):
         """
@@ -656,6 +664,17 @@ class StMoveGUI(QGraphicsLineItem, StMove):
         drawVerLine = lambda caller, start: None  # Not used in 2D mode
         self.make_path(drawHorLine, drawVerLine)
 
+    def update_papath(self):
+        """
+        Makes the path if it was not made yet or if the start move has changed
+        since.
+        """
+        self.update_start_moves()
+        if self.path_state != self.state:
+            self.prepareGeometryChange()
+            self.make_papath()
+            self.path_state = self.state
+
     def setSelected(self, flag=True):
         """
         Override inherited function to turn off selection of Arrows.
@@ -664,6 +683,7 @@ class StMoveGUI(QGraphicsLineItem, StMove):
         if self.allwaysshow:
             pass
         elif flag is True:
+            self.update_papath()
             self.show()
         else:
             self.hide()
@@ -676,6 +696,7 @@ class StMoveGUI(QGraphicsLineItem, StMove):
         """
         self.allwaysshow = flag
         if flag is True:
+            self.update_papath()
             self.show()
         elif flag is True and self.isSelected():
             self.show()
@@ -370,7 +370,7 @@ class GLWidget(CanvasBase):
         for shape in self.shapes.selected_iter():
             if not shape.disabled:
                 self.setColor(GLWidget.COLOR_STMOVE)
-                GL.glCallList(shape.drawStMove)
+                GL.glCallList(self.makeStMove(shape))
                 self.setColor(GLWidget.COLOR_SELECT)
                 GL.glCallList(shape.drawObject)
             elif self.showDisabledPaths:
@@ -389,7 +389,7 @@ class GLWidget(CanvasBase):
                 GL.glCallList(shape.drawObject)
                 if self.showPathDirections:
                     self.setColor(GLWidget.COLOR_STMOVE)
-                    GL.glCallList(shape.drawStMove)
+                    GL.glCallList(self.makeStMove(shape))
             elif self.showDisabledPaths:
                 self.setColor(GLWidget.COLOR_NORMAL_DISABLED)
                 GL.glCallList(shape.drawObject)
@@ -474,8 +474,13 @@ class GLWidget(CanvasBase):
 
     def paint_shape(self, shape):
         shape.drawObject = self.makeShape(shape)  # 1 object
-        shape.stmove = StMove(shape)
-        shape.drawStMove = self.makeStMove(shape.stmove)  # 1 object
+        stmove = StMove(shape)
+        if shape.stmove is not None:
+            stmove.reuse(shape.stmove)
+        shape.stmove = stmove
+        # The start move is compiled when it is drawn the first time
+        shape.drawStMove = GL.glGenLists(1)  # 1 object
+        shape.drawStMoveState = None
         shape.drawArrowsDirection = self.makeDirArrows(shape)  # 2 objects
 
     def makeShape(self, shape):
@@ -493,17 +498,24 @@ class GLWidget(CanvasBase):
 
         return genList
 
-    def makeStMove(self, stmove):
-        genList = GL.glGenLists(1)
-        GL.glNewList(genList, GL.GL_COMPILE)
+    def makeStMove(self, shape):
+        """
+        Compiles the display list of the start move of the shape, if it was
+        not compiled yet or if the start move has changed since.
+        @return: The display list
+        """
+        shape.stmove.update_start_moves()
+        if shape.drawStMoveState != shape.stmove.state:
+            GL.glNewList(shape.drawStMove, GL.GL_COMPILE)
 
-        GL.glBegin(GL.GL_LINES)
-        stmove.make_path(self.drawHorLine, self.drawVerLine)
-        GL.glEnd()
+            GL.glBegin(GL.GL_LINES)
+            shape.stmove.make_path(self.drawHorLine, self.drawVerLine)
+            GL.glEnd()
 
-        GL.glEndList()
+            GL.glEndList()
+            shape.drawStMoveState = shape.stmove.state
 
-        return genList
+        return shape.drawStMove
 
     def drawHorLine(self, caller, Ps, Pe):
         GL.glVertex3f(Ps.x, -Ps.y, caller.axis3_start_mill_depth)
@@ -553,6 +553,7 @@ class TreeHandler(QWidget):
 
                 real_layer.exp_order = []  # Clear the current export order
                 real_layer.exp_order_complete = []  # Clear the current export order
+                shape_nrs = {id(shape): nr for nr, shape in enumerate(real_layer.shapes)}
 
                 # Assign the export order for the shapes of the layer "real_layer"
                 for j in range(self.layer_item_model.rowCount(layer_item_index)):
@@ -568,7 +569,7 @@ class TreeHandler(QWidget):
                         real_shape = toPyObject(shape_item_index.data(CUSTOM_GCODE_OBJECT))
 
                     if real_shape and (not real_shape.isDisabled() or includeDisableds):
-                        real_layer.exp_order_complete.append(real_layer.shapes.index(real_shape))  # Create the export order list with the shapes & custom gcode numbers (eg [5, 3, 2, 4, 0, 1])
+                        real_layer.exp_order_complete.append(shape_nrs[id(real_shape)])  # Create the export order list with the shapes & custom gcode numbers (eg [5, 3, 2, 4, 0, 1])
 
     def updateTreeViewOrder(self):
         """
@@ -586,20 +587,42 @@ class TreeHandler(QWidget):
             if isValid(layer_item_index.data(LAYER_OBJECT)):
                 real_layer = toPyObject(layer_item_index.data(LAYER_OBJECT))
 
-                # for shape_nr in real_layer.exp_order[::-1]:  # reverse order and prepend if we want to insert optimized shape before fixed shapes
-                for shape_nr in real_layer.exp_order:
-                    for j in range(self.layer_item_model.rowCount(layer_item_index)):
-                        shape_item_index = self.layer_item_model.index(j, 0, layer_item_index)
+                # The rows of the movable shapes, found in one pass
+                rows = {}
+                for j in range(self.layer_item_model.rowCount(layer_item_index)):
+                    shape_item_index = self.layer_item_model.index(j, 0, layer_item_index)
 
-                        if isValid(shape_item_index.data(SHAPE_OBJECT)):
-                            real_shape = toPyObject(shape_item_index.data(SHAPE_OBJECT)).shapeobj
+                    if isValid(shape_item_index.data(SHAPE_OBJECT)):
+                        real_shape = toPyObject(shape_item_index.data(SHAPE_OBJECT)).shapeobj
 
-                            if real_shape and real_shape.nr == shape_nr and (real_shape.send_to_TSP or g.config.vars.Route_Optimisation['TSP_shape_order'] == 'CONSTRAIN_ORDER_ONLY'):
-                                # Shape number "shape_nr" found in the treeView and Shape is movable => moving it to its new position
-                                item_to_be_moved = layer_item.takeRow(j)
-                                layer_item.appendRow(item_to_be_moved)
+                        if real_shape and real_shape.nr not in rows and (real_shape.send_to_TSP or g.config.vars.Route_Optimisation['TSP_shape_order'] == 'CONSTRAIN_ORDER_ONLY'):
+                            rows[real_shape.nr] = j
+
+                # The movable shapes are moved to the end in the order of exp_order.
+                # Taking the rows from the bottom keeps the numbers of the other rows.
+                moved = [rows[shape_nr] for shape_nr in real_layer.exp_order if shape_nr in rows]
+                items = {}
+                for j in sorted(moved, reverse=True):
+                    items[j] = layer_item.takeRow(j)
+                for j in moved:
+                    layer_item.appendRow(items[j])
+
+    def updateTreeViewLayerOrder(self):
+        """
+        Update the order of the layers in the TreeView according to the
+        layers_list. This function should be called after the layers have
+        been sequenced
+        """
+        root_item = self.layer_item_model.invisibleRootItem()
+        for layer in self.layers_list:
+            for i in range(root_item.rowCount()):
+                layer_item_index = self.layer_item_model.index(i, 0)
+                if isValid(layer_item_index.data(LAYER_OBJECT)) and\
+                        toPyObject(layer_item_index.data(LAYER_OBJECT)) is layer:
+                    root_item.appendRow(root_item.takeRow(i))
+                    break
 
-                                break
+        self.ui.layersShapesTreeView.expandAll()
 
     def columnsSelectDeselect(self, selection_model, item_index, select):
         """
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import tempfile
+
+logger = logging.getLogger("PostPro.GCodeWriter")
+
+
+class LineWriter(object):
+    """
+    The last stage of the export: passes the exported text on to the output
+    as it is written, and adds the line numbers and the line endings of the
+    postprocessor configuration on the way. The text may be written in any
+    pieces, a line gets its number when its first character is written.
+    """
+    def __init__(self, write, use_line_nrs=False, line_nrs_begin=10, line_nrs_step=10, win_line_endings=False):
+        """
+        @param write: Function which writes a string to the output
+        @param use_line_nrs: True if the lines shall be numbered
+        @param line_nrs_begin: The number of the first line
+        @param line_nrs_step: The increment of the line numbers
+        @param win_line_endings: True if the lines shall end with CR LF
+        """
+        self.output = write
+        self.use_line_nrs = use_line_nrs
+        self.line_nr = line_nrs_begin
+        self.line_nrs_step = line_nrs_step
+        self.line_format = 'N%i '
+        self.line_ending = '\r\n' if win_line_endings else '\n'
+        # Whether the next character written starts a new line
+        self.line_start = True
+
+    def write(self, exstr):
+        """
+        Writes a piece of the exported text.
+        @param exstr: The text to write, lines are separated by \\n
+        """
+        if not exstr:
+            return
+        if not self.use_line_nrs:
+            if self.line_ending != '\n':
+                exstr = exstr.replace('\n', self.line_ending)
+            self.output(exstr)
+            return
+
+        lines = exstr.split('\n')
+        # The text after the last line break starts a line which is only
+        # numbered once it has any characters.
+        last = lines.pop()
+        parts = []
+        for line in lines:
+            if self.line_start:
+                parts.append(self.line_format % self.line_nr)
+                self.line_nr += self.line_nrs_step
+            parts.append(line)
+            parts.append(self.line_ending)
+            self.line_start = True
+        if last:
+            if self.line_start:
+                parts.append(self.line_format % self.line_nr)
+                self.line_nr += self.line_nrs_step
+            parts.append(last)
+            self.line_start = False
+        self.output("".join(parts))
+
+
+class GCodeWriter(object):
+    """
+    Passes the blocks of the exported program on to the output while the
+    shapes are exported, so that the program is never kept in memory as a
+    whole. The blocks are collected to pieces of about buffer_size characters
+    before they are passed on. Text written between hold and release is
+    spooled to a temporary file, so that other text, e.g. the subroutines
+    written during the export, can be put before it.
+    """
+    def __init__(self, write, buffer_size=1 << 16):
+        """
+        @param write: Function which writes a string to the output, e.g. the
+        write method of a LineWriter
+        @param buffer_size: The number of characters collected before they are
+        passed on
+        """
+        self.output = write
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.spool = None
+
+    def write(self, exstr):
+        """
+        Writes a block of the program.
+        @param exstr: The block to write
+        """
+        self.buffer.append(exstr)
+        self.buffered += len(exstr)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Passes the collected blocks on to the output or to the spool.
+        """
+        if not self.buffer:
+            return
+        exstr = "".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        if self.spool is not None:
+            self.spool.write(exstr)
+        else:
+            self.output(exstr)
+
+    def hold(self):
+        """
+        Keeps back the text written from now on until release is called.
+        """
+        self.flush()
+        self.spool = make_spool()
+
+    def release(self, source=None):
+        """
+        Writes the text of the given file and then the text kept back since
+        hold.
+        @param source: File with the text to put before the text kept back,
+        see make_spool
+        """
+        self.flush()
+        spool = self.spool
+        self.spool = None
+        if source is not None:
+            self.copy(source)
+        self.copy(spool)
+        spool.close()
+
+    def copy(self, source):
+        """
+        Writes the whole text of a file piece by piece.
+        @param source: The file, see make_spool
+        """
+        self.flush()
+        source.seek(0)
+        for exstr in iter(lambda: source.read(self.buffer_size), ""):
+            self.write(exstr)
+        self.flush()
+
+    def close(self):
+        """
+        Passes on everything which was written.
+        """
+        if self.spool is not None:
+            self.release()
+        self.flush()
+
+
+def make_spool():
+    """
+    Returns a temporary file to keep back text of the program in, e.g. the
+    subroutines written during the export. It is deleted when it is closed.
+    @return: The file opened for writing and reading text
+    """
+    return tempfile.TemporaryFile("w+", encoding="utf-8", newline="")
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+import numpy as np
+
+
+class GridIndex(object):
+    """
+    Uniform grid over a set of points for nearest point queries. A query
+    searches a block of cells around the cell of the query point, which is
+    enlarged until no closer point is possible, so its cost depends on the
+    local density rather than on the number of points. Points can be removed; once most
+    of them are gone the grid is rebuilt with the remaining ones, so that
+    queries do not have to cross many empty cells.
+    """
+    def __init__(self, points, per_cell=2):
+        """
+        Standard method to initialize the class
+        @param points: Array (n x 2) of the coordinates of the points
+        @param per_cell: The average number of points per cell
+        """
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.per_cell = per_cell
+        self.removed = np.zeros(len(self.points), dtype=bool)
+        self.remaining = len(self.points)
+        self.build()
+
+    def build(self):
+        """
+        Sorts the remaining points into the cells of a new grid.
+        """
+        nrs = np.flatnonzero(~self.removed)
+        self.indexed = len(nrs)
+        if self.indexed == 0:
+            self.nrs = nrs
+            return
+
+        points = self.points[nrs]
+        self.lo = points.min(axis=0)
+        span = points.max(axis=0) - self.lo
+        # About per_cell points per cell, also if all points are on a line
+        self.size = max(np.sqrt(span[0] * span[1] * self.per_cell / self.indexed),
+                        max(span) * self.per_cell / self.indexed, 1e-9)
+        self.nx, self.ny = (span // self.size).astype(int) + 1
+
+        cells = self.cell_nrs(points)
+        sort = np.argsort(cells, kind='stable')
+        self.nrs = nrs[sort]
+        self.start = np.searchsorted(cells[sort], np.arange(self.nx * self.ny + 1)).tolist()
+
+    def cell_nrs(self, points):
+        ij = ((points - self.lo) // self.size).astype(int)
+        ij[:, 0] = np.clip(ij[:, 0], 0, self.nx - 1)
+        ij[:, 1] = np.clip(ij[:, 1], 0, self.ny - 1)
+        return ij[:, 0] * self.ny + ij[:, 1]
+
+    def remove(self, nrs):
+        """
+        Removes points from the index.
+        @param nrs: The numbers of the points
+        """
+        nrs = np.asarray(nrs, dtype=int)
+        self.remaining -= np.count_nonzero(~self.removed[nrs])
+        self.removed[nrs] = True
+
+    def nearest(self, x, y, mask=None):
+        """
+        Returns the nearest remaining point.
+        @param x: The x coordinate of the query point
+        @param y: The y coordinate of the query point
+        @param mask: Boolean array; only points whose entry is True are
+        considered, all by default
+        @return: The number of the nearest point, -1 if there is none
+        """
+        if self.remaining * 4 < self.indexed:
+            self.build()
+        if self.indexed == 0:
+            return -1
+
+        cx = min(max(int((x - self.lo[0]) // self.size), 0), self.nx - 1)
+        cy = min(max(int((y - self.lo[1]) // self.size), 0), self.ny - 1)
+        r = 1
+        while True:
+            nrs = self.block(cx, cy, r)
+            keep = ~self.removed[nrs]
+            if mask is not None:
+                keep &= mask[nrs]
+            nrs = nrs[keep]
+            if len(nrs):
+                dist = np.hypot(self.points[nrs, 0] - x, self.points[nrs, 1] - y)
+                nr = int(np.argmin(dist))
+                # Points outside of the block are more than r cells away
+                if dist[nr] <= r * self.size or self.covers(cx, cy, r):
+                    return int(nrs[nr])
+                r = int(np.ceil(dist[nr] / self.size))
+            elif self.covers(cx, cy, r):
+                return -1
+            else:
+                r *= 2
+
+    def k_nearest(self, queries, k):
+        """
+        Returns the k nearest remaining points of many query points. The
+        query points are processed per cell; the block of cells around a
+        cell is enlarged until the k nearest points are known to be in it.
+        @param queries: Array (m x 2) of the coordinates of the query points
+        @param k: The number of points per query point
+        @return: Array (m x k) of the numbers of the points sorted by their
+        distance, padded with -1 if there are less than k points
+        """
+        queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+        result = np.full((len(queries), k), -1, dtype=int)
+        if self.remaining * 4 < self.indexed:
+            self.build()
+        if self.indexed == 0 or k == 0 or len(queries) == 0:
+            return result
+
+        cells = self.cell_nrs(queries)
+        sort = np.argsort(cells, kind='stable')
+        groups = np.split(sort, np.flatnonzero(np.diff(cells[sort])) + 1)
+        for group in groups:
+            cx, cy = divmod(int(cells[group[0]]), self.ny)
+            group_queries = queries[group]
+            r = 1
+            while True:
+                nrs = self.block(cx, cy, r)
+                nrs = nrs[~self.removed[nrs]]
+                if len(nrs) < k and not self.covers(cx, cy, r):
+                    r *= 2
+                    continue
+                dist = np.hypot(group_queries[:, 0, np.newaxis] - self.points[nrs, 0],
+                                group_queries[:, 1, np.newaxis] - self.points[nrs, 1])
+                count = min(k, len(nrs))
+                if count < len(nrs):
+                    part = np.argpartition(dist, count - 1, axis=1)[:, :count]
+                else:
+                    part = np.tile(np.arange(len(nrs)), (len(group), 1))
+                part_dist = np.take_along_axis(dist, part, axis=1)
+                max_dist = part_dist.max() if count else 0.0
+                # Points outside of the block are more than r cells away
+                if max_dist <= r * self.size or self.covers(cx, cy, r):
+                    order = np.argsort(part_dist, axis=1)
+                    result[group, :count] = nrs[np.take_along_axis(part, order, axis=1)]
+                    break
+                r = int(np.ceil(max_dist / self.size))
+        return result
+
+    def covers(self, cx, cy, r):
+        """
+        True if the block of r cells around the cell cx, cy covers the grid.
+        """
+        return cx - r <= 0 and cy - r <= 0 and cx + r >= self.nx - 1 and cy + r >= self.ny - 1
+
+    def block(self, cx, cy, r):
+        """
+        Returns the numbers of the points in the cells which are at most r
+        cells away from the cell cx, cy. The cells of a column of the grid
+        are stored one after another, so every column is one range.
+        """
+        y0, y1 = max(cy - r, 0), min(cy + r, self.ny - 1) + 1
+        start = self.start
+        chunks = [self.nrs[start[i * self.ny + y0]:start[i * self.ny + y1]]
+                  for i in range(max(cx - r, 0), min(cx + r, self.nx - 1) + 1)]
+        return np.concatenate(chunks)
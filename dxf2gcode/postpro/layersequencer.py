@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger("PostPro.LayerSequencer")
+
+
+class LayerSequencer(object):
+    """
+    Orders the layers of a job. Starting at the start point the sequence
+    always continues with the layer which is cheapest to reach: the rapid
+    move to its nearest shape plus the cost of a tool change if it needs
+    another tool. Layers with the same tool therefore follow each other, as
+    long as the layers listed in order keep their relative order.
+
+    Where a layer is left depends on its route, which is not known yet; the
+    centre of its shapes is used instead.
+    """
+    def __init__(self, tools, points, order, start, tool_change_cost):
+        """
+        Standard method to initialize the class
+        @param tools: List of the tool numbers of the layers
+        @param points: List with the start points of the shapes per layer
+        @param order: List of the layers which must keep their order
+        @param start: The start point of the machine
+        @param tool_change_cost: The cost of a tool change as length of rapid
+        moves
+        """
+        self.tools = tools
+        self.order = order
+        self.tool_change_cost = tool_change_cost
+        self.points = [np.array([[p.x, p.y] for p in layer_points], dtype=float).reshape(-1, 2)
+                       for layer_points in points]
+
+        self.opt_route = []
+        self.tool_changes = 0
+        self.length = 0.0
+        self.calc_route(np.array([start.x, start.y], dtype=float))
+
+    def __str__(self):
+        return "Layer nrs:      %i" % len(self.tools) +\
+               "\norder:          %s" % self.order +\
+               "\nTool changes:   %i" % self.tool_changes +\
+               "\nRapid length:   %0.1f" % self.length +\
+               "\nOpt. route:     %s" % self.opt_route
+
+    def calc_route(self, pos):
+        """
+        Builds the sequence of the layers.
+        @param pos: The start point as array
+        """
+        fixed = set(self.order)
+        free = [nr for nr in range(len(self.tools)) if nr not in fixed]
+        next_fixed = 0
+        tool = None
+        while len(self.opt_route) < len(self.tools):
+            candidates = list(free)
+            if next_fixed < len(self.order):
+                candidates.append(self.order[next_fixed])
+
+            best_nr, best_cost, best_dist = None, np.inf, 0.0
+            for nr in candidates:
+                dist = self.distance(pos, nr)
+                # The first tool has to be loaded anyway
+                cost = dist
+                if tool is not None and self.tools[nr] != tool:
+                    cost += self.tool_change_cost
+                if cost < best_cost:
+                    best_nr, best_cost, best_dist = nr, cost, dist
+
+            if best_nr in fixed:
+                next_fixed += 1
+            else:
+                free.remove(best_nr)
+            if tool is not None and self.tools[best_nr] != tool:
+                self.tool_changes += 1
+            tool = self.tools[best_nr]
+            self.length += best_dist
+            self.opt_route.append(best_nr)
+            if len(self.points[best_nr]):
+                pos = self.points[best_nr].mean(axis=0)
+
+        logger.debug("Layers ordered with %i tool changes" % self.tool_changes)
+
+    def distance(self, pos, nr):
+        """
+        Returns the distance from a point to the nearest shape of a layer.
+        """
+        if len(self.points[nr]) == 0:
+            return 0.0
+        return float(np.min(np.hypot(*(self.points[nr] - pos).T)))
@@ -26,17 +26,23 @@
 ############################################################################
 
 import os
+import sys
 import time
+from collections import Counter
 import re
 from math import degrees
 import shutil
 import logging
 
+import numpy as np
+
 import dxf2gcode.globals.globals as g
 
 from dxf2gcode.core.point import Point
+from dxf2gcode.core.customgcode import CustomGCode
 from dxf2gcode.postpro.postprocessorconfig import MyPostProConfig
 from dxf2gcode.postpro.breaks import Breaks
+from dxf2gcode.postpro.gcodewriter import GCodeWriter, LineWriter, make_spool
 from dxf2gcode.gui.configwindow import *
 
 import dxf2gcode.globals.constants as c
@@ -48,6 +54,133 @@ str_encode = lambda exstr: exstr
 logger = logging.getLogger("PostPro.PostProcessor")
 
 
+class NumberFormat(object):
+    """
+    Formats the real values of the export as defined in the Number_Format
+    section of a postprocessor configuration. The format string and the way
+    the trailing zeros are removed are determined once for the configuration.
+    """
+    def __init__(self, number_format):
+        """
+        @param number_format: The Number_Format section of the configuration
+        """
+        pre_dec = number_format["pre_decimals"]
+        self.post_dec = number_format["post_decimals"]
+        self.dec_sep = number_format["decimal_separator"]
+
+        # + or - sign if required. Also used for Leading Zeros
+        flags = ''
+        if number_format["signed_values"]:
+            flags += '+'
+        if number_format["pre_decimal_zero_padding"]:
+            flags += '0'
+        self.format_str = '%' + flags + '%i.%if' % (pre_dec + self.post_dec + 1, self.post_dec)
+
+        # The decimal separator is removed with the zeros after it, if it is a
+        # single character.
+        if number_format["post_decimal_zero_padding"]:
+            self.format = self.format_padded
+            self.strip_re = None
+        elif len(self.dec_sep) == 1:
+            self.format = self.format_stripped
+            self.strip_chars = '0' + self.dec_sep
+            self.strip_re = re.compile(r'\.?0+$', re.M)
+        else:
+            self.format = self.format_stripped
+            self.strip_chars = '0'
+            self.strip_re = re.compile(r'0+$', re.M)
+
+    def format_padded(self, number):
+        """
+        Formats a number with all its decimals.
+        @param number: The number to format
+        @return: The formatted string of the number.
+        """
+        numstr = self.format_str % number
+        return numstr[:-(self.post_dec + 1)] + self.dec_sep + numstr[-self.post_dec:]
+
+    def format_stripped(self, number):
+        """
+        Formats a number without the zeros at the end of its decimals.
+        @param number: The number to format
+        @return: The formatted string of the number.
+        """
+        numstr = self.format_str % number
+        return numstr[:-(self.post_dec + 1)] + (self.dec_sep + numstr[-self.post_dec:]).rstrip(self.strip_chars)
+
+    def format_array(self, numbers):
+        """
+        Formats an array of numbers, e.g. the coordinates of a series of
+        moves, at once.
+        @param numbers: Array of the numbers to format
+        @return: List of the formatted strings of the numbers.
+        """
+        numbers = np.asarray(numbers, dtype=float).ravel().tolist()
+        if not len(numbers):
+            return []
+        if not self.post_dec:
+            return [self.format(number) for number in numbers]
+
+        # All numbers are formatted as the lines of one string. The decimal
+        # point is the only point in each line.
+        exstr = "\n".join([self.format_str] * len(numbers)) % tuple(numbers)
+        if self.strip_re is not None:
+            exstr = self.strip_re.sub('', exstr)
+        if self.dec_sep != '.':
+            exstr = exstr.replace('.', self.dec_sep)
+        return exstr.split("\n")
+
+
+class ExportStats(object):
+    """
+    Statistics of one export. Pocket passes are formatted once per shape and
+    reused for the following slices; the time needed to format a pass is
+    counted as saved for every reuse.
+    """
+    def __init__(self):
+        self.pocket_passes = 0
+        self.reused_passes = 0
+        self.format_time = 0.0
+        self.saved_time = 0.0
+        self.last_format_time = 0.0
+        self.placements = 0
+        self.shape_subroutines = 0
+
+    def add_pass(self, format_time):
+        """
+        Counts a pocket pass which was formatted.
+        @param format_time: The time needed to format its moves
+        """
+        self.pocket_passes += 1
+        self.format_time += format_time
+        self.last_format_time = format_time
+
+    def add_reused_pass(self, format_time):
+        """
+        Counts a pocket pass which reused the moves of the first pass.
+        @param format_time: The time needed to format the moves of the first
+        pass
+        """
+        self.pocket_passes += 1
+        self.reused_passes += 1
+        self.saved_time += format_time
+
+    def add_placement(self, new_subroutine):
+        """
+        Counts a shape which was written as call of a subroutine.
+        @param new_subroutine: True if the subroutine was written for it
+        """
+        self.placements += 1
+        if new_subroutine:
+            self.shape_subroutines += 1
+
+    def __str__(self):
+        return "Export statistics: %i pocket passes, %i reused; formatting took %.3fs, %.3fs saved; " \
+            "%i shapes written as %i subroutines" %\
+            (self.pocket_passes, self.reused_passes, self.format_time, self.saved_time,
+             self.placements, self.shape_subroutines)
+
+
 class MyPostProcessor(object):
     """
     The PostProcessor Class includes the functions for getting the output
@@ -262,7 +395,8 @@ class MyPostProcessor(object):
         This function performs the export to a file or stdout.
         It calls the following dedicated export functions and runs
         though the list of layers to export after checking if there are shapes
-        to export on these layers.
+        to export on these layers. The program is written to the file or
+        stdout while the shapes are exported, see write_program.
         @param load_filename: The name of the loaded dxf file. This name is
         written at the start of the export
         @param save_filename: The name of the file which shall be created.
@@ -273,13 +407,55 @@ class MyPostProcessor(object):
         """
         self.breaks = Breaks(LayerContents)
         self.initialize_export_vars()
+        self.stats = ExportStats()
 
-        exstr = self.write_gcode_be(load_filename)
+        # If the String shall be given to STDOUT
+        if g.config.vars.General['write_to_stdout']:
+            self.write_program(sys.stdout.write, load_filename, LayerContents)
+            sys.stdout.write('\n')
+            logger.info(self.tr("Export to STDOUT was successful"))
+            # self.close
+        else:
+            # Export Data to file
+            try:
+                # File open and write
+                with open(save_filename, "w") as f:
+                    self.write_program(lambda exstr: f.write(str_encode(exstr)),
+                                       load_filename, LayerContents)
+                logger.info(self.tr("Export to FILE was successful"))
+            except IOError:
+                QMessageBox.warning(g.window,
+                                    self.tr("Warning during Export"),
+                                    self.tr("Cannot Save the File"))
+            except:
+                # Do not leave an incomplete program behind
+                os.remove(save_filename)
+                raise
+
+    def write_program(self, write, load_filename, LayerContents):
+        """
+        Exports the shapes and writes the program block by block. The blocks
+        are collected by a GCodeWriter and pass the LineWriter on their way to
+        the output, so the program is never kept in memory as a whole. The
+        subroutines are spooled to a temporary file until they are written.
+        @param write: Function which writes a string to the output
+        @param load_filename: The name of the loaded dxf file
+        @param LayerContents: The layers to export, see exportShapes
+        """
+        writer = GCodeWriter(self.make_line_writer(write).write)
+        writer.write(self.write_gcode_be(load_filename))
+
+        # Subroutines at the beginning follow the header. The program is kept
+        # back until all subroutines are written.
+        hold = (self.use_subroutines or self.dedup_shapes) and\
+            self.vars.General["subroutines_position"] == 'begin'
+        if hold:
+            writer.hold()
 
         # Move Machine to retraction Area before continuing anything.
         # Note: none of the changes done in the GUI can affect this height,
         #       only the config file can do so (intended)
-        exstr += self.rap_pos_z(g.config.vars.Depth_Coordinates['axis3_retract'])
+        writer.write(self.rap_pos_z(g.config.vars.Depth_Coordinates['axis3_retract']))
 
         previous_tool = None
         # Do the export for each LayerContent in LayerContents List
@@ -291,50 +467,50 @@ class MyPostProcessor(object):
 
             # Perform export only for Layers which have at least 1 Shape to export
             if len(LayerContent.exp_order_complete):
-                exstr += self.commentprint("*** LAYER: %s ***" % LayerContent.name)
+                writer.write(self.commentprint("*** LAYER: %s ***" % LayerContent.name))
 
                 # If tool has changed for this LayerContent, add it
                 if LayerContent.tool_nr != previous_tool:
-                    exstr += self.chg_tool(LayerContent.tool_nr, LayerContent.speed)
+                    writer.write(self.chg_tool(LayerContent.tool_nr, LayerContent.speed))
                     previous_tool = LayerContent.tool_nr
 
+                shape_hashes = self.get_shape_hashes(LayerContent)
                 for shape_nr in LayerContent.exp_order_complete:
                     shape = LayerContent.shapes[shape_nr]
                     logger.debug(self.tr("Beginning export of Shape Nr: %s") % shape.nr)
 
-                    exstr += self.commentprint("* SHAPE Nr: %i *" % shape.nr)
+                    writer.write(self.commentprint("* SHAPE Nr: %i *" % shape.nr))
 
-                    exstr += shape.Write_GCode(self)
+                    if shape_nr in shape_hashes:
+                        writer.write(self.write_shape_placement(shape, shape_hashes[shape_nr]))
+                    else:
+                        for exstr in shape.Write_GCode_blocks(self):
+                            writer.write(exstr)
 
         # Move machine to the Final Position
         EndPosition = Point(g.config.vars.Plane_Coordinates['axis1_start_end'],
                             g.config.vars.Plane_Coordinates['axis2_start_end'])
 
-        exstr += self.rap_pos_xy(EndPosition)
+        writer.write(self.rap_pos_xy(EndPosition))
 
         # Write the end G-Code at the end
-        exstr += self.write_gcode_en()
-
-        exstr = self.make_line_numbers(exstr)
-        exstr = self.make_windows_line_endings(exstr)
-
-        # If the String shall be given to STDOUT
-        if g.config.vars.General['write_to_stdout']:
-            print(exstr)
-            logger.info(self.tr("Export to STDOUT was successful"))
-            # self.close
-        else:
-            # Export Data to file
-            try:
-                # File open and write
-                f = open(save_filename, "w")
-                f.write(str_encode(exstr))
-                f.close()
-                logger.info(self.tr("Export to FILE was successful"))
-            except IOError:
-                QMessageBox.warning(g.window,
-                                    self.tr("Warning during Export"),
-                                    self.tr("Cannot Save the File"))
+        code_end = self.write_gcode_en()
+        writer.write(code_end)
+
+        if hold:
+            writer.release(self.subroutines)
+        elif self.subroutines is not None:
+            # The end G-Code usually has no line break at its end
+            if not code_end.endswith("\n"):
+                writer.write("\n")
+            writer.copy(self.subroutines)
+        writer.close()
+        if self.subroutines is not None:
+            self.subroutines.close()
+            self.subroutines = None
+
+        if self.stats.pocket_passes or self.stats.placements:
+            logger.info(self.stats)
 
     def initialize_export_vars(self):
         """
@@ -348,6 +524,12 @@ class MyPostProcessor(object):
         self.comment = ""
 
         self.abs_export = self.vars.General["abs_export"]
+        self.number_format = NumberFormat(self.vars.Number_Format)
+        # Moves in the plane are only reused for further slices if their
+        # string does not contain the depth.
+        self.reuse_plane_moves = not any(
+            "%ZE" in self.vars.Program[key] or "%-ZE" in self.vars.Program[key]
+            for key in ("lin_mov_plane", "arc_int_cw", "arc_int_ccw"))
 
         self.Pe = Point(g.config.vars.Plane_Coordinates['axis1_start_end'],
                         g.config.vars.Plane_Coordinates['axis2_start_end'])
@@ -368,36 +550,69 @@ class MyPostProcessor(object):
         self.ze = g.config.vars.Depth_Coordinates['axis3_retract']
         self.lz = self.ze
 
-        self.keyvars = {"%feed": 'self.iprint(self.feed)',
-                        "%speed": 'self.iprint(self.speed)',
-                        "%tool_nr": 'self.iprint(self.tool_nr)',
-                        "%nl": 'self.nlprint()',
-                        "%XE": 'self.fnprint(self.Pe.x)',
-                        "%-XE": 'self.fnprint(-self.Pe.x)',
-                        "%XS": 'self.fnprint(self.Ps.x)',
-                        "%-XS": 'self.fnprint(-self.Ps.x)',
-                        "%YE": 'self.fnprint(self.Pe.y*fac)',
-                        "%-YE": 'self.fnprint(-self.Pe.y*fac)',
-                        "%YS": 'self.fnprint(self.Ps.y*fac)',
-                        "%-YS": 'self.fnprint(-self.Ps.y*fac)',
-                        "%ZE": 'self.fnprint(self.ze)',
-                        "%-ZE": 'self.fnprint(-self.ze)',
-                        "%I": 'self.fnprint(self.IJ.x)',
-                        "%-I": 'self.fnprint(-self.IJ.x)',
-                        "%J": 'self.fnprint(self.IJ.y*fac)',
-                        "%-J": 'self.fnprint(-self.IJ.y*fac)',
-                        "%XO": 'self.fnprint(self.O.x)',
-                        "%-XO": 'self.fnprint(-self.O.x)',
-                        "%YO": 'self.fnprint(self.O.y*fac)',
-                        "%-YO": 'self.fnprint(-self.O.y*fac)',
-                        "%R": 'self.fnprint(self.r)',
-                        "%AngS": 'self.fnprint(degrees(self.s_ang))',
-                        "%-AngS": 'self.fnprint(degrees(-self.s_ang))',
-                        "%AngE": 'self.fnprint(degrees(self.e_ang))',
-                        "%-AngE": 'self.fnprint(degrees(-self.e_ang))',
-                        "%ext": 'self.fnprint(degrees(self.ext))',
-                        "%-ext": 'self.fnprint(degrees(-self.ext))',
-                        "%comment": 'self.sprint(self.comment)'}
+        # Subroutines are only written for absolute G-code, since the passes
+        # of the slices need to start at the same position.
+        self.use_subroutines = self.vars.General["use_subroutines"] and\
+            self.vars.General["output_type"] == 'g-code'
+        if self.use_subroutines and not self.abs_export:
+            logger.warning(self.tr("Subroutines are only supported for absolute coordinates, they are not used."))
+            self.use_subroutines = False
+        self.sub_nr = self.vars.General["sub_nr_begin"]
+        self.next_sub_nr = self.sub_nr
+        # The subroutines are spooled to a temporary file once the first one
+        # is written
+        self.subroutines = None
+
+        # Shapes are not deduplicated if they may be broken by BREAKS: layers,
+        # which depends on their position.
+        self.dedup_shapes = self.vars.General["dedup_shapes"] and\
+            self.vars.General["output_type"] == 'g-code' and not len(self.breaks.breakLayers)
+        self.shape_subroutines = {}
+
+        # The formatters of the keywords in the strings of the Postprocessor
+        # Configuration. The strings are compiled into their literal text and
+        # these formatters at their first use, see make_print_str.
+        if g.config.machine_type == 'lathe':
+            fac = 2
+        else:
+            fac = 1
+
+        self.keyvars = {"%feed": lambda: self.iprint(self.feed),
+                        "%speed": lambda: self.iprint(self.speed),
+                        "%tool_nr": lambda: self.iprint(self.tool_nr),
+                        "%sub_nr": lambda: self.iprint(self.sub_nr),
+                        "%nl": self.nlprint,
+                        "%XE": lambda: self.fnprint(self.Pe.x),
+                        "%-XE": lambda: self.fnprint(-self.Pe.x),
+                        "%XS": lambda: self.fnprint(self.Ps.x),
+                        "%-XS": lambda: self.fnprint(-self.Ps.x),
+                        "%YE": lambda: self.fnprint(self.Pe.y * fac),
+                        "%-YE": lambda: self.fnprint(-self.Pe.y * fac),
+                        "%YS": lambda: self.fnprint(self.Ps.y * fac),
+                        "%-YS": lambda: self.fnprint(-self.Ps.y * fac),
+                        "%ZE": lambda: self.fnprint(self.ze),
+                        "%-ZE": lambda: self.fnprint(-self.ze),
+                        "%I": lambda: self.fnprint(self.IJ.x),
+                        "%-I": lambda: self.fnprint(-self.IJ.x),
+                        "%J": lambda: self.fnprint(self.IJ.y * fac),
+                        "%-J": lambda: self.fnprint(-self.IJ.y * fac),
+                        "%XO": lambda: self.fnprint(self.O.x),
+                        "%-XO": lambda: self.fnprint(-self.O.x),
+                        "%YO": lambda: self.fnprint(self.O.y * fac),
+                        "%-YO": lambda: self.fnprint(-self.O.y * fac),
+                        "%R": lambda: self.fnprint(self.r),
+                        "%AngS": lambda: self.fnprint(degrees(self.s_ang)),
+                        "%-AngS": lambda: self.fnprint(degrees(-self.s_ang)),
+                        "%AngE": lambda: self.fnprint(degrees(self.e_ang)),
+                        "%-AngE": lambda: self.fnprint(degrees(-self.e_ang)),
+                        "%ext": lambda: self.fnprint(degrees(self.ext)),
+                        "%-ext": lambda: self.fnprint(degrees(-self.ext)),
+                        "%comment": lambda: self.sprint(self.comment)}
+        # Longer keywords are matched first, in case a keyword starts with
+        # another one.
+        self.keyvars_re = re.compile("|".join(re.escape(key) for key in
+                                              sorted(self.keyvars, key=len, reverse=True)))
+        self.templates = {}
 
     def write_gcode_be(self, load_filename):
         """
@@ -442,38 +657,117 @@ class MyPostProcessor(object):
         """
         return self.make_print_str(self.vars.General["code_end"])
 
-    def make_line_numbers(self, exstr):
-        """
-        This Method adds Line Numbers to the existing exstr when required for export.
-        @param exstr: This is the string which shall be exported where the line
-        numbers are added.
-        @return: It returns the string with line numbers added to it.
+    def write_subroutine(self, exstr):
+        """
+        Stores the given moves as a new subroutine in the spool of the
+        subroutines.
+        @param exstr: The moves of the subroutine
+        @return: Returns the number of the subroutine.
+        """
+        self.sub_nr = self.next_sub_nr
+        self.next_sub_nr += 1
+        if self.subroutines is None:
+            self.subroutines = make_spool()
+        self.subroutines.write(self.make_print_str(self.vars.General["sub_begin"]) + exstr +
+                               self.make_print_str(self.vars.General["sub_end"]))
+        return self.sub_nr
+
+    def get_shape_hashes(self, LayerContent):
+        """
+        Fingerprints the shapes of the layer which shall be exported, see
+        Shape.get_placement_hash.
+        @param LayerContent: The layer to be exported
+        @return: Dictionary of the hashes of the shapes which are placed more
+        than once, by the number of the shape in the layer
+        """
+        if not self.dedup_shapes:
+            return {}
+
+        shape_hashes = {}
+        for shape_nr in LayerContent.exp_order_complete:
+            shape = LayerContent.shapes[shape_nr]
+            if not isinstance(shape, CustomGCode):
+                shape_hash = shape.get_placement_hash()
+                if shape_hash is not None:
+                    shape_hashes[shape_nr] = shape_hash
+
+        counts = Counter(shape_hashes.values())
+        return dict((shape_nr, shape_hash) for shape_nr, shape_hash in shape_hashes.items()
+                    if counts[shape_hash] > 1)
+
+    def write_shape_placement(self, shape, shape_hash):
+        """
+        Writes a shape which is identical to other shapes as the move to its
+        start and the call of a subroutine. The subroutine is written in
+        incremental coordinates at the first placement.
+        @param shape: The shape to be exported
+        @param shape_hash: The hash of the shape (see get_shape_hashes)
+        @return: Returns the string which shall be added.
         """
-        use_line_nrs = self.vars.Line_Numbers["use_line_nrs"]
-        line_nrs_begin = self.vars.Line_Numbers["line_nrs_begin"]
-        line_nrs_step = self.vars.Line_Numbers["line_nrs_step"]
-
-        line_format = 'N%i '
-        if use_line_nrs:
-            nr = 0
-            line_nr = line_nrs_begin
-            exstr = ((line_format + '%s') % (line_nr, exstr))
-            nr = exstr.find('\n', nr)
-            while not nr == -1:
-                line_nr += line_nrs_step
-                exstr = (('%s' + line_format + '%s') % (exstr[0:nr + 1],
-                                                        line_nr,
-                                                        exstr[nr + 1:len(exstr)]))
-
-                nr = exstr.find('\n', nr + len(line_format % line_nr) + 2)
-
+        exstr = shape.Write_GCode_start_move(self)
+        start = shape.get_start_move_point()
+
+        new_subroutine = shape_hash not in self.shape_subroutines
+        if new_subroutine:
+            abs_export, use_subroutines, feed = self.abs_export, self.use_subroutines, self.feed
+            start_z = self.lz
+            self.abs_export = False
+            self.use_subroutines = False
+            # The feed rate at the call is unknown, so the subroutine sets it.
+            self.feed = 0
+            sub_str = shape.Write_GCode(self, start_move=False)
+            if abs_export:
+                sub_str = self.make_print_str("%s\n" % self.vars.General["code_begin_prog_inc"]) +\
+                    sub_str + self.make_print_str("%s\n" % self.vars.General["code_begin_prog_abs"])
+            self.abs_export, self.use_subroutines = abs_export, use_subroutines
+
+            self.shape_subroutines[shape_hash] = (self.write_subroutine(sub_str), start_z,
+                                                  self.lPe - start, self.lz, self.feed)
+            self.lPe, self.lz, self.feed = start, start_z, feed
+            logger.debug(self.tr("Shape Nr: %s written as subroutine") % shape.nr)
+
+        sub_nr, start_z, offset, end_z, end_feed = self.shape_subroutines[shape_hash]
+        if self.lz != start_z:
+            exstr += self.rap_pos_z(start_z)
+        exstr += self.call_subroutine(sub_nr, start_z)
+        self.lPe, self.lz, self.feed = start + offset, end_z, end_feed
+        self.stats.add_placement(new_subroutine)
         return exstr
 
-    def make_windows_line_endings(self, exstr):
-        if self.vars.Number_Format["win_line_endings"]:
-            return exstr.replace('\n', '\r\n')
+    def call_subroutine(self, sub_nr, z_pos):
+        """
+        Code to call a subroutine for the slice at the given depth.
+        @param sub_nr: The number of the subroutine
+        @param z_pos: The depth of the slice
+        @return: Returns the string which shall be added.
+        """
+        self.sub_nr = sub_nr
+        self.ze = z_pos
+        return self.make_print_str(self.vars.General["sub_call"])
 
-        return exstr
+    def lin_pol_z_sub(self):
+        """
+        Code to add if the machine is commanded to the depth of the slice
+        within a subroutine. The depth is the parameter of the subroutine.
+        @return: Returns the string which shall be added.
+        """
+        sub_depth = self.vars.General["sub_depth"]
+        keystr = self.vars.Program["lin_mov_depth"]
+        keystr = keystr.replace("%-ZE", "-" + sub_depth).replace("%ZE", sub_depth)
+        return self.make_print_str(keystr)
+
+    def make_line_writer(self, write):
+        """
+        Creates the stage of the export which adds the line numbers and the
+        line endings, when required for export.
+        @param write: Function which writes a string to the output
+        @return: Returns the LineWriter which passes the text on to write.
+        """
+        return LineWriter(write,
+                          self.vars.Line_Numbers["use_line_nrs"],
+                          self.vars.Line_Numbers["line_nrs_begin"],
+                          self.vars.Line_Numbers["line_nrs_step"],
+                          self.vars.Number_Format["win_line_endings"])
 
     def chg_tool(self, tool_nr, speed):
         """
@@ -538,10 +832,10 @@ class MyPostProcessor(object):
         self.ext = ext
 
         if not self.abs_export:
-            self.Pe = Pe - self.lPe
-            self.lPe = Pe
+            self.Pe = self.round_point(Pe) - self.round_point(self.lPe)
         else:
             self.Pe = Pe
+        self.lPe = Pe
 
         if dir == 'cw':
             return self.make_print_str(self.vars.Program["arc_int_cw"])
@@ -556,10 +850,11 @@ class MyPostProcessor(object):
         @return: Returns the string which shall be added.
         """
         if not self.abs_export:
-            self.ze = z_pos - self.lz
-            self.lz = z_pos
+            self.ze = round(z_pos, self.vars.Number_Format["post_decimals"]) -\
+                round(self.lz, self.vars.Number_Format["post_decimals"])
         else:
             self.ze = z_pos
+        self.lz = z_pos
 
         return self.make_print_str(self.vars.Program["rap_pos_depth"])
 
@@ -571,10 +866,10 @@ class MyPostProcessor(object):
         @return: Returns the string which shall be added.
         """
         if not self.abs_export:
-            self.Pe = Pe - self.lPe
-            self.lPe = Pe
+            self.Pe = self.round_point(Pe) - self.round_point(self.lPe)
         else:
             self.Pe = Pe
+        self.lPe = Pe
 
         return self.make_print_str(self.vars.Program["rap_pos_plane"])
 
@@ -586,10 +881,11 @@ class MyPostProcessor(object):
         @return: Returns the string which shall be added.
         """
         if not self.abs_export:
-            self.ze = z_pos - self.lz
-            self.lz = z_pos
+            self.ze = round(z_pos, self.vars.Number_Format["post_decimals"]) -\
+                round(self.lz, self.vars.Number_Format["post_decimals"])
         else:
             self.ze = z_pos
+        self.lz = z_pos
 
         return self.make_print_str(self.vars.Program["lin_mov_depth"])
 
@@ -602,13 +898,45 @@ class MyPostProcessor(object):
         """
         self.Ps = Ps
         if not self.abs_export:
-            self.Pe = Pe - self.lPe
-            self.lPe = Pe
+            self.Pe = self.round_point(Pe) - self.round_point(self.lPe)
         else:
             self.Pe = Pe
+        self.lPe = Pe
 
         return self.make_print_str(self.vars.Program["lin_mov_plane"])
 
+    def round_point(self, point):
+        """
+        Rounds a point to the exported number of decimals. Incremental moves
+        are the differences of rounded positions, so that the rounding errors
+        do not accumulate.
+        @param point: The point to round
+        @return: The rounded point
+        """
+        post_dec = self.vars.Number_Format["post_decimals"]
+        return Point(round(point.x, post_dec), round(point.y, post_dec))
+
+    def get_position_xy(self):
+        """
+        Returns the last position in the plane, i.e. the position the next
+        incremental move starts from.
+        @return: The last position
+        """
+        return self.lPe
+
+    def reuse_moves(self, exstr, lPe):
+        """
+        Returns moves which were formatted before and restores the position
+        they end at, so that the following incremental moves continue
+        correctly. The moves need to start at the same position as when they
+        were formatted.
+        @param exstr: The formatted moves
+        @param lPe: The last position after the moves (see get_position_xy)
+        @return: Returns the string which shall be added.
+        """
+        self.lPe = lPe
+        return exstr
+
     def write_pre_shape_cut(self):
         """
         Return the text to add before a shape.
@@ -640,15 +968,34 @@ class MyPostProcessor(object):
         @return: Returns the string with replaced keyvars (e.g. %Z is replaced
         by the real Z value in the defined Number Format.
         """
-        if g.config.machine_type=='lathe':
-            fac = 2
-        else:
-            fac = 1
-
-        exstr = keystr
-        for key, value in self.keyvars.items():
-            exstr = exstr.replace(key, eval(value))
-        return exstr
+        template = self.templates.get(keystr)
+        if template is None:
+            template = self.templates[keystr] = self.compile_template(keystr)
+
+        chunks, formatters = template
+        parts = list(chunks)
+        parts[1::2] = [formatter() for formatter in formatters]
+        return "".join(parts)
+
+    def compile_template(self, keystr):
+        """
+        Splits a string of the Postprocessor Configuration into its literal
+        text and the formatters of its keywords (see keyvars).
+        @param keystr: String which contains the keywords
+        @return: Returns the list of the literal chunks, in which every second
+        entry is a placeholder for the value of a keyword, and the list of the
+        formatters of these values.
+        """
+        chunks = []
+        formatters = []
+        pos = 0
+        for match in self.keyvars_re.finditer(keystr):
+            chunks.append(keystr[pos:match.start()])
+            chunks.append(None)
+            formatters.append(self.keyvars[match.group()])
+            pos = match.end()
+        chunks.append(keystr[pos:])
+        return chunks, formatters
 
     # Function which returns the given value as a formatted integer
     def iprint(self, integer):
@@ -681,40 +1028,16 @@ class MyPostProcessor(object):
         @param number: The number which shall be returned in a formatted string
         @return: The formatted string of the number.
         """
-        pre_dec = self.vars.Number_Format["pre_decimals"]
-        post_dec = self.vars.Number_Format["post_decimals"]
-        dec_sep = self.vars.Number_Format["decimal_separator"]
-        pre_dec_z_pad = self.vars.Number_Format["pre_decimal_zero_padding"]
-        post_dec_z_pad = self.vars.Number_Format["post_decimal_zero_padding"]
-        signed_val = self.vars.Number_Format["signed_values"]
-
-        exstr = ''
+        return self.number_format.format(number)
 
-        # + or - sign if required. Also used for Leading Zeros
-        if signed_val and pre_dec_z_pad:
-            numstr = ('%+0' + str(pre_dec + post_dec + 1) +
-                      '.' + str(post_dec) + 'f') % number
-        elif signed_val == 0 and pre_dec_z_pad:
-            numstr = ('%0' + str(pre_dec + post_dec + 1) +
-                      '.' + str(post_dec) + 'f') % number
-        elif signed_val and pre_dec_z_pad == 0:
-            numstr = ('%+' + str(pre_dec + post_dec + 1) +
-                      '.' + str(post_dec) + 'f') % number
-        elif signed_val == 0 and pre_dec_z_pad == 0:
-            numstr = ('%' + str(pre_dec + post_dec + 1) +
-                      '.' + str(post_dec) + 'f') % number
-
-        # Gives the required decimal format.
-        exstr += numstr[0:-(post_dec + 1)]
-
-        exstr_end = dec_sep
-        exstr_end += numstr[-post_dec:]
-
-        # Add's Zero's to the end if required
-        if not post_dec_z_pad:
-            while len(exstr_end) > 0 and (exstr_end[-1] == '0' or exstr_end[-1] == dec_sep):
-                exstr_end = exstr_end[0:-1]
-        return exstr + exstr_end
+    def fnprint_array(self, numbers):
+        """
+        This function returns the given real values in the defined format, see
+        fnprint.
+        @param numbers: Array of the numbers which shall be formatted
+        @return: List of the formatted strings of the numbers.
+        """
+        return self.number_format.format_array(numbers)
 
 #    def __str__(self):
 #
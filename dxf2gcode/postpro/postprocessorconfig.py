@@ -40,7 +40,7 @@ from PyQt5 import QtCore
 import logging
 logger = logging.getLogger("PostPro.PostProcessorConfig")
 
-POSTPRO_VERSION = "7"
+POSTPRO_VERSION = "9"
 """
 version tag - increment this each time you edit CONFIG_SPEC
 
@@ -88,6 +88,23 @@ POSTPRO_SPEC = str('''
     # This is code which will be written at the end of the exported file.
     code_end = string(default="M2 (Program end)")
 
+    # Writes the XY pass of a shape which is cut in several slices only once as a subroutine, which is called for every slice. Only used for absolute G-code export.
+    use_subroutines = boolean(default=False)
+    # The subroutines are written at the beginning of the program (e.g. LinuxCNC, where they need to be defined before they are called) or after its end (e.g. Fanuc).
+    subroutines_position = option('begin', 'end', default='begin')
+    # Number of the first subroutine (%sub_nr), the following ones are numbered consecutively.
+    sub_nr_begin = integer(min = 1, default=100)
+    # This is written at the beginning of a subroutine. Fanuc: O%sub_nr%nl
+    sub_begin = string(default="o%sub_nr sub%nl")
+    # This is written at the end of a subroutine. Fanuc: M99%nl
+    sub_end = string(default="o%sub_nr endsub%nl")
+    # This calls a subroutine for the slice at depth %ZE. Fanuc: G65 P%sub_nr A%ZE%nl (or M98 P%sub_nr%nl if the depth is not needed, see sub_depth)
+    sub_call = string(default="o%sub_nr call [%ZE]%nl")
+    # Used for %ZE within a subroutine: the depth of the slice it is called for (pocket passes plunge to it again after lift moves). Fanuc with G65 A: #1
+    sub_depth = string(default="#1")
+    # Shapes of a layer which only differ in their position (e.g. the parts of a nested sheet) are written once as a subroutine in incremental coordinates, which is called at every placement. Uses the subroutine templates above.
+    dedup_shapes = boolean(default=False)
+
     [Number_Format]
     # Gives the indentation for the values.
     pre_decimals = integer(min = 0, default=4)
@@ -310,7 +327,16 @@ class MyPostProConfig(object):
                 ('code_begin_prog_abs', CfgLineEdit(MyPostProConfig.tr('Absolute programming:'))),
                 ('code_begin_prog_inc', CfgLineEdit(MyPostProConfig.tr('Incremental programming:'))),
                 ('code_begin', CfgTextEdit(MyPostProConfig.tr('Startup:'))),
-                ('code_end', CfgTextEdit(MyPostProConfig.tr('End:')))
+                ('code_end', CfgTextEdit(MyPostProConfig.tr('End:'))),
+                ('__subtitle4__', CfgSubtitle(MyPostProConfig.tr("Subroutines"))),
+                ('use_subroutines', CfgCheckBox(MyPostProConfig.tr('Write the passes of the slices as subroutines'))),
+                ('subroutines_position', CfgComboBox(MyPostProConfig.tr('Position of the subroutines:'))),
+                ('sub_nr_begin', CfgSpinBox(MyPostProConfig.tr('Subroutine number starts at:'))),
+                ('sub_begin', CfgLineEdit(MyPostProConfig.tr('Subroutine begin:'))),
+                ('sub_end', CfgLineEdit(MyPostProConfig.tr('Subroutine end:'))),
+                ('sub_call', CfgLineEdit(MyPostProConfig.tr('Subroutine call:'))),
+                ('sub_depth', CfgLineEdit(MyPostProConfig.tr('Depth within a subroutine:'))),
+                ('dedup_shapes', CfgCheckBox(MyPostProConfig.tr('Write identical shapes once as a subroutine')))
             ])),
             ('Number_Format', OrderedDict([
                 ('__section_title__', MyPostProConfig.tr("Output formatting")),
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+import hashlib
+import logging
+
+import numpy as np
+
+logger = logging.getLogger("PostPro.RouteCache")
+
+
+class RouteCache(object):
+    """
+    The optimized export orders of the layers. The order of a layer is stored
+    with a hash of everything its route depends on: the start and end points
+    of the shapes, the shapes with a fixed order, the start and end position
+    of the machine and the settings of the optimization. As long as the hash
+    of a layer does not change its order is reused without optimizing again;
+    otherwise the cached order is a good route to start with, if most of the
+    shapes are still the same.
+    """
+    def __init__(self):
+        self.routes = {}
+
+    def __str__(self):
+        return "Cached routes:  %i" % len(self.routes)
+
+    def clear(self):
+        """
+        Forgets all routes, e.g. when other shapes have been loaded.
+        """
+        self.routes = {}
+
+    def key(self, shape_nrs, st_end_points, *constraints):
+        """
+        Returns the hash of a routing problem. The shapes are sorted by their
+        numbers, so the key does not depend on the order they are given in.
+        @param shape_nrs: The numbers of the shapes of the route
+        @param st_end_points: List of the start and end points of the shapes
+        @param constraints: Further values the route depends on; their repr
+        is hashed
+        @return: The key as string
+        """
+        nrs = np.array(shape_nrs, dtype=np.int64)
+        points = np.array([[st.x, st.y, en.x, en.y] for st, en in st_end_points],
+                          dtype=float).reshape(-1, 4)
+        order = np.argsort(nrs, kind='stable')
+        digest = hashlib.sha1(nrs[order].tobytes())
+        digest.update(points[order].tobytes())
+        for constraint in constraints:
+            digest.update(repr(constraint).encode('utf-8'))
+        return digest.hexdigest()
+
+    def lookup(self, layer_nr, key):
+        """
+        Returns the cached export order of a layer if the key matches.
+        @param layer_nr: The number of the layer
+        @param key: The key of the current routing problem of the layer
+        @return: The export order or None
+        """
+        if layer_nr in self.routes and self.routes[layer_nr][0] == key:
+            return list(self.routes[layer_nr][1])
+        return None
+
+    def warm_route(self, layer_nr, shape_nrs):
+        """
+        Returns a route to start the optimization of a changed layer with:
+        the shapes in their cached order, followed by the new shapes. It is
+        only returned if at least half of the shapes are cached.
+        @param layer_nr: The number of the layer
+        @param shape_nrs: The numbers of the shapes of the route
+        @return: The route as list of the positions in shape_nrs, or None
+        """
+        if layer_nr not in self.routes:
+            return None
+        positions = {shape_nr: nr for nr, shape_nr in enumerate(shape_nrs)}
+        route = [positions.pop(shape_nr) for shape_nr in self.routes[layer_nr][1]
+                 if shape_nr in positions]
+        if len(route) * 2 < len(shape_nrs):
+            return None
+        logger.debug("Warm start with %i of %i shapes" % (len(route), len(shape_nrs)))
+        return route + sorted(positions.values())
+
+    def store(self, layer_nr, key, exp_order):
+        """
+        Stores the export order of a layer.
+        @param layer_nr: The number of the layer
+        @param key: The key of the routing problem the order belongs to
+        @param exp_order: The export order
+        """
+        self.routes[layer_nr] = (key, list(exp_order))
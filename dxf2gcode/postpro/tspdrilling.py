@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+from collections import deque
+import logging
+from math import hypot, sqrt
+
+import numpy as np
+
+from dxf2gcode.postpro.tspoptimisation import DistanceMatrixClass
+
+logger = logging.getLogger("PostPro.TSPDrilling")
+
+eps = 1e-9
+
+
+class TspDrilling(object):
+    """
+    Fast route optimization for layers which only hold points, e.g. drill
+    holes. A point is left where it is entered, so the distances between
+    the points are symmetric and reversing a part of the route does not
+    change its length.
+
+    The route starts along a space filling curve: a Hilbert curve or a
+    serpentine over bands of the points, whichever is the shortest. Sorting
+    the points along a curve needs O(n log n). It is then polished by 2-opt
+    and Or-opt moves to the nearest neighbours of a point; a move reverses
+    or shifts at most max_segment points, which bounds its cost on layers
+    with many thousand points.
+
+    The last point is the start and end point of the machine, whose start
+    and end may differ; it always stays at the beginning of the route.
+    """
+    def __init__(self, st_end_points, neighbours=8, max_segment=1000, batch=5000, route=None):
+        """
+        Standard method to initialize the class
+        @param st_end_points: List of the start and end points of the shapes
+        @param neighbours: The number of near points tried per point
+        @param max_segment: The maximal number of points a move reverses or
+        shifts
+        @param batch: The maximal number of points checked per iteration
+        @param route: The route to start with instead of the curve,
+        beginning with the start point (e.g. a previous result)
+        """
+        self.shape_nrs = len(st_end_points)
+        self.neighbours = neighbours
+        self.max_segment = max_segment
+        self.batch = batch
+
+        self.DistanceMatrix = DistanceMatrixClass()
+        self.DistanceMatrix.generate_matrix(st_end_points)
+        self.start_x, self.start_y = self.DistanceMatrix.starts.T.tolist()
+        self.end_x, self.end_y = self.DistanceMatrix.ends.T.tolist()
+
+        # The nearest neighbours are searched on the first iteration
+        self.near = None
+
+        if route is None:
+            route = self.curve_route()
+        self.route = list(route)
+        self.pos = [0] * self.shape_nrs
+        for nr, shape_nr in enumerate(self.route):
+            self.pos[shape_nr] = nr
+        route = np.array(self.route)
+        self.start_length = float(self.DistanceMatrix.distances(route, np.roll(route, -1)).sum())
+        self.cur_length = self.start_length
+        self.queue = deque(self.route)
+        self.queued = set(self.route)
+        self.moves = 0
+
+        self.opt_route = list(self.route)
+        self.opt_length = self.start_length
+
+    def __str__(self):
+        return "Shape nrs:      %i" % self.shape_nrs +\
+               "\nMoves:          %i" % self.moves +\
+               "\nStart length:   %0.1f" % self.start_length +\
+               "\nOpt. length:    %0.1f" % self.opt_length +\
+               "\nOpt. route:     %s" % self.opt_route
+
+    def curve_route(self):
+        """
+        Orders the points along the shortest of the space filling curves.
+        The closed curve is opened where it is cheapest to come from and
+        return to the start point of the machine, in the cheaper direction.
+        @return: The route as list of the point numbers
+        """
+        depot = self.shape_nrs - 1
+        points = self.DistanceMatrix.starts[:depot]
+        if len(points) < 3:
+            return [depot] + list(range(depot))
+
+        orders = [np.argsort(hilbert_index(points), kind='stable')]
+        size = points.max(axis=0) - points.min(axis=0)
+        # The mean distance of the points scales the widths of the bands
+        spacing = max(sqrt(size[0] * size[1] / len(points)), size.max() / len(points))
+        for axis in range(2):
+            for factor in (1.0, 1.5, 2.0):
+                orders.append(serpentine(points, axis, spacing * factor))
+        lengths = [cycle_length(points[order]) for order in orders]
+        order = orders[int(np.argmin(lengths))]
+        logger.debug("Curve lengths: %s" % ", ".join("%0.1f" % length for length in lengths))
+
+        path = points[order]
+        prev = np.roll(path, 1, axis=0)
+        start = self.DistanceMatrix.starts[depot]
+        ende = self.DistanceMatrix.ends[depot]
+        link = np.hypot(*(path - prev).T)
+        # Opening the curve between prev and path forwards or backwards
+        forwards = np.hypot(*(path - ende).T) + np.hypot(*(prev - start).T) - link
+        backwards = np.hypot(*(prev - ende).T) + np.hypot(*(path - start).T) - link
+        nr = int(np.argmin(np.concatenate((forwards, backwards))))
+        route = np.roll(order, -(nr % len(order)))
+        if nr >= len(order):
+            route = route[::-1]
+        return [depot] + route.tolist()
+
+    def length(self):
+        """
+        Returns the length of the route including the way back to the start.
+        """
+        return self.cur_length
+
+    @property
+    def converged(self):
+        """
+        True if no move shortens the route any more.
+        """
+        return not self.queue
+
+    def calc_next_iteration(self):
+        """
+        Checks a batch of the queued points for improving moves. Points next
+        to a changed part of the route are queued again.
+        """
+        if self.near is None:
+            k = min(self.neighbours, self.shape_nrs - 1)
+            if k > 0:
+                self.near = self.DistanceMatrix.nearest_neighbours(k).tolist()
+            else:
+                self.near = [[] for _ in range(self.shape_nrs)]
+        for nr in range(min(len(self.queue), self.batch)):
+            shape_nr = self.queue.popleft()
+            self.queued.discard(shape_nr)
+            if self.improve_two_opt(shape_nr) or self.improve_or_opt(shape_nr):
+                self.moves += 1
+                self.activate(shape_nr)
+        self.opt_route = list(self.route)
+        self.opt_length = self.cur_length
+
+    def activate(self, *shape_nrs):
+        """
+        Queues points whose neighbourhood has changed for another check.
+        """
+        for shape_nr in shape_nrs:
+            if shape_nr not in self.queued:
+                self.queued.add(shape_nr)
+                self.queue.append(shape_nr)
+
+    def dist(self, nr1, nr2):
+        return hypot(self.end_x[nr1] - self.start_x[nr2], self.end_y[nr1] - self.start_y[nr2])
+
+    def replace(self, first, part):
+        """
+        Replaces a part of the route and updates the positions of its points.
+        @param first: The position of the first point of the part
+        @param part: The new points of the part
+        """
+        self.route[first:first + len(part)] = part
+        for nr, shape_nr in enumerate(part, first):
+            self.pos[shape_nr] = nr
+
+    def improve_two_opt(self, shape_nr):
+        """
+        Tries to reverse a part of the route such that the point is next to
+        one of its nearest neighbours.
+        @param shape_nr: The point to check
+        @return: True if a move was applied
+        """
+        n = self.shape_nrs
+        route, pos = self.route, self.pos
+        i = pos[shape_nr]
+        for c in self.near[shape_nr]:
+            j = pos[c]
+            if i + 1 < j <= i + self.max_segment:
+                # a b ... c d  ->  a c ... b d
+                a, b, d = shape_nr, route[i + 1], route[(j + 1) % n]
+                gain = self.dist(a, b) + self.dist(c, d) - self.dist(a, c) - self.dist(b, d)
+                first, last = i + 1, j
+            elif i - self.max_segment <= j < i - 1:
+                # c e ... a f  ->  c a ... e f
+                a, b, d = route[j + 1], shape_nr, route[(i + 1) % n]
+                gain = self.dist(c, a) + self.dist(b, d) - self.dist(c, b) - self.dist(a, d)
+                first, last = j + 1, i
+            else:
+                continue
+            if gain > eps:
+                self.replace(first, route[last:first - 1:-1])
+                self.cur_length -= gain
+                self.activate(a, b, c, d)
+                return True
+        return False
+
+    def improve_or_opt(self, shape_nr):
+        """
+        Tries to move up to three consecutive points starting with the given
+        one next to one of the nearest neighbours of the point, in either
+        direction.
+        @param shape_nr: The first point of the moved part
+        @return: True if a move was applied
+        """
+        n = self.shape_nrs
+        route, pos = self.route, self.pos
+        s = pos[shape_nr]
+        if s == 0:
+            return False
+        for length in range(1, 4):
+            e = s + length - 1
+            if e >= n:
+                break
+            first, last = route[s], route[e]
+            prev, nxt = route[s - 1], route[(e + 1) % n]
+            removed = self.dist(prev, first) + self.dist(last, nxt) - self.dist(prev, nxt)
+            for c in self.near[first]:
+                q = pos[c]
+                # After c with the first point next to it, or before c with
+                # the part reversed
+                for p, forwards in ((q, True), (q - 1 if q > 0 else n - 1, False)):
+                    if s - 1 <= p <= e or abs(p - s) > self.max_segment:
+                        continue
+                    c1, d1 = route[p], route[(p + 1) % n]
+                    if forwards:
+                        added = self.dist(c1, first) + self.dist(last, d1)
+                    else:
+                        added = self.dist(c1, last) + self.dist(first, d1)
+                    gain = removed + self.dist(c1, d1) - added
+                    if gain > eps:
+                        part = route[s:e + 1] if forwards else route[e:s - 1:-1]
+                        if p > e:
+                            self.replace(s, route[e + 1:p + 1] + part)
+                        else:
+                            self.replace(p + 1, part + route[p + 1:s])
+                        self.cur_length -= gain
+                        self.activate(prev, nxt, first, last, c1, d1)
+                        return True
+        return False
+
+
+def hilbert_index(points, bits=16):
+    """
+    Returns the positions of points along a Hilbert curve over their
+    bounding square.
+    @param points: Array (n x 2) of the points
+    @param bits: The resolution of the curve in bits per axis
+    @return: Array of the positions
+    """
+    low = points.min(axis=0)
+    span = max(float((points.max(axis=0) - low).max()), eps)
+    cells = ((points - low) / span * ((1 << bits) - 1)).astype(np.int64)
+    x, y = cells[:, 0], cells[:, 1]
+    index = np.zeros(len(points), dtype=np.int64)
+    s = 1 << (bits - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        index += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant such that the curve continues there
+        flip = rx & ~ry
+        x = np.where(flip, s - 1 - x, x) & (s - 1)
+        y = np.where(flip, s - 1 - y, y) & (s - 1)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s >>= 1
+    return index
+
+
+def serpentine(points, axis, width):
+    """
+    Orders points band by band, alternately forwards and backwards along
+    the bands. The bands are centred at the lowest points, so the rows of a
+    regular pattern fall into one band each if the width matches.
+    @param points: Array (n x 2) of the points
+    @param axis: The axis along the bands (0 for x, 1 for y)
+    @param width: The width of the bands
+    @return: Array of the point numbers in their order
+    """
+    across = points[:, 1 - axis]
+    band = np.floor((across - across.min()) / width + 0.5).astype(np.int64)
+    # Empty bands are skipped
+    band = np.unique(band, return_inverse=True)[1].ravel()
+    along = np.where(band % 2 == 0, points[:, axis], -points[:, axis])
+    return np.lexsort((along, band))
+
+
+def cycle_length(path):
+    """
+    Returns the length of a closed path through points.
+    @param path: Array (n x 2) of the points in their order
+    """
+    return float(np.hypot(*(path - np.roll(path, -1, axis=0)).T).sum())
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import multiprocessing
+import random
+
+import numpy as np
+
+import dxf2gcode.globals.globals as g
+from dxf2gcode.postpro.tspoptimisation import TspOptimization, DistanceMatrixClass
+
+logger = logging.getLogger("PostPro.TSPIslands")
+
+# The pool of processes is kept for the next optimization
+pool = None
+pool_size = 0
+
+# The distance matrix of the last problem in this process of the pool
+island_problem = {}
+
+# Time in seconds between two checks if the optimization is interrupted
+# while the islands evolve
+poll_time = 0.05
+
+
+def get_pool(processes):
+    """
+    Returns a pool with the given number of processes, started on first use.
+    """
+    global pool, pool_size
+    if pool is None or pool_size != processes:
+        if pool is not None:
+            pool.terminate()
+        # Forking the GUI process is not safe, start fresh interpreters
+        pool = multiprocessing.get_context('spawn').Pool(processes)
+        pool_size = processes
+    return pool
+
+
+def evolve_island(args):
+    """
+    Runs the genetic algorithm on one island for a number of generations.
+    The distance matrix is generated only once per process and problem.
+    @param args: Tuple of the problem (key, points, order and parameters),
+    the begin art, the population (None for a new one), the number of
+    generations and the random seed
+    @return: The population and the lengths of its routes
+    """
+    (key, st_end_points, order, params), begin_art, pop, generations, seed = args
+    if island_problem.get('key') != key:
+        DistanceMatrix = DistanceMatrixClass()
+        DistanceMatrix.generate_matrix(st_end_points)
+        island_problem.update(key=key, DistanceMatrix=DistanceMatrix)
+    random.seed(seed)
+    np.random.seed(seed)
+    tsp = TspOptimization(st_end_points, order, dict(params, begin_art=begin_art),
+                          island_problem['DistanceMatrix'], pop)
+    for it_nr in range(generations):
+        tsp.calc_next_iteration()
+    return tsp.Population.pop, tsp.Fittness.cur_fittness
+
+
+class TspIslands(object):
+    """
+    Island model of the genetic algorithm. Several populations, started with
+    different begin arts, evolve independently in a pool of processes. After
+    every migration interval the best route of each island replaces the
+    worst route of the next island. One iteration runs a migration interval
+    of generations on all islands.
+    """
+    def __init__(self, st_end_points, order, route=None):
+        """
+        Standard method to initialize the class
+        @param st_end_points: List of the start and end points of the shapes
+        @param order: List of the shapes which must keep their order
+        @param route: A route which replaces the first one of every island
+        (e.g. a previous result)
+        """
+        params = g.config.vars.Route_Optimisation
+        self.shape_nrs = len(st_end_points)
+        self.order = order
+        self.island_nrs = params['islands']
+        self.interval = params['migration_interval']
+        self.params = {'max_population': params['max_population'],
+                       'mutation_rate': params['mutation_rate']}
+
+        # Every island starts differently, the first one as configured
+        begin_arts = [params['begin_art']] +\
+            [art for art in ('heuristic', 'greedy', 'random', 'ordered') if art != params['begin_art']]
+        self.begin_arts = [begin_arts[nr % len(begin_arts)] for nr in range(self.island_nrs)]
+        self.pops = [None] * self.island_nrs
+        self.best_fittness = []
+        self.opt_route = []
+        self.opt_length = float('inf')
+        self.iterations = 0
+        # The genetic algorithm runs until it is stopped
+        self.converged = False
+        # Function which is called while waiting for the islands, e.g. to
+        # handle the events of the GUI; if it returns True the iteration is
+        # given up (see optimize_route)
+        self.interrupted = None
+
+        # The key tells the processes if they hold the matrix of the problem
+        self.problem = ((id(self), random.random()), st_end_points, order, self.params)
+        self.pool = get_pool(min(self.island_nrs, multiprocessing.cpu_count()))
+
+        self.calc_next_iteration(0)
+        if route is not None:
+            # The islands correct the order of the route when they continue
+            for pop in self.pops:
+                pop[0] = route
+
+    def __str__(self):
+        return "Islands:        %i" % self.island_nrs +\
+               "\nGenerations:    %i" % (self.iterations * self.interval) +\
+               "\nShape nrs:      %i" % self.shape_nrs +\
+               "\norder:          %s" % self.order +\
+               "\nStart length:   %0.1f" % self.best_fittness[0] +\
+               "\nOpt. length:    %0.1f" % self.best_fittness[-1] +\
+               "\nOpt. route:     %s" % self.opt_route
+
+    def calc_next_iteration(self, generations=None):
+        """
+        Evolves all islands for a migration interval in parallel and lets the
+        best routes migrate. While the processes run, interrupted is called
+        every poll_time seconds; if it returns True the islands keep their
+        populations of the previous iteration.
+        @param generations: The number of generations, the migration interval
+        by default
+        """
+        if generations is None:
+            generations = self.interval
+        tasks = [(self.problem, art, pop, generations, random.randrange(2 ** 31))
+                 for art, pop in zip(self.begin_arts, self.pops)]
+        result = self.pool.map_async(evolve_island, tasks, chunksize=1)
+        while not result.ready():
+            result.wait(poll_time)
+            if self.interrupted is not None and not result.ready() and self.interrupted():
+                logger.debug("Iteration of the islands interrupted")
+                return
+        results = result.get()
+        if generations:
+            self.iterations += 1
+
+        best = [pop[np.argmin(fittness)].copy() for pop, fittness in results]
+        for nr, (pop, fittness) in enumerate(results):
+            # The best route of the previous island replaces the worst one
+            pop[np.argmax(fittness)] = best[nr - 1]
+            self.pops[nr] = pop
+
+        lengths = [float(np.min(fittness)) for pop, fittness in results]
+        best_nr = int(np.argmin(lengths))
+        if lengths[best_nr] < self.opt_length:
+            self.opt_length = lengths[best_nr]
+            self.opt_route = best[best_nr].tolist()
+        self.best_fittness.append(self.opt_length)
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+############################################################################
+#
+#   Copyright (C) 2008-2015
+#    Christian Kohlöffel
+#    Vinzenz Schulz
+#    Jean-Paul Schouwstra
+#
+#   This file is part of DXF2GCODE.
+#
+#   DXF2GCODE is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   DXF2GCODE is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with DXF2GCODE.  If not, see <http://www.gnu.org/licenses/>.
+#
+############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+
+from collections import deque
+import logging
+from math import hypot
+
+import numpy as np
+
+from dxf2gcode.postpro.gridindex import GridIndex
+from dxf2gcode.postpro.tspoptimisation import DistanceMatrixClass
+
+logger = logging.getLogger("PostPro.TSPLocalSearch")
+
+eps = 1e-9
+
+
+class TspLocalSearch(object):
+    """
+    Route optimization by local search. A nearest neighbour route is improved
+    by 2-opt moves (reversing a part of the route) and Or-opt moves (moving
+    up to three consecutive shapes elsewhere) until no move shortens it.
+    Only moves between near shapes are tried, using neighbour lists.
+
+    The distances are not symmetric, since shapes are left at their end
+    point and entered at their start point. The last shape is the start and
+    end point of the machine; it always stays at the beginning of the route.
+    The shapes listed in order keep their relative order.
+
+    Shapes may have several candidates for their start and end points, e.g.
+    every vertex of a closed contour or both directions of an open shape.
+    The route is then built with the nearest candidate of the next shape,
+    found with a spatial index; once the order is locally optimal the
+    candidates are chosen again for the neighbours in the route.
+    """
+    def __init__(self, st_end_points, order, neighbours=8, candidates=None, route=None):
+        """
+        Standard method to initialize the class
+        @param st_end_points: List of the start and end points of the shapes
+        @param order: List of the shapes which must keep their order
+        @param neighbours: The number of near shapes tried per shape
+        @param candidates: List with the possible [start, end] points of
+        every shape, None or an empty list for shapes which have only their
+        st_end_points; None if no shape has candidates
+        @param route: The route to start with instead of a nearest neighbour
+        route, beginning with the start point (e.g. a previous result)
+        """
+        self.shape_nrs = len(st_end_points)
+        self.order = order
+        self.neighbours = neighbours
+
+        # The rank of the shapes in the fixed order, -1 for free shapes
+        self.rank = np.full(self.shape_nrs, -1, dtype=int)
+        self.rank[list(order)] = np.arange(len(order))
+
+        # Shapes without candidates keep their start and end points
+        self.choose_candidates = candidates is not None
+        self.init_candidates(st_end_points, candidates or [None] * self.shape_nrs)
+        if route is None:
+            route = self.nearest_candidate_route()
+        else:
+            route = self.given_route(route)
+        st_end_points = [self.candidates[nr][self.choice[nr]] for nr in range(self.shape_nrs)]
+
+        # Only the points are stored; the distances are computed on demand
+        self.DistanceMatrix = DistanceMatrixClass()
+        self.DistanceMatrix.generate_matrix(st_end_points)
+        self.set_points()
+
+        # Nearest successors and predecessors of every shape
+        k = min(neighbours, self.shape_nrs - 1)
+        if k > 0:
+            self.succ = self.DistanceMatrix.nearest_neighbours(k).tolist()
+            self.pred = self.DistanceMatrix.nearest_predecessors(k).tolist()
+        else:
+            self.succ = self.pred = [[] for _ in range(self.shape_nrs)]
+
+        self.set_route(route)
+        self.start_length = self.length()
+        self.queue = deque(self.route)
+        self.queued = set(self.route)
+        self.moves = 0
+
+        self.opt_route = list(self.route)
+        self.opt_length = self.start_length
+
+    def __str__(self):
+        return "Shape nrs:      %i" % self.shape_nrs +\
+               "\norder:          %s" % self.order +\
+               "\nMoves:          %i" % self.moves +\
+               "\nStart length:   %0.1f" % self.start_length +\
+               "\nOpt. length:    %0.1f" % self.opt_length +\
+               "\nOpt. route:     %s" % self.opt_route
+
+    def init_candidates(self, st_end_points, candidates):
+        """
+        Collects the candidates of all shapes in arrays; shapes without
+        candidates get their start and end points as only candidate.
+        @param st_end_points: List of the start and end points of the shapes
+        @param candidates: List with the possible [start, end] points of
+        every shape
+        """
+        self.candidates = [cands if cands else [st_end]
+                           for st_end, cands in zip(st_end_points, candidates)]
+        counts = [len(cands) for cands in self.candidates]
+        # The candidates of shape nr are first[nr]..first[nr + 1] - 1
+        self.first = np.concatenate(([0], np.cumsum(counts))).tolist()
+        self.owner = np.repeat(np.arange(self.shape_nrs), counts)
+        self.cand_starts = np.array([[st.x, st.y] for cands in self.candidates for st, en in cands])
+        self.cand_ends = np.array([[en.x, en.y] for cands in self.candidates for st, en in cands])
+        self.choice = [0] * self.shape_nrs
+
+    def nearest_candidate_route(self):
+        """
+        Builds a route starting at the start point which always continues
+        with the nearest start point of any candidate of the remaining
+        shapes; a shape with a fixed order may only follow once its
+        predecessors in the order are in the route. The candidates used are
+        stored in choice.
+        @return: The route as list of the shape numbers
+        """
+        start = self.shape_nrs - 1
+        index = GridIndex(self.cand_starts)
+        index.remove(range(self.first[start], self.first[start + 1]))
+        allowed = self.rank[self.owner] < 0
+        if len(self.order):
+            first_fixed = self.order[0]
+            allowed[self.first[first_fixed]:self.first[first_fixed + 1]] = True
+
+        route = [start]
+        x, y = self.cand_ends[self.first[start]]
+        while len(route) < self.shape_nrs:
+            cand_nr = index.nearest(x, y, allowed)
+            nr = int(self.owner[cand_nr])
+            self.choice[nr] = cand_nr - self.first[nr]
+            route.append(nr)
+            index.remove(range(self.first[nr], self.first[nr + 1]))
+            if 0 <= self.rank[nr] < len(self.order) - 1:
+                next_fixed = self.order[self.rank[nr] + 1]
+                allowed[self.first[next_fixed]:self.first[next_fixed + 1]] = True
+            x, y = self.cand_ends[cand_nr]
+        return route
+
+    def given_route(self, route):
+        """
+        Prepares a given route: the shapes with a fixed order take the
+        places of the fixed shapes in that order, and every shape gets the
+        candidate whose start point is nearest to the end of its predecessor.
+        @param route: The route as list of the shape numbers
+        @return: The route as list of the shape numbers
+        """
+        route = list(route)
+        slots = [nr for nr, shape_nr in enumerate(route) if self.rank[shape_nr] >= 0]
+        for slot, shape_nr in zip(slots, self.order):
+            route[slot] = shape_nr
+
+        x, y = self.cand_ends[self.first[route[0]]]
+        for nr in route[1:]:
+            a, b = self.first[nr], self.first[nr + 1]
+            if b - a > 1:
+                self.choice[nr] = int(np.argmin(np.hypot(self.cand_starts[a:b, 0] - x,
+                                                         self.cand_starts[a:b, 1] - y)))
+            x, y = self.cand_ends[a + self.choice[nr]]
+        return route
+
+    def improve_candidates(self):
+        """
+        Chooses the candidate of every shape with the shortest way from the
+        end of its predecessor in the route to the start of its successor.
+        The distances of the changed shapes are updated and their
+        neighbourhood is checked again.
+        @return: True if a candidate was changed
+        """
+        n = self.shape_nrs
+        route = self.route
+        changed = []
+        for i in range(1, n):
+            nr = route[i]
+            a, b = self.first[nr], self.first[nr + 1]
+            if b - a < 2:
+                continue
+            prev_end = self.cand_ends[self.first[route[i - 1]] + self.choice[route[i - 1]]]
+            nxt = route[(i + 1) % n]
+            next_start = self.cand_starts[self.first[nxt] + self.choice[nxt]]
+            cost = np.hypot(*(self.cand_starts[a:b] - prev_end).T) +\
+                np.hypot(*(self.cand_ends[a:b] - next_start).T)
+            best = int(np.argmin(cost))
+            if cost[best] < cost[self.choice[nr]] - eps:
+                self.choice[nr] = best
+                changed.append(nr)
+        if not changed:
+            return False
+
+        chosen = np.array(self.first[:-1]) + self.choice
+        self.DistanceMatrix.starts = self.cand_starts[chosen]
+        self.DistanceMatrix.ends = self.cand_ends[chosen]
+        self.set_points()
+        k = min(self.neighbours, n - 1)
+        if k > 0:
+            # The shape itself may be one of the k + 1 nearest points
+            changed_nrs = np.array(changed)
+            succ = GridIndex(self.DistanceMatrix.starts, per_cell=k + 1)\
+                .k_nearest(self.DistanceMatrix.ends[changed_nrs], k + 1)
+            pred = GridIndex(self.DistanceMatrix.ends, per_cell=k + 1)\
+                .k_nearest(self.DistanceMatrix.starts[changed_nrs], k + 1)
+            for nr, nr_succ, nr_pred in zip(changed, succ.tolist(), pred.tolist()):
+                self.succ[nr] = [other for other in nr_succ if other != nr][:k]
+                self.pred[nr] = [other for other in nr_pred if other != nr][:k]
+        self.set_route(route)
+        for nr in changed:
+            i = self.pos[nr]
+            self.activate(route[i - 1], nr, route[(i + 1) % n])
+        return True
+
+    def start_points(self):
+        """
+        Returns the start points of the candidates chosen for the shapes.
+        """
+        return [cands[choice][0] for cands, choice in zip(self.candidates, self.choice)]
+
+    def set_points(self):
+        """
+        Copies the chosen start and end points of the shapes into lists, which
+        are faster than arrays for single distances.
+        """
+        self.start_x, self.start_y = self.DistanceMatrix.starts.T.tolist()
+        self.end_x, self.end_y = self.DistanceMatrix.ends.T.tolist()
+
+    def set_route(self, route):
+        """
+        Sets the route and updates the positions of the shapes and the
+        running sums along it.
+        @param route: The route as list of the shape numbers
+        """
+        self.route = route
+        self.pos = [0] * self.shape_nrs
+        for nr, shape_nr in enumerate(route):
+            self.pos[shape_nr] = nr
+
+        route = np.array(route)
+        nxt = np.roll(route, -1)
+        # Lengths of the route up to a position, forwards and backwards
+        self.fwd = np.concatenate(([0.0], np.cumsum(self.DistanceMatrix.distances(route, nxt)))).tolist()
+        self.bwd = np.concatenate(([0.0], np.cumsum(self.DistanceMatrix.distances(nxt, route)))).tolist()
+        # Number of shapes with a fixed order before a position
+        self.fixed = np.concatenate(([0], np.cumsum(self.rank[route] >= 0))).tolist()
+
+    def length(self):
+        """
+        Returns the length of the route including the way back to the start.
+        """
+        return self.fwd[-1]
+
+    @property
+    def converged(self):
+        """
+        True if no move shortens the route any more.
+        """
+        return not self.queue
+
+    def calc_next_iteration(self):
+        """
+        Checks all queued shapes for improving moves once. Shapes next to a
+        changed part of the route are checked again in the next iteration.
+        When no shape is left the candidates are chosen again.
+        """
+        for nr in range(len(self.queue)):
+            shape_nr = self.queue.popleft()
+            self.queued.discard(shape_nr)
+            if self.improve_two_opt(shape_nr) or self.improve_or_opt(shape_nr):
+                self.moves += 1
+                self.activate(shape_nr)
+        if not self.queue and self.choose_candidates:
+            self.improve_candidates()
+        self.opt_route = list(self.route)
+        self.opt_length = self.length()
+
+    def activate(self, *shape_nrs):
+        """
+        Queues shapes whose neighbourhood has changed for another check.
+        """
+        for shape_nr in shape_nrs:
+            if shape_nr not in self.queued:
+                self.queued.add(shape_nr)
+                self.queue.append(shape_nr)
+
+    def dist(self, nr1, nr2):
+        return hypot(self.end_x[nr1] - self.start_x[nr2], self.end_y[nr1] - self.start_y[nr2])
+
+    def improve_two_opt(self, shape_nr):
+        """
+        Tries to reverse a part of the route such that the shape is followed
+        by one of its nearest successors, or such that its successor in the
+        route follows one of its nearest predecessors.
+        @param shape_nr: The shape to check
+        @return: True if a move was applied
+        """
+        n = self.shape_nrs
+        route, pos = self.route, self.pos
+        i = pos[shape_nr]
+        if i == n - 1:
+            return False
+        # The part i+1..j is reversed
+        candidates = [pos[nr] for nr in self.succ[shape_nr]] +\
+            [pos[nr] - 1 if pos[nr] > 0 else n - 1 for nr in self.pred[route[i + 1]]]
+        a, b = route[i], route[i + 1]
+        for j in candidates:
+            if j <= i + 1:
+                continue
+            c, d = route[j], route[(j + 1) % n]
+            if self.fixed[j + 1] - self.fixed[i + 1] > 1:
+                continue
+            gain = self.dist(a, b) + self.dist(c, d) - self.dist(a, c) - self.dist(b, d) +\
+                (self.fwd[j] - self.fwd[i + 1]) - (self.bwd[j] - self.bwd[i + 1])
+            if gain > eps:
+                self.set_route(route[:i + 1] + route[j:i:-1] + route[j + 1:])
+                self.activate(a, b, c, d)
+                return True
+        return False
+
+    def improve_or_opt(self, shape_nr):
+        """
+        Tries to move up to three consecutive shapes starting with the given
+        one between one of the nearest predecessors of the first shape and
+        its successor, or before one of the nearest successors of the last
+        shape.
+        @param shape_nr: The first shape of the moved part
+        @return: True if a move was applied
+        """
+        n = self.shape_nrs
+        route, pos = self.route, self.pos
+        s = pos[shape_nr]
+        if s == 0:
+            return False
+        for length in range(1, 4):
+            e = s + length - 1
+            if e >= n:
+                break
+            first, last = route[s], route[e]
+            prev, nxt = route[s - 1], route[(e + 1) % n]
+
+            # Where the part may go without breaking the fixed order
+            lo, hi = 0, n
+            fixed_nrs = self.fixed[e + 1] - self.fixed[s]
+            if fixed_nrs:
+                ranks = [self.rank[nr] for nr in route[s:e + 1] if self.rank[nr] >= 0]
+                if ranks[0] > 0:
+                    lo = pos[self.order[ranks[0] - 1]]
+                if ranks[-1] + 1 < len(self.order):
+                    hi = pos[self.order[ranks[-1] + 1]]
+
+            removed = self.dist(prev, first) + self.dist(last, nxt) - self.dist(prev, nxt)
+            # The part is inserted between the positions p and p+1
+            candidates = [pos[nr] for nr in self.pred[first]] +\
+                [pos[nr] - 1 if pos[nr] > 0 else n - 1 for nr in self.succ[last]]
+            for p in candidates:
+                if s - 1 <= p <= e or not lo <= p < hi:
+                    continue
+                c, d = route[p], route[(p + 1) % n]
+                gain = removed + self.dist(c, d) - self.dist(c, first) - self.dist(last, d)
+                if gain > eps:
+                    part = route[s:e + 1]
+                    rest = route[:s] + route[e + 1:]
+                    at = p + 1 if p < s else p + 1 - length
+                    self.set_route(rest[:at] + part + rest[at:])
+                    self.activate(prev, nxt, first, last, c, d)
+                    return True
+        return False
@@ -27,10 +27,14 @@
 from __future__ import absolute_import
 from __future__ import division
 
-from random import random, shuffle
+from random import random
 from math import floor, ceil
+import time
+
+import numpy as np
 
 import dxf2gcode.globals.globals as g
+from dxf2gcode.postpro.gridindex import GridIndex
 
 import dxf2gcode.globals.constants as c
 from PyQt5 import QtCore
@@ -39,50 +43,142 @@ import logging
 logger = logging.getLogger("PostPro.TSP")
 
 
+def optimize_route(TSPs, iterations, max_time=0.0, max_stall_iterations=0,
+                   progress=None, interval=0.5):
+    """
+    Runs the iterations of a route optimization until their number is
+    reached, the time is up, the route has not become shorter for a number
+    of iterations or the route is accepted.
+    @param TSPs: The route optimization (TspOptimization, TspIslands or
+    TspLocalSearch)
+    @param iterations: The maximal number of iterations
+    @param max_time: The maximal time in seconds, 0 for no limit
+    @param max_stall_iterations: The number of iterations without a shorter
+    route after which the optimization stops, 0 for no limit
+    @param progress: Function which is called at most every interval seconds
+    with the optimization and True if the route has become shorter since the
+    last call. If it returns True the current route is accepted.
+    @param interval: The minimal time between two calls of progress
+    @return: The number of iterations done
+    """
+    start = time.time()
+    # When progress was called last, if the route has become shorter since
+    # and if the optimization has been stopped
+    state = {'progress': start, 'improved': False, 'iterations': 0, 'stopped': False}
+
+    def interrupted():
+        """
+        Checks if the time is up and calls progress at its interval.
+        @return: True if the optimization shall stop
+        """
+        now = time.time()
+        if state['stopped']:
+            return True
+        if max_time and now - start >= max_time:
+            logger.debug("TSP stopped after %0.1f s" % (now - start))
+            state['stopped'] = True
+        elif progress is not None and now - state['progress'] >= interval:
+            state['progress'] = now
+            improved, state['improved'] = state['improved'], False
+            if progress(TSPs, improved):
+                logger.debug("TSP route accepted after %i iterations" % state['iterations'])
+                state['stopped'] = True
+        return state['stopped']
+
+    # An iteration of the islands takes long, they check meanwhile
+    if hasattr(TSPs, 'interrupted'):
+        TSPs.interrupted = interrupted
+
+    best_length = TSPs.opt_length
+    stall_iterations = 0
+    it_nr = 0
+    while it_nr < iterations and not TSPs.converged:
+        TSPs.calc_next_iteration()
+        it_nr += 1
+        state['iterations'] = it_nr
+
+        if TSPs.opt_length < best_length:
+            best_length = TSPs.opt_length
+            stall_iterations = 0
+            state['improved'] = True
+        else:
+            stall_iterations += 1
+        if max_stall_iterations and stall_iterations >= max_stall_iterations:
+            logger.debug("TSP stopped after %i iterations without improvement" % stall_iterations)
+            break
+
+        if interrupted():
+            break
+    return it_nr
+
+
 class TspOptimization(object):
     """
     Optimization using the Travelling Salesman Problem (TSP) algorithim
     """
-    def __init__(self, st_end_points, order):
+    def __init__(self, st_end_points, order, params=None, DistanceMatrix=None, pop=None, route=None):
+        """
+        @param st_end_points: List of the start and end points of the shapes
+        @param order: List of the shapes which must keep their order
+        @param params: The Route_Optimisation settings to use instead of the
+        configuration (e.g. in another process)
+        @param DistanceMatrix: The DistanceMatrixClass of the points if it
+        has been generated already
+        @param pop: The routes to continue with instead of a new population
+        @param route: A route which replaces the first one of a new
+        population (e.g. a previous result)
+        """
+        if params is None:
+            params = g.config.vars.Route_Optimisation
         self.shape_nrs = len(st_end_points)
         self.iterations = int(self.shape_nrs) * 10
         self.pop_nr = min(int(ceil(self.shape_nrs / 8.0) * 8.0),
-                          g.config.vars.Route_Optimisation['max_population'])
-        self.mutate_rate = g.config.vars.Route_Optimisation['mutation_rate']
+                          params['max_population'])
+        self.mutate_rate = params['mutation_rate']
         self.opt_route = []
+        self.opt_length = float('inf')
         self.order = order
         self.st_end_points = st_end_points
+        # The genetic algorithm runs until it is stopped
+        self.converged = False
 
         # Generate the Distance Matrix
-        self.DistanceMatrix = DistanceMatrixClass()
-        self.DistanceMatrix.generate_matrix(st_end_points)
+        if DistanceMatrix is None:
+            DistanceMatrix = DistanceMatrixClass()
+            DistanceMatrix.generate_matrix(st_end_points)
+        self.DistanceMatrix = DistanceMatrix
 
         # Generation Population
         self.Population = PopulationClass([self.shape_nrs, self.pop_nr],
-                                          self.DistanceMatrix.matrix,
-                                          self.mutate_rate)
+                                          self.DistanceMatrix,
+                                          self.mutate_rate,
+                                          params['begin_art'], pop, self.order)
+        self.pop_nr = self.Population.size[1]
+        if route is not None:
+            self.Population.pop[0] = route
 
         # Initialise the Result Class
         self.Fittness = FittnessClass(self.Population,
-                                      list(range(self.Population.size[1])),
+                                      np.zeros(self.Population.size[1]),
                                       self.order)
-        self.Fittness.calc_st_fittness(self.DistanceMatrix.matrix,
-                                       range(self.shape_nrs))
+        self.Fittness.calc_st_fittness(self.DistanceMatrix,
+                                       np.arange(self.shape_nrs))
 
         # Anfang der Reihenfolge immer auf den letzen Punkt legen
         # Beginning of the sequence always put the last point ???
         self.Fittness.set_startpoint()
 
-        # Function to correct the order of the elements
+        # Function to correct the order of the elements. The genetic
+        # algorithm keeps the start point and the order afterwards.
         self.Fittness.correct_constrain_order()
 
         # logger.debug('Calculation of start fitness TSP: %s' %self)
         # logger.debug('Size Distance matrix: %s', len(self.DistanceMatrix.matrix))
         # Erstellen der ersten Ergebnisse
         # Create the first result
-        self.Fittness.calc_cur_fittness(self.DistanceMatrix.matrix)
+        self.Fittness.calc_cur_fittness(self.DistanceMatrix)
         self.Fittness.select_best_fittness()
-        self.opt_route = self.Population.pop[self.Fittness.best_route]
+        self.update_opt_route()
 
         # ERstellen der 2 opt Optimierungs Klasse
         # Create the 2 opt optimization class ???
@@ -100,22 +196,25 @@ class TspOptimization(object):
 #            #print ("Vorher: %0.2f" %self.calc_tour_length(tours[tour_nr]))
 #            self.Population.pop[pop_nr]=self.optmove.do2optmove(self.Population.pop[pop_nr])
 #            #print ("Nachher: %0.2f" %self.calc_tour_length(tours[tour_nr]))
-        # Anfang der Reihenfolge immer auf den letzen Punkt legen
-        # Always put the last point at the beginning of the sequence
-        self.Fittness.set_startpoint()
-        # Korrektur Funktion um die Reihenfolge der Elemente zu korrigieren
-        # Function to correct the order of the elements
-        self.Fittness.correct_constrain_order()
         # Fittness der jeweiligen Routen ausrechen
         # Calculate fitness of each route
-        self.Fittness.calc_cur_fittness(self.DistanceMatrix.matrix)
+        self.Fittness.calc_cur_fittness(self.DistanceMatrix)
         # Straffunktion falls die Route nicht der gewünschten Reihenfolge entspricht
         # Function if the route is not the desired sequence ???
         # Best route to choose
         self.Fittness.select_best_fittness()
-        self.opt_route = self.Population.pop[self.Fittness.best_route]
+        self.update_opt_route()
         # logger.debug('Calculation next iteration of TSP: %s' %self)
 
+    def update_opt_route(self):
+        """
+        Keeps the best route of the population if it is the shortest one so
+        far, since the best route of a generation might be lost in the next.
+        """
+        if self.Fittness.best_fittness[-1] < self.opt_length:
+            self.opt_length = float(self.Fittness.best_fittness[-1])
+            self.opt_route = self.Population.pop[self.Fittness.best_route].tolist()
+
     def __str__(self):
         #res = self.Population.pop
         return "Iteration nrs:    %i" % (self.iterations * 10) +\
@@ -124,29 +223,54 @@ class TspOptimization(object):
                "\nMutate rate:    %0.2f" % self.mutate_rate +\
                "\norder:          %s" % self.order +\
                "\nStart length:   %0.1f" % self.Fittness.best_fittness[0] +\
-               "\nOpt. length:    %0.1f" % self.Fittness.best_fittness[-1] +\
+               "\nOpt. length:    %0.1f" % self.opt_length +\
                "\nOpt. route:     %s" % self.opt_route
 
 class PopulationClass:
-    def __init__(self, size, dmatrix, mutate_rate):
+    """
+    The population of the genetic algorithm. Every row of the integer array
+    pop is one route.
+    """
+    # Number of nearest neighbours used to build heuristic routes
+    neighbours = 8
+
+    def __init__(self, size, DistanceMatrix, mutate_rate, begin_art=None, pop=None, order=()):
+        if begin_art is None:
+            begin_art = g.config.vars.Route_Optimisation['begin_art']
         self.size = size
         self.mutate_rate = mutate_rate
-        self.pop = []
         self.rot = []
 
-        # logger.debug('The Population size is: %s' %self.size)
+        # The rank of the shapes in the fixed order, -1 for free shapes
+        self.order = np.array(order, dtype=int)
+        self.rank = np.full(size[0], -1, dtype=int)
+        self.rank[self.order] = np.arange(len(self.order))
 
-        for pop_nr in range(self.size[1]):
-            # logger.debug("======= TSP initializing population nr %i =======" % pop_nr)
+        # logger.debug('The Population size is: %s' %self.size)
 
-            if g.config.vars.Route_Optimisation['begin_art'] == 'ordered':
-                self.pop.append(list(range(size[0])))
-            elif g.config.vars.Route_Optimisation['begin_art'] == 'random':
-                self.pop.append(self.random_begin(size[0]))
-            elif g.config.vars.Route_Optimisation['begin_art'] == 'heuristic':
-                self.pop.append(self.heuristic_begin(dmatrix[:]))
-            else:
-                logger.error(self.tr('Wrong begin art of TSP chosen'))
+        if pop is not None:
+            # Continue with given routes
+            self.pop = np.array(pop, dtype=int)
+            self.size = [self.pop.shape[1], self.pop.shape[0]]
+        else:
+            self.pop = np.zeros((self.size[1], self.size[0]), dtype=int)
+            for pop_nr in range(self.size[1]):
+                # logger.debug("======= TSP initializing population nr %i =======" % pop_nr)
+
+                if begin_art == 'ordered':
+                    self.pop[pop_nr] = np.arange(size[0])
+                elif begin_art == 'random':
+                    self.pop[pop_nr] = self.random_begin(size[0])
+                elif begin_art == 'heuristic':
+                    self.pop[pop_nr] = self.heuristic_begin(DistanceMatrix)
+                elif begin_art == 'greedy':
+                    # One greedy route, the others stay different
+                    if pop_nr == 0:
+                        self.pop[pop_nr] = self.greedy_begin(DistanceMatrix)
+                    else:
+                        self.pop[pop_nr] = self.heuristic_begin(DistanceMatrix)
+                else:
+                    logger.error(self.tr('Wrong begin art of TSP chosen'))
 
         for rot_nr in range(size[0]):
             self.rot.append(0)
@@ -156,7 +280,7 @@ class PopulationClass:
                  % (self.size[0], self.size[1], self.mutate_rate, self.rot)
 
         for line in self.pop:
-            string += '\n' + str(line)
+            string += '\n' + str(line.tolist())
         return string
 
     def tr(self, string_to_translate):
@@ -172,171 +296,323 @@ class PopulationClass:
         """
         random_begin for TSP
         """
-        tour = list(range(size))
-        shuffle(tour)
-        return tour
+        return np.random.permutation(size)
 
-    def heuristic_begin(self, dmatrix):
+    def heuristic_begin(self, DistanceMatrix):
+        """
+        Builds a nearest neighbour route starting at a random shape. The next
+        shape is the first one of the nearest neighbours of the current shape
+        which is not in the route yet. Only if all of them are, a grid index
+        over the start points of the remaining shapes is searched.
+        @param DistanceMatrix: The DistanceMatrixClass of the shapes
+        @return: The route as array of the shape numbers
+        """
+        size = len(DistanceMatrix.starts)
+        neighbours = DistanceMatrix.nearest_neighbours(self.neighbours).tolist()
+        index = GridIndex(DistanceMatrix.starts)
+        visited = [False] * size
+        # The shapes in the route which are still in the index
+        pending = []
+
+        tour = [int(floor(random()*size))]
+        while len(tour) < size:
+            nr = tour[-1]
+            visited[nr] = True
+            pending.append(nr)
+            nxt = -1
+            for nb in neighbours[nr]:
+                if nb >= 0 and not visited[nb]:
+                    nxt = nb
+                    break
+            if nxt < 0:
+                index.remove(pending)
+                pending = []
+                nxt = index.nearest(*DistanceMatrix.ends[nr])
+            tour.append(nxt)
+        return np.array(tour, dtype=int)
+
+    def greedy_begin(self, DistanceMatrix):
         """
-        heuristic_begin for TSP
+        Builds a route of the shortest connections: the connections to the
+        nearest neighbours are added by increasing length, unless a shape
+        would get a second successor or predecessor or a cycle would be
+        closed. The resulting paths are joined, each continuing with the
+        nearest start of the remaining paths.
+        @param DistanceMatrix: The DistanceMatrixClass of the shapes
+        @return: The route as array of the shape numbers
         """
+        size = len(DistanceMatrix.starts)
+        starts, ends = DistanceMatrix.starts, DistanceMatrix.ends
+        neighbours = DistanceMatrix.nearest_neighbours(self.neighbours)
+        rows = np.repeat(np.arange(size), neighbours.shape[1])
+        cols = neighbours.ravel()
+        valid = cols >= 0
+        rows, cols = rows[valid], cols[valid]
+        lengths = np.hypot(*(starts[cols] - ends[rows]).T)
+
+        succ = [-1] * size
+        pred = [-1] * size
+        # The first shape of the path of every shape (union find)
+        head = list(range(size))
+
+        def find(nr):
+            while head[nr] != nr:
+                head[nr] = head[head[nr]]
+                nr = head[nr]
+            return nr
+
+        for edge_nr in np.argsort(lengths, kind='stable').tolist():
+            nr1, nr2 = int(rows[edge_nr]), int(cols[edge_nr])
+            if succ[nr1] < 0 and pred[nr2] < 0:
+                root1, root2 = find(nr1), find(nr2)
+                if root1 != root2:
+                    succ[nr1] = nr2
+                    pred[nr2] = nr1
+                    head[root2] = root1
+
+        # Join the paths, indexing them by their first shape
+        firsts = [nr for nr in range(size) if pred[nr] < 0]
+        index = GridIndex(starts[firsts])
         tour = []
-        possibilities = list(range(len(dmatrix[0])))
-        start_nr = int(floor(random()*len(dmatrix[0])))
-
-        # Hinzufügen der Nr und entfernen aus possibilies
-        # Add and remove the number of possibilities
-        tour.append(start_nr)
-        possibilities.pop(possibilities.index(tour[-1]))
-        counter = 0
-
-        while len(possibilities):
-            counter += 1
-            tour.append(self.heuristic_find_next(tour[-1], possibilities, dmatrix))
-            possibilities.pop(possibilities.index(tour[-1]))
+        path_nr = 0
+        while path_nr >= 0:
+            index.remove([path_nr])
+            nr = firsts[path_nr]
+            while nr >= 0:
+                tour.append(nr)
+                nr = succ[nr]
+            path_nr = index.nearest(*ends[tour[-1]])
+        return np.array(tour, dtype=int)
+
+    def random_indices(self):
+        """
+        Returns two random positions in a route, sorted. The start point at
+        position 0 is never chosen.
+        """
+        indx = [1 + int(floor(random()*(self.size[0] - 1))), 1 + int(floor(random()*(self.size[0] - 1)))]
+        indx.sort()
+        return indx
 
-            # if counter % 10 == 0:
-            #     logger.debug("TSP heuristic searching nr %i" % counter)
-        return tour
+    def fixed_positions(self, pop):
+        """
+        Returns the positions of the shapes with a fixed order in every
+        route. They are ascending, since the routes keep the order.
+        @param pop: The routes
+        @return: Array (routes x fixed shapes) of the positions
+        """
+        positions = np.empty_like(pop)
+        positions[np.arange(len(pop))[:, np.newaxis], pop] = np.arange(pop.shape[1])
+        return positions[:, self.order]
 
-    def heuristic_find_next(self, start, possibilities, dmatrix):
+    def segment_indices(self, fixed_pos):
         """
-        heuristic_find_next() for TSP
+        Returns the first and last position of a random part of a route
+        which holds at most one shape with a fixed order. Reversing the part
+        or swapping its ends keeps the order of the shapes.
+        @param fixed_pos: The positions of the fixed shapes in the route
+        @return: The sorted positions, equal if the part is a single shape
         """
-        # Auswahl der Entfernungen des nächsten Punkts
-        # The distances of the point selection
-        min_dist = 1e99
-        darray = dmatrix[start]
+        first = 1 + int(floor(random()*(self.size[0] - 1)))
+        # The second fixed shape from the first position on ends the part
+        nr = int(np.searchsorted(fixed_pos, first)) + 1
+        last = fixed_pos[nr] - 1 if nr < len(fixed_pos) else self.size[0] - 1
+        return [first, first + int(floor(random()*(last - first + 1)))]
 
-        for pnr in possibilities:
-            if darray[pnr] < min_dist:
-                min_point = pnr
-                min_dist = darray[pnr]
-        return min_point
+    def insert_index(self, fixed_pos, gens_fixed):
+        """
+        Returns a random position in a route at which genes may be inserted
+        without breaking the order: after the fixed shape preceding the
+        fixed shapes of the genes and before the one following them.
+        @param fixed_pos: The positions of the fixed shapes in the route
+        @param gens_fixed: The first and last rank of the fixed shapes within
+        the genes; the first is greater if there are none
+        @return: The position, at least 1 so the start point stays first
+        """
+        lo = 1
+        hi = self.size[0]
+        if gens_fixed[0] <= gens_fixed[1]:
+            if gens_fixed[0] > 0:
+                lo = fixed_pos[gens_fixed[0] - 1] + 1
+            if gens_fixed[1] + 1 < len(fixed_pos):
+                hi = fixed_pos[gens_fixed[1] + 1]
+        return lo + int(floor(random()*(hi - lo + 1)))
 
     def genetic_algorithm(self, Result, mutate_rate):
         """
         genetic_algorithm for TSP
         """
         self.mutate_rate = mutate_rate
+        half = self.size[1] // 2
+        quarter = self.size[1] // 4
 
         # Neue Population Matrix erstellen
         # Create new Population Matrix
-        new_pop = []
-        for p_nr in range(self.size[1]):
-            new_pop.append([])
+        new_pop = self.pop.copy()
 
         # Tournament Selection 1 between Parents (2 Parents remaining)
-        ts_r1 = list(range(self.size[1]))
-        shuffle(ts_r1)
-        winners_r1 = []
-        tmp_fittness = []
-        for nr in range(self.size[1] // 2):
-            if Result.cur_fittness[ts_r1[nr * 2]] < Result.cur_fittness[ts_r1[(nr * 2) + 1]]:
-                winners_r1.append(self.pop[ts_r1[nr * 2]])
-                tmp_fittness.append(Result.cur_fittness[ts_r1[nr * 2]])
-            else:
-                winners_r1.append(self.pop[ts_r1[(nr * 2) + 1]])
-                tmp_fittness.append(Result.cur_fittness[ts_r1[(nr * 2) + 1]])
-        # print(tmp_fittness)
+        ts_r1 = np.random.permutation(self.size[1])[:half * 2].reshape(-1, 2)
+        winners_r1 = np.where(Result.cur_fittness[ts_r1[:, 0]] < Result.cur_fittness[ts_r1[:, 1]],
+                              ts_r1[:, 0], ts_r1[:, 1])
+        tmp_fittness = Result.cur_fittness[winners_r1]
 
         # Tournament Selection 2 only one Parent remaining
-        ts_r2 = list(range(self.size[1] // 2))
-        shuffle(ts_r2)
-        for nr in range(self.size[1] // 4):
-            if tmp_fittness[ts_r2[nr * 2]] < tmp_fittness[ts_r2[(nr * 2) + 1]]:
-                winner = winners_r1[ts_r2[nr * 2]]
-            else:
-                winner = winners_r1[ts_r2[(nr * 2) + 1]]
-
-            # Schreiben der Gewinner in die neue Population Matrix
-            # print(winner)
-            for pnr in range(2):
-                new_pop[pnr * self.size[1] // 2 + nr] = winner[:]
+        ts_r2 = np.random.permutation(half)[:quarter * 2].reshape(-1, 2)
+        winners_r2 = np.where(tmp_fittness[ts_r2[:, 0]] < tmp_fittness[ts_r2[:, 1]],
+                              winners_r1[ts_r2[:, 0]], winners_r1[ts_r2[:, 1]])
+
+        # Schreiben der Gewinner in die neue Population Matrix
+        for pnr in range(2):
+            new_pop[pnr * half:pnr * half + quarter] = self.pop[winners_r2]
+
+        # The operators keep the start point first and the fixed shapes in
+        # their order, so no route has to be corrected afterwards
+        fixed_pos = self.fixed_positions(self.pop)
 
         # Crossover Gens from 2 Parents
-        crossover = list(range(self.size[1] // 2))
-        shuffle(crossover)
-        for nr in range(self.size[1] // 4):
+        crossover = np.random.permutation(half)
+        for nr in range(quarter):
             # child = parent2
             # Parents are the winners of the first round (Genetic Selection?)
-            parent1 = winners_r1[crossover[nr * 2]][:]
-            child = winners_r1[crossover[(nr * 2) + 1]][:]
+            parent1_nr = winners_r1[crossover[nr * 2]]
+            child_nr = winners_r1[crossover[(nr * 2) + 1]]
+            parent1 = self.pop[parent1_nr]
+            child = self.pop[child_nr]
 
             # The genetic line that is exchanged in the child parent1
-            indx = [int(floor(random()*self.size[0])), int(floor(random()*self.size[0]))]
-            indx.sort()
-            while indx[0] == indx[1]:
-                indx = [int(floor(random()*self.size[0])), int(floor(random()*self.size[0]))]
-                indx.sort()
+            indx = self.random_indices()
             gens = parent1[indx[0]:indx[1] + 1]
+            # The ranks of the fixed shapes within the genes
+            gens_fixed = [int(np.searchsorted(fixed_pos[parent1_nr], indx[0])),
+                          int(np.searchsorted(fixed_pos[parent1_nr], indx[1], 'right')) - 1]
 
             # Remove the exchanged genes
-            for gen in gens:
-                child.pop(child.index(gen))
+            keep = ~np.isin(child, gens)
 
-            # Insert the new genes at a random position
-            ins_indx = int(floor(random()*self.size[0]))
-            new_children = child[0:ins_indx] + gens + child[ins_indx:len(child)]
+            # Insert the new genes at a random position between the
+            # neighbours of their fixed shapes
+            ins_indx = self.insert_index(fixed_pos[child_nr], gens_fixed)
+            ins_indx = int(np.count_nonzero(keep[:ins_indx]))
+            child = child[keep]
+            new_children = np.concatenate((child[:ins_indx], gens, child[ins_indx:]))
 
             # Write the new children in the new population matrix
             for pnr in range(2):
-                new_pop[int((pnr + 0.5) * self.size[1] / 2 + nr)] = new_children[:]
+                new_pop[int((pnr + 0.5) * self.size[1] / 2 + nr)] = new_children
 
         # Mutate the 2nd half of the population matrix
-        mutate = list(range(self.size[1] // 2))
-        shuffle(mutate)
+        mutate = np.random.permutation(half)
         num_mutations = int(round(mutate_rate * self.size[1] / 2))
+        fixed_pos = self.fixed_positions(new_pop)
         for nr in range(num_mutations):
             # The genetic line that is exchanged in the child parent1 ???
-            indx = [int(floor(random()*self.size[0])), int(floor(random()*self.size[0]))]
-            indx.sort()
-            while indx[0] == indx[1]:
-                indx = [int(floor(random()*self.size[0])), int(floor(random()*self.size[0]))]
-                indx.sort()
+            indx = self.segment_indices(fixed_pos[half + mutate[nr]])
 
             # Zu mutierende Line
             # Line to be mutated ????
-            mutline = new_pop[self.size[1] // 2 + mutate[nr]]
+            mutline = new_pop[half + mutate[nr]]
             if random() < 0.75:  # Gen Abschnitt umdrehen / Turn gene segment
-                cut = mutline[indx[0]:indx[1] + 1]
-                cut.reverse()
-                mutline = mutline[0:indx[0]] + cut + mutline[indx[1] + 1:len(mutline)]
+                mutline[indx[0]:indx[1] + 1] = mutline[indx[0]:indx[1] + 1][::-1].copy()
             else:  # 2 Gene tauschen / 2 Gene exchange
-                orgline = mutline[:]
-                mutline[indx[0]] = orgline[indx[1]]
-                mutline[indx[1]] = orgline[indx[0]]
-            new_pop[self.size[1] // 2 + mutate[nr]] = mutline
+                mutline[indx] = mutline[indx[::-1]]
 
         # Assign the new population matrix
         self.pop = new_pop
 
 class DistanceMatrixClass:
     """
-    DistanceMatrixClass
+    DistanceMatrixClass. The distances between the shapes are not stored as
+    a full matrix, which would need memory proportional to the square of the
+    number of shapes. Only the start and end points are kept; distances are
+    computed on demand and the candidates of the optimizers are taken from
+    the lists of the nearest neighbours, so the memory grows with the number
+    of shapes times the number of neighbours.
     """
     def __init__(self):
-        self.matrix = []
         self.size = [0, 0]
+        self.starts = np.zeros((0, 2))
+        self.ends = np.zeros((0, 2))
+        self.neighbours = {}
+        self.predecessors = {}
 
     def __str__(self):
         string = ("Distance Matrix; size: %i X %i" % (self.size[0], self.size[1]))
-        for line_x in self.matrix:
+        for nr in range(self.size[0]):
             string += "\n"
-            for x_vals in line_x:
+            for x_vals in self.distances(nr, np.arange(self.size[1])):
                 string += "%8.2f" % x_vals
         return string
 
     def generate_matrix(self, st_end_points):
-        self.matrix = [[st_end_y[1].distance(st_end_x[0]) for st_end_x in st_end_points]
-                       for st_end_y in st_end_points]
+        """
+        Stores the start and end points of the shapes the distances are
+        computed from.
+        @param st_end_points: List of the start and end points of the shapes
+        """
+        starts = np.array([[st_end[0].x, st_end[0].y] for st_end in st_end_points], dtype=float)
+        ends = np.array([[st_end[1].x, st_end[1].y] for st_end in st_end_points], dtype=float)
         self.size = [len(st_end_points), len(st_end_points)]
+        self.starts = starts.reshape(-1, 2)
+        self.ends = ends.reshape(-1, 2)
+        self.neighbours = {}
+        self.predecessors = {}
+
+    def distances(self, from_nrs, to_nrs):
+        """
+        Computes the distances from the end of shapes to the start of shapes.
+        The shape numbers are broadcast against each other like NumPy arrays.
+        @param from_nrs: The number(s) of the shapes the moves begin at
+        @param to_nrs: The number(s) of the shapes the moves end at
+        @return: Array of the distances in the broadcast shape
+        """
+        delta = self.ends[from_nrs] - self.starts[to_nrs]
+        return np.hypot(delta[..., 0], delta[..., 1])
+
+    def nearest_neighbours(self, k):
+        """
+        Returns the k shapes whose start points are nearest to the end point
+        of every shape, found with a grid index over the start points.
+        @param k: The number of neighbours per shape
+        @return: Array (shapes x k) of the shape numbers sorted by their
+        distance, padded with -1 if there are less than k other shapes
+        """
+        if k not in self.neighbours:
+            self.neighbours[k] = nearest_others(self.starts, self.ends, k)
+        return self.neighbours[k]
+
+    def nearest_predecessors(self, k):
+        """
+        Returns the k shapes whose end points are nearest to the start point
+        of every shape, found with a grid index over the end points.
+        @param k: The number of predecessors per shape
+        @return: Array (shapes x k) of the shape numbers sorted by their
+        distance, padded with -1 if there are less than k other shapes
+        """
+        if k not in self.predecessors:
+            self.predecessors[k] = nearest_others(self.ends, self.starts, k)
+        return self.predecessors[k]
+
+
+def nearest_others(points, queries, k):
+    """
+    Finds the k points nearest to every query point; the point with the
+    number of the query itself is left out.
+    @param points: Array (n x 2) of the points to search
+    @param queries: Array (n x 2) of the query points
+    @param k: The number of points per query
+    @return: Array (n x k) of the point numbers sorted by their distance,
+    padded with -1
+    """
+    nearest = GridIndex(points, per_cell=k + 1).k_nearest(queries, k + 1)
+    # Move the point of the query itself to the end and drop it
+    itself = nearest == np.arange(len(queries))[:, np.newaxis]
+    nearest = np.take_along_axis(nearest, np.argsort(itself, axis=1, kind='stable'), axis=1)
+    return nearest[:, :k]
 
 class FittnessClass:
     def __init__(self, population, cur_fittness, order):
         self.population = population
         self.cur_fittness = cur_fittness
-        self.order = order
+        self.order = np.array(order, dtype=int)
         self.best_fittness = []
         self.best_route = []
 
@@ -344,25 +620,13 @@ class FittnessClass:
         return "\nBest Fittness: %s \nBest Route: %s \nBest Pop: %s"\
                % (self.best_fittness[-1], self.best_route, self.population.pop[self.best_route])
 
-    def calc_st_fittness(self, matrix, st_pop):
-        dis = matrix[st_pop[-1]][st_pop[0]]
-        for nr in range(1, len(st_pop)):
-            dis += matrix[st_pop[nr - 1]][st_pop[nr]]
-
-        self.best_fittness.append(dis)
-
-    def calc_cur_fittness(self, matrix):
-        # logger.debug("Calculating current fittness len(self.population.pop): %s"
-        #              % len(self.population.pop))
-        # logger.debug("Length of self.cur_fittness: %s" %(len(self.cur_fittness)))
+    def calc_st_fittness(self, DistanceMatrix, st_pop):
+        self.best_fittness.append(DistanceMatrix.distances(st_pop, np.roll(st_pop, -1)).sum())
 
-        for pop_nr in range(len(self.population.pop)):
-            pop = self.population.pop[pop_nr]
-            # logger.debug("pop_nr: %s" %pop_nr)
-            dis = matrix[pop[-1]][pop[0]]
-            for nr in range(1, len(pop)):
-                dis += matrix[pop[nr - 1]][pop[nr]]
-            self.cur_fittness[pop_nr] = dis
+    def calc_cur_fittness(self, DistanceMatrix):
+        # The lengths of all routes including the way back to the start
+        pop = self.population.pop
+        self.cur_fittness = DistanceMatrix.distances(pop, np.roll(pop, -1, axis=1)).sum(axis=1)
 
     # 2te Möglichkeit die Reihenfolge festzulegen (Korrekturfunktion=Aktiv)
     # Second option set the order (correction function = Active)
@@ -371,28 +635,26 @@ class FittnessClass:
         in begin this might be the best place to change it. Maybe we can also have
         an additional option in the config file?"""
 
-        for pop in self.population.pop:
-            # Search the current order
-            order_index = self.get_pop_index_list(pop)
-            # Momentane Reihenfolge der indexe sortieren
-            # Current sort order of the index ???
-            order_index.sort()
-            # Indices according to correct order
-            for ind_nr in range(len(order_index)):
-                pop[order_index[ind_nr]] = self.order[ind_nr]
+        if len(self.order) == 0:
+            return
+        pop = self.population.pop
+        # Search the current order and sort the indices of every route
+        order_index = np.sort(self.get_pop_index_list(pop), axis=1)
+        # Indices according to correct order
+        pop[np.arange(len(pop))[:, np.newaxis], order_index] = self.order
 
     def set_startpoint(self):
-        n_pts = len(self.population.pop[-1])
-        for pop in self.population.pop:
-            st_pt_nr = pop.index(n_pts - 1)
-            # 99% of the time we don't have to reorder the arrays
-            if st_pt_nr > 0:
-                # Contour with the starting point at the beginning
-                pop[:] = pop[st_pt_nr:n_pts] + pop[0:st_pt_nr]
+        pop = self.population.pop
+        n_pts = pop.shape[1]
+        # Contour with the starting point at the beginning
+        st_pt_nr = np.argmax(pop == n_pts - 1, axis=1)
+        pop[:] = pop[np.arange(len(pop))[:, np.newaxis],
+                     (np.arange(n_pts) + st_pt_nr[:, np.newaxis]) % n_pts]
 
     def get_pop_index_list(self, pop):
-        return [pop.index(order) for order in self.order]
+        # The positions of the shapes in every route
+        return np.argsort(pop, axis=1)[:, self.order]
 
     def select_best_fittness(self):
-        self.best_fittness.append(min(self.cur_fittness))
-        self.best_route = self.cur_fittness.index(self.best_fittness[-1])
+        self.best_route = int(np.argmin(self.cur_fittness))
+        self.best_fittness.append(self.cur_fittness[self.best_route])
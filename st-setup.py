@@ -77,7 +77,8 @@ setup(
     install_requires=[
         'configobj',
         'PyQt5',
-        'PyOpenGL'
+        'PyOpenGL',
+        'numpy'
     ],
 
     include_package_data=True,